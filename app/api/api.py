@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
-from api.endpoints import chats
+from api.endpoints import chats, health
 
 api_router = APIRouter()
 api_router.include_router(chats.router, prefix="/api/v1", tags=["CHATBOT API v1"])
+api_router.include_router(health.router, tags=["health"])
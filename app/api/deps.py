@@ -1,9 +1,22 @@
-from fastapi import Request
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from fastapi import Request, HTTPException
 from service.conversation_manager import ConversationManager
-from service.chat import ChatService
+from service.limits import AdmissionController
+
+if TYPE_CHECKING:
+    # service.chat は llama_index 等の読み込みが重いため、STARTUP_MODE=lazy の起動を遅らせないよう実行時には読み込まない
+    from service.chat import ChatService
 
 def get_manager(request: Request) -> ConversationManager:
     return request.app.state.manager
 
+def get_admission(request: Request) -> AdmissionController:
+    return request.app.state.admission
+
 def get_chat_service(request: Request) -> ChatService:
-    return request.app.state.chat_service
+    chat_service = request.app.state.chat_service
+    if chat_service is None:
+        # STARTUP_MODE=lazy で初期化が終わっていない
+        raise HTTPException(status_code=503, detail="Chat service is starting up", headers={"Retry-After": "5"})
+    return chat_service
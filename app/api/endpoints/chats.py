@@ -1,34 +1,220 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from api.deps import get_manager, get_chat_service
+from __future__ import annotations
+import os
+import json
+import asyncio
+import weakref
+from typing import TYPE_CHECKING
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from api.deps import get_manager, get_chat_service, get_admission
 from service.conversation_manager import ConversationManager
-from service.chat import ChatService
+from service.limits import (
+    AdmissionController, AdmissionLease, AdmissionRejected, StageTimeout, ClientDisconnected,
+    cancel_on_disconnect, iterate_until_disconnect,
+)
+from service.metrics import CLIENT_DISCONNECTS
+
+if TYPE_CHECKING:
+    from service.chat import ChatService
 
 router = APIRouter()
 
+# nginx と同じく、クライアントが先に切断したリクエストは 499 として記録する
+CLIENT_CLOSED_REQUEST = 499
+# /create/chat/batch で1回に受け付ける質問数の上限
+BATCH_MAX_QUERIES = int(os.getenv("CHAT_BATCH_MAX_QUERIES", "1000"))
+
 @router.get("/create/session")
 async def create_session(manager: ConversationManager=Depends(get_manager)) -> dict:
     """
     ユーザーの会話セッションを作成し、セッションIDを返す関数
     """
     try:
-        session_id = manager.generate_sequential_session_id()
+        session_id = await manager.generate_sequential_session_id()
         return {"session_id": session_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create session: {e}")
 
+@router.get("/sessions/stats")
+async def session_stats(manager: ConversationManager=Depends(get_manager)) -> dict:
+    """
+    アクティブなセッション数と使用メモリ量を返す関数
+    """
+    try:
+        return await manager.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get session stats: {e}")
+
+@router.get("/chat/stats")
+async def chat_stats(chat_service: ChatService=Depends(get_chat_service), admission: AdmissionController=Depends(get_admission)) -> dict:
+    """
+    まとめられた同時リクエスト数やキャッシュのヒット数、同時実行数の制限の状況を返す関数
+    """
+    return {**chat_service.stats(), "admission": admission.stats()}
+
+async def _wait_disconnect(request: Request) -> None:
+    """
+    クライアントが切断するまで待つ関数（リクエストボディは読み終えているため、次に届くのは切断の通知のみ）
+    Request.is_disconnected() は BaseHTTPMiddleware の下では切断を検知できないため、受信を待ち続ける
+    """
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _admit(admission: AdmissionController, slots: int = 1) -> AdmissionLease:
+    """
+    チャットの実行枠を slots 個取得する関数（空きがなければ 429 と Retry-After を返す）
+    """
+    try:
+        return await admission.acquire(slots)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=f"Too many requests: {e.reason}", headers={"Retry-After": str(e.retry_after)})
+
 class QueryRequest(BaseModel):
     session_id: str
     query: str
+    # False にすると回答キャッシュを使わずに必ず新しく回答を生成する
+    use_cache: bool = True
 
 @router.post("/create/chat")
-async def create_query(request: QueryRequest, chat_service: ChatService=Depends(get_chat_service)) -> dict:
+async def create_query(
+    request: QueryRequest,
+    http_request: Request,
+    chat_service: ChatService=Depends(get_chat_service),
+    admission: AdmissionController=Depends(get_admission),
+):
     """
     ユーザーの質問を受け取り、回答を生成する関数
     """
-    try:
-        response = await chat_service.handle_query(session_id=request.session_id, query=request.query)
+    async with await _admit(admission):
+        try:
+            response = await cancel_on_disconnect(
+                lambda: _wait_disconnect(http_request),
+                chat_service.handle_query(session_id=request.session_id, query=request.query, use_cache=request.use_cache),
+            )
 
-        return {"response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to create chat: {e}")
+            return {"response": response}
+        except ClientDisconnected:
+            CLIENT_DISCONNECTS.inc(endpoint="chat")
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        except StageTimeout as e:
+            raise HTTPException(status_code=504, detail=f"Failed to create chat: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to create chat: {e}")
+
+
+def _sse_event(data: dict, event: str | None = None) -> str:
+    """
+    Server-Sent Events 形式の1イベント分の文字列を組み立てる関数
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/create/chat/stream")
+async def create_query_stream(
+    request: QueryRequest,
+    http_request: Request,
+    chat_service: ChatService=Depends(get_chat_service),
+    admission: AdmissionController=Depends(get_admission),
+) -> StreamingResponse:
+    """
+    ユーザーの質問を受け取り、生成されたトークンを Server-Sent Events で逐次返す関数
+    """
+    # 429 を返せるよう、ストリームを始める前に実行枠を取得する
+    lease = await _admit(admission)
+
+    async def event_stream():
+        chunks = []
+        try:
+            deltas = chat_service.handle_query_stream(session_id=request.session_id, query=request.query, use_cache=request.use_cache)
+            async for delta in iterate_until_disconnect(lambda: _wait_disconnect(http_request), deltas):
+                chunks.append(delta)
+                yield _sse_event({"delta": delta})
+            yield _sse_event({"response": "".join(chunks).strip()}, event="done")
+        except ClientDisconnected:
+            CLIENT_DISCONNECTS.inc(endpoint="chat_stream")
+        except asyncio.CancelledError:
+            # サーバーが切断を先に検知した場合は、ストリームの生成ごとキャンセルされる
+            CLIENT_DISCONNECTS.inc(endpoint="chat_stream")
+            raise
+        except Exception as e:
+            print("error", e)
+            yield _sse_event({"detail": f"Failed to create chat: {e}"}, event="error")
+        finally:
+            lease.release()
+
+    stream = event_stream()
+    # ストリームが始まる前に切断された場合は finally が実行されないため、ストリームの破棄時にも枠を返す
+    weakref.finalize(stream, lease.release)
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(lease.release),
+    )
+
+
+class BatchQueryItem(BaseModel):
+    query: str
+    # 指定した場合はそのセッションの会話履歴を使って回答し、履歴に保存する（未指定なら履歴なしの1問として扱う）
+    session_id: str | None = None
+
+class BatchQueryRequest(BaseModel):
+    queries: list[BatchQueryItem] = Field(min_length=1, max_length=BATCH_MAX_QUERIES)
+    use_cache: bool = True
+    # 回答を同時に生成する件数（未指定なら CHAT_BATCH_CONCURRENCY、CHAT_MAX_CONCURRENT を超えない）
+    concurrency: int | None = Field(default=None, ge=1)
+
+@router.post("/create/chat/batch")
+async def create_query_batch(
+    request: BatchQueryRequest,
+    http_request: Request,
+    chat_service: ChatService=Depends(get_chat_service),
+    admission: AdmissionController=Depends(get_admission),
+) -> StreamingResponse:
+    """
+    複数の質問を受け取り、回答ができた順に Server-Sent Events で返す関数
+    埋め込みと検索は複数の質問をまとめて行い、回答は concurrency 件ずつ同時に生成する
+    各質問の結果は result イベント（index は queries 内の位置）で返し、最後に done イベントで件数を返す
+    """
+    # 同時に生成する件数分の実行枠を取得し、単発のチャットと同じ上限の中で処理する
+    concurrency = min(request.concurrency or chat_service.batch_concurrency, len(request.queries), admission.max_concurrent)
+    lease = await _admit(admission, concurrency)
+    release = lease.release
+
+    async def event_stream():
+        completed = failed = 0
+        try:
+            results = chat_service.handle_batch(
+                [(item.session_id, item.query) for item in request.queries], use_cache=request.use_cache, concurrency=concurrency,
+            )
+            async for index, result in iterate_until_disconnect(lambda: _wait_disconnect(http_request), results):
+                data = {"index": index, "session_id": request.queries[index].session_id}
+                if isinstance(result, Exception):
+                    failed += 1
+                    data.update(detail=f"Failed to create chat: {result}", status=504 if isinstance(result, StageTimeout) else 500)
+                else:
+                    completed += 1
+                    data["response"] = result
+                yield _sse_event(data, event="result")
+            yield _sse_event({"completed": completed, "failed": failed}, event="done")
+        except ClientDisconnected:
+            CLIENT_DISCONNECTS.inc(endpoint="chat_batch")
+        except asyncio.CancelledError:
+            CLIENT_DISCONNECTS.inc(endpoint="chat_batch")
+            raise
+        except Exception as e:
+            print("error", e)
+            yield _sse_event({"detail": f"Failed to create chat batch: {e}"}, event="error")
+        finally:
+            release()
+
+    stream = event_stream()
+    weakref.finalize(stream, release)
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+@router.get("/healthz/live")
+async def liveness(request: Request) -> JSONResponse:
+    """
+    プロセスが応答できるかを返す関数（初期化に失敗した場合のみ 503 を返し、再起動させる）
+    """
+    startup = request.app.state.startup
+    if startup.error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": startup.error})
+    return JSONResponse(content={"status": "alive"})
+
+@router.get("/healthz/ready")
+async def readiness(request: Request) -> JSONResponse:
+    """
+    チャットを受け付けられるか（ChatService の初期化が終わり、Redis に接続できるか）と起動時間を返す関数
+    """
+    status = request.app.state.startup.status()
+    if status["ready"]:
+        try:
+            await request.app.state.redis_client.ping()
+        except Exception as e:
+            status["ready"] = False
+            status["error"] = f"Redis ping failed: {e}"
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
@@ -1,29 +1,88 @@
+import time
+# 起動時間の計測の基準（このモジュールの読み込み開始時点）
+_import_started_at = time.perf_counter()
+
+import os
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import uvicorn
-import redis
+import redis.asyncio as redis
 from dotenv import load_dotenv
-from service.chat import get_chat_service
 from service.conversation_manager import ConversationManager
 from api.api import api_router
+from service.metrics import REGISTRY, REQUEST_SECONDS, start_request_timings, server_timing_header
+from service.startup import StartupState
+from service.limits import AdmissionController
+from service.static_images import ImageStaticFiles
 
 load_dotenv()
 
+# eager: 起動時に ChatService を作り終えてから受け付ける / lazy: 先に起動し、ChatService はバックグラウンドで作る
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+
 chat_service = None
 manager = None
+redis_pool = None
 redis_client = None
+warmup_task = None
+startup = StartupState(STARTUP_MODE, started_at=_import_started_at)
+# チャットの同時実行数の上限と、上限に達したときに待たせる件数・秒数（超えたリクエストは 429 で断る）
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "32")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "2")),
+    retry_after=int(os.getenv("CHAT_RETRY_AFTER_SECONDS", "1")),
+)
+startup.record("import_app", time.perf_counter() - _import_started_at)
+
+
+def _build_chat_service():
+    """
+    llama_index・google-genai の読み込みと ChatService の作成を行う関数（重いため lazy ではスレッドで実行する）
+    """
+    with startup.phase("import_chat"):
+        from service.chat import get_chat_service
+    with startup.phase("chat_service"):
+        return get_chat_service(manager, cache_redis_client=redis_client)
+
+
+async def _warm_up(app: FastAPI) -> None:
+    """
+    ChatService をバックグラウンドで作成し、完了したら準備完了にする関数
+    """
+    global chat_service
+    try:
+        chat_service = await asyncio.to_thread(_build_chat_service)
+    except Exception as e:
+        startup.mark_failed(e)
+        print(f"❌ ChatService初期化失敗: {e}")
+        return
+    app.state.chat_service = chat_service
+    print("✅ ChatService初期化完了")
+    startup.mark_ready()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
-    global chat_service, manager, redis_client
-    print("🚀 アプリケーションの起動中...")
+    global chat_service, manager, redis_pool, redis_client, warmup_task
+    print(f"🚀 アプリケーションの起動中... (STARTUP_MODE={STARTUP_MODE})")
+    app.state.startup = startup
+    app.state.admission = admission
+    app.state.chat_service = None
     try:
         # Redisの接続設定
-        redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True, max_connections=10 )
-        if not redis_client.ping():
+        # 会話履歴と埋め込みキャッシュ(float32のバイト列)で共有するため、デコードしないプールを使う
+        redis_pool = redis.ConnectionPool.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "10")),
+        )
+        redis_client = redis.Redis(connection_pool=redis_pool)
+        with startup.phase("redis"):
+            connected = await redis_client.ping()
+        if not connected:
             print("❌ Redis接続失敗")
             raise RuntimeError("Redis connection failed")        
         else:
@@ -37,18 +96,23 @@ async def lifespan(app: FastAPI):
             print(f"❌ ConversationManager初期化失敗: {e}")
             raise RuntimeError(f"ConversationManager initialization failed: {e}")
 
-        # chat_serviceの初期化
-        try:
-            chat_service = get_chat_service(manager)
-            print("✅ ChatService初期化完了")
-        except Exception as e:
-            print(f"❌ ChatService初期化失敗: {e}")
-            raise RuntimeError(f"ChatService initialization failed: {e}")
-
         # インスタンスをアプリケーション全体に保存
         app.state.redis_client = redis_client
         app.state.manager = manager
-        app.state.chat_service = chat_service
+
+        # chat_serviceの初期化
+        if STARTUP_MODE == "lazy":
+            # 準備ができるまで /healthz/ready と チャットAPI は 503 を返す
+            warmup_task = asyncio.create_task(_warm_up(app))
+        else:
+            try:
+                chat_service = _build_chat_service()
+                print("✅ ChatService初期化完了")
+            except Exception as e:
+                print(f"❌ ChatService初期化失敗: {e}")
+                raise RuntimeError(f"ChatService initialization failed: {e}")
+            app.state.chat_service = chat_service
+            startup.mark_ready()
 
     except redis.ConnectionError as e:
         print(f"❌ redis接続エラーが発生しました: {e}")
@@ -62,14 +126,24 @@ async def lifespan(app: FastAPI):
 
     # shutdown
     print("🛑 アプリケーションのシャットダウン中...")
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
     try:
+        if manager:
+            # 書き込み待ちの会話履歴を保存してから接続を閉じる
+            await manager.flush()
+            print("✅ 会話履歴の書き込みを完了しました")
         if redis_client:
-            redis_client.close()
+            await redis_client.aclose()
+            await redis_pool.aclose()
             print("✅ Redis接続を閉じました")
         else:
             print("❌ Redisクライアントが初期化されていません")
+        if chat_service:
+            await chat_service.close()
+            print("✅ Qdrant接続を閉じました")
     except Exception as e:
-        print(f"❌ Redis接続のシャットダウン中にエラーが発生しました: {e}")
+        print(f"❌ シャットダウン中にエラーが発生しました: {e}")
 
 
 # FastAPIアプリケーション作成
@@ -78,9 +152,42 @@ app = FastAPI(title="TUNA RAG ChatBot API", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,allow_origins=["*"],allow_methods=["*"],allow_headers=["*"],)
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    # 処理段階ごとの所要時間を Server-Timing ヘッダーで返す
+    # ストリーミングはヘッダーの送信が生成より先のため、会話履歴の読み込みなど送信前の段階のみ含まれる
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    # パスパラメーターを持つルートはないため、一致したルートはそのままのパスで集計する（未知のパスは1つにまとめる）
+    path = request.url.path if request.scope.get("route") is not None else "unmatched"
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=path, status=response.status_code)
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """
+    処理段階ごとのレイテンシ・トークン数・検索件数・キャッシュ・同時実行数の制限の統計を Prometheus のテキスト形式で返す関数
+    """
+    gauges = {
+        "startup": {**{f"{name}_seconds": seconds for name, seconds in startup.timings.items()}, "is_ready": int(startup.ready)},
+        "admission": admission.stats(),
+    }
+    if chat_service is not None:
+        gauges["chat"] = chat_service.stats()
+    if manager is not None:
+        try:
+            gauges["sessions"] = await manager.stats()
+        except Exception as e:
+            print(f"セッションの統計の取得に失敗しました: {e}")
+    return REGISTRY.render(gauges)
+
 app.include_router(api_router)
 
-app.mount("/static", StaticFiles(directory="./images"), name="static")
+# 操作画像（tools/image_variants.py が書き出したハッシュ付きの画像は長期キャッシュさせる）
+app.mount("/static", ImageStaticFiles(directory="./images"), name="static")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8000, log_level="debug")
\ No newline at end of file
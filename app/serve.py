@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Multi-worker entry point
+uvicorn のワーカーを N プロセス起動してバックエンドを実行する
+
+各ワーカーは spawn で起動した別プロセスで main を読み込み、lifespan の中で Redis・Qdrant・Gemini の
+クライアントを作るため、プロセス間で接続やイベントループを共有しない。
+回答キャッシュ・埋め込みのLRU・/metrics はワーカーごと、Redis 上のキャッシュと会話履歴は全ワーカーで共有される。
+REDIS_MAX_CONNECTIONS はワーカーごとの上限になる。
+
+使い方:
+    python3 serve.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+
+import os
+import argparse
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the chat backend with multiple uvicorn workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # ワーカーを使う場合は "main:app" の文字列で渡す必要がある
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
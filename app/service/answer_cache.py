@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+
+class AnswerCache:
+    """
+    クエリ埋め込みのコサイン類似度で過去の回答を引くセマンティックキャッシュ
+    エントリは回答を生成したときの documents コレクションのインデックスバージョンに紐づき、
+    バージョンが変わると全て破棄される（古いバージョンで生成された回答は保存もしない）
+    """
+
+    def __init__(self, dimensionality: int, threshold: float = 0.95, max_size: int = 512, ttl: int = 3600):
+        self.dimensionality = dimensionality
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version: Optional[str] = None
+
+        # 正規化済みの埋め込みを固定長の行列に保持し、検索は1回の行列積で行う
+        self._vectors = np.zeros((max_size, dimensionality), dtype=np.float32)
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._entries: dict[int, tuple[float, str, str, Optional[str]]] = {}  # slot -> (期限, クエリ, 回答, インデックスバージョン)
+        self._lru: OrderedDict[int, None] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_stores = 0
+
+    def _normalize(self, embedding: list[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.shape[0] != self.dimensionality or norm == 0:
+            return None
+        return vector / norm
+
+    def _remove(self, slot: int) -> None:
+        self._valid[slot] = False
+        self._entries.pop(slot, None)
+        self._lru.pop(slot, None)
+
+    def clear(self) -> None:
+        """
+        全てのエントリを破棄する
+        """
+        self._valid[:] = False
+        self._entries.clear()
+        self._lru.clear()
+
+    def ensure_version(self, version: Optional[str]) -> None:
+        """
+        インデックスバージョンが変わっていればキャッシュを破棄する
+        """
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+                print(f"インデックスバージョンが {self.version} から {version} に変わったため回答キャッシュを破棄しました。")
+            self.clear()
+            self.version = version
+
+    def lookup(self, embedding: list[float], version: Optional[str]) -> Optional[str]:
+        """
+        インデックスバージョン version で生成された回答のうち、類似度がしきい値以上のものを返す。該当がなければ None
+        """
+        self.ensure_version(version)
+        vector = self._normalize(embedding)
+        if vector is None or not self._entries:
+            self.misses += 1
+            return None
+
+        scores = self._vectors @ vector
+        scores[~self._valid] = -np.inf
+        slot = int(np.argmax(scores))
+        if scores[slot] < self.threshold:
+            self.misses += 1
+            return None
+
+        expires_at, cached_query, answer, entry_version = self._entries[slot]
+        if expires_at < time.monotonic() or entry_version != version:
+            self._remove(slot)
+            self.misses += 1
+            return None
+
+        self._lru.move_to_end(slot)
+        self.hits += 1
+        print(f"回答キャッシュにヒットしました (類似度: {scores[slot]:.3f}, 元の質問: {cached_query})")
+        return answer
+
+    def store(self, embedding: list[float], query: str, answer: str, version: Optional[str]) -> None:
+        """
+        インデックスバージョン version で生成した回答をキャッシュに保存する。上限に達していれば最も古く使われたものを追い出す
+        生成中にバージョンが変わっていた場合（古いインデックスの検索結果による回答）は保存しない
+        """
+        vector = self._normalize(embedding)
+        if vector is None or self.max_size <= 0:
+            return
+        if version != self.version:
+            self.stale_stores += 1
+            return
+
+        free_slots = np.flatnonzero(~self._valid)
+        if free_slots.size > 0:
+            slot = int(free_slots[0])
+        else:
+            slot, _ = self._lru.popitem(last=False)
+            self.evictions += 1
+
+        self._vectors[slot] = vector
+        self._valid[slot] = True
+        self._entries[slot] = (time.monotonic() + self.ttl, query, answer, version)
+        self._lru[slot] = None
+        self._lru.move_to_end(slot)
+
+    def stats(self) -> dict:
+        """
+        キャッシュのヒット/ミス数などを返す
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_stores": self.stale_stores,
+            "size": len(self._entries),
+            "index_version": self.version,
+        }
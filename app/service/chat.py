@@ -1,78 +1,74 @@
 import os
-from typing import Optional
+import time
+import asyncio
+from typing import Optional, AsyncIterator
 from dotenv import load_dotenv
 from service.conversation_manager import ConversationManager
+from service.embedding_cache import EmbeddingCache, normalize_query
+from service.embedding_batcher import EmbeddingBatcher, gemini_batch_embedder
+from service.answer_cache import AnswerCache
+from service.mmap_index import MmapVectorIndex
+from service.context_assembler import ContextAssembler
+from service.prompt_cache import PromptCache, GeminiCacheBackend, StubCacheBackend
+from service.single_flight import SingleFlight
+from service.fakes import FakeLLM, FakeEmbedding, FakeVectorStore
+from service.qdrant_retriever import LeanQdrantRetriever, create_async_qdrant_client, build_search_params
+from service.metrics import stage, record_stage, TOKENS, RETRIEVED_NODES, ANSWERS
+from service.limits import StageTimeout, with_timeout, iterate_with_timeout
+from google import genai
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
 from google.genai.types import EmbedContentConfig
-from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core import VectorStoreIndex, QueryBundle
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
 
 load_dotenv()
 
-# シングルトンインスタンスの管理
+# シングルトンインスタンスの管理（fork 後の子プロセスでは作り直すため、作成したプロセスIDも保持する）
 _chat_service_instance = None
+_chat_service_pid = None
 
-class ChatService:
-    def __init__(self, manager: Optional[ConversationManager] = None):
-        self.google_api_key = os.getenv("GOOGLE_API_KEY")
-        self.manager = manager
+LLM_MODEL_NAME = "models/gemini-2.5-flash"
+EMBEDDING_MODEL_NAME = "models/gemini-embedding-001"
+EMBEDDING_DIMENSIONALITY = 768
+# GoogleGenAIEmbedding はクエリの埋め込みに常に RETRIEVAL_QUERY を使用する
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
 
-        # LLMと埋め込みモデルの設定
-        Settings.llm = GoogleGenAI(
-            model="models/gemini-2.5-flash",
-            temperature=0.22,
-            api_key=self.google_api_key
-        )
-        Settings.embed_model = GoogleGenAIEmbedding(
-            model_name="models/gemini-embedding-001",
-            api_key=self.google_api_key,
-            embedding_config=EmbedContentConfig(task_type="QUESTION_ANSWERING", output_dimensionality=768),
-        )
+# tools/embedding.py が取り込みのたびに更新するインデックスバージョンのキー
+INDEX_VERSION_KEY = "index_version:documents"
 
-        self.qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"))
-        self.collection_name = "documents"
+# 検索に使うバックエンド
+# qdrant: llama_index 経由で Qdrant を検索 / qdrant_lean: 必要なペイロードだけを Qdrant から直接取得
+# mmap: tools/export_mmap_index.py で書き出したファイル
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "qdrant")
+MMAP_INDEX_PATH = os.getenv("MMAP_INDEX_PATH", "mmap_index/documents.mmvi")
+# mmap のファイルの書き出し元が現在のインデックスバージョンと一致しているかを確認する間隔（秒）
+MMAP_SNAPSHOT_CHECK_SECONDS = 1.0
+RETRIEVAL_TOP_K = 10
+# Qdrant の検索時パラメータ（未指定ならコレクションの設定のまま） / tools/collection_profiles.py の量子化プロファイル向けの候補の倍率
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF")) if os.getenv("QDRANT_HNSW_EF") else None
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING")) if os.getenv("QDRANT_OVERSAMPLING") else None
+# qdrant_lean で、先頭の次元だけのベクトルで候補を探してから元のベクトルで再スコアする場合の次元数と候補数
+# （tools/collection_profiles.py の matryoshka プロファイルで作ったコレクションが必要）
+QDRANT_PREFIX_DIMS = int(os.getenv("QDRANT_PREFIX_DIMS")) if os.getenv("QDRANT_PREFIX_DIMS") else None
+QDRANT_PREFIX_CANDIDATES = int(os.getenv("QDRANT_PREFIX_CANDIDATES", "100"))
 
-        vector_store = QdrantVectorStore(
-            client=self.qdrant_client,
-            collection_name=self.collection_name,
-        )
-        print(f"Loading index from Qdrant collection '{self.collection_name}'...")
-        self.index = VectorStoreIndex.from_vector_store(
-            vector_store=vector_store
-        )
-        print("Index loaded successfully.")
+# gemini: Gemini と Qdrant を使う / fake: 負荷試験用に service/fakes.py のスタンドインを使う（APIキー・Qdrant 不要）
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "gemini")
 
-    
-    def _format_response_history(self, history: list[dict]) -> str:
-        if not history:
-            return "（過去の会話はありません）"
-        
-        formatted = ""
-        for i, item in enumerate(history[-3:], 1):  # 直近3件のみ
-            formatted += f"Q{i}: {item['query']}\nA{i}: {item['response']}...\n\n"
+# 処理段階ごとの制限時間（秒、0 で無制限）。超えた場合は StageTimeout を送出し、API は 504 を返す
+# LLM はストリーミングでは最初のチャンクまでの時間、以降はチャンク間の時間を LLM_CHUNK_TIMEOUT_SECONDS で制限する
+EMBED_TIMEOUT_SECONDS = float(os.getenv("EMBED_TIMEOUT_SECONDS", "10"))
+RETRIEVE_TIMEOUT_SECONDS = float(os.getenv("RETRIEVE_TIMEOUT_SECONDS", "10"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CHUNK_TIMEOUT_SECONDS = float(os.getenv("LLM_CHUNK_TIMEOUT_SECONDS", "30"))
 
-        return formatted
-    
-    async def create_response(self, conversation: list[dict], query: str) -> str:
-        """
-        ユーザーからのクエリに対するレスポンスを生成する関数
-        """
-        retriever = self.index.as_retriever(similarity_top_k=10, embed_model=Settings.embed_model)
-        retrieved_nodes = retriever.retrieve(query)
+NOT_FOUND_MESSAGE = "該当する情報が見つかりませんでした。"
+GENERATION_FAILED_MESSAGE = "応答の生成に失敗しました。もう一度お試しください。"
 
-        reference = ""
-        if retrieved_nodes:
-            print(f"Found {len(retrieved_nodes)} relevant sources.")
-            for i, node in enumerate(retrieved_nodes):
-                reference += f"## 参考情報 {i+1}\n"
-                reference += f"{node.text}\n\n"
-        else:
-            print("No relevant sources found.")
-            reference = "TUNAシステムの機能に関連する情報は見つかりませんでした。"
-        
-        prompt = f"""
+# 全リクエストで共通の命令（システム指示としてコンテキストキャッシュに登録する）
+SYSTEM_INSTRUCTION = """
 以下の[命令]を絶対に守ってください。
 
 # 命令
@@ -134,7 +130,341 @@ class ChatService:
 - 該当情報がない場合はstr型の空文字列を返す
 - 解答例の内容は参照禁止
 - [過去の回答履歴]は参考情報として活用する
+"""
+
+class ChatService:
+    def __init__(self, manager: Optional[ConversationManager] = None, cache_redis_client=None):
+        self.google_api_key = os.getenv("GOOGLE_API_KEY")
+        self.manager = manager
+
+        # LLMと埋め込みモデルの設定
+        # llama_index の Settings（プロセス全体で共有）は使わず、インスタンスごとに持つ
+        if CHAT_BACKEND == "fake":
+            seed = int(os.getenv("FAKE_SEED", "0"))
+            self.llm = FakeLLM.from_env(seed=seed)
+            self.embed_model = FakeEmbedding.from_env(EMBEDDING_DIMENSIONALITY, seed=seed)
+            self.genai_client = None
+            embed_batch = self.embed_model.aembed_batch
+        else:
+            self.llm = GoogleGenAI(
+                model=LLM_MODEL_NAME,
+                temperature=0.22,
+                api_key=self.google_api_key
+            )
+            self.embed_model = GoogleGenAIEmbedding(
+                model_name=EMBEDDING_MODEL_NAME,
+                api_key=self.google_api_key,
+                embedding_config=EmbedContentConfig(task_type="QUESTION_ANSWERING", output_dimensionality=EMBEDDING_DIMENSIONALITY),
+            )
+            self.genai_client = genai.Client(api_key=self.google_api_key)
+            embed_batch = gemini_batch_embedder(self.genai_client, EMBEDDING_MODEL_NAME, QUERY_TASK_TYPE, EMBEDDING_DIMENSIONALITY)
+
+        # 同時リクエストのクエリ埋め込みを短い時間窓でまとめ、1回のAPI呼び出しで埋め込む
+        batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.embedding_batcher = EmbeddingBatcher(
+            embed_batch=embed_batch,
+            max_batch_size=batch_size,
+            window_ms=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")),
+        ) if batch_size > 1 else None
+
+        # クエリ埋め込みのキャッシュ（プロセス内LRU + Redis）
+        self.embedding_cache = EmbeddingCache(
+            embed_model=self.embed_model,
+            model_name=EMBEDDING_MODEL_NAME,
+            task_type=QUERY_TASK_TYPE,
+            dimensionality=EMBEDDING_DIMENSIONALITY,
+            redis_client=cache_redis_client,
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+            ttl=int(os.getenv("EMBEDDING_CACHE_TTL", "86400")),
+            batcher=self.embedding_batcher,
+        )
+
+        # 類似した質問への回答キャッシュ（インデックスバージョンで無効化）
+        self.cache_redis_client = cache_redis_client
+        self.answer_cache = AnswerCache(
+            dimensionality=EMBEDDING_DIMENSIONALITY,
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+            ttl=int(os.getenv("ANSWER_CACHE_TTL", "3600")),
+        )
+
+        # 固定のシステム指示はコンテキストキャッシュに載せ、リクエストごとには質問・参考情報・履歴だけを送る
+        if os.getenv("PROMPT_CACHE", "on") == "off":
+            prompt_cache_backend = None
+        elif self.genai_client is None:
+            prompt_cache_backend = StubCacheBackend()
+        else:
+            prompt_cache_backend = GeminiCacheBackend(self.genai_client, LLM_MODEL_NAME)
+        self.prompt_cache = PromptCache(
+            backend=prompt_cache_backend,
+            system_instruction=SYSTEM_INSTRUCTION,
+            model=LLM_MODEL_NAME,
+            ttl_seconds=int(os.getenv("PROMPT_CACHE_TTL", "3600")),
+        )
+
+        # 同じ質問・同じ会話履歴の同時リクエストは、実行中の1件の結果を共有する
+        self.single_flight = SingleFlight(wait_seconds=float(os.getenv("COALESCE_WAIT_SECONDS", "30")))
+
+        # 複数の質問のまとめ処理（handle_batch）で、回答を同時に生成する件数の既定値と、埋め込み・検索をまとめて先に行う件数
+        self.batch_concurrency = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+        self.batch_prefetch_size = int(os.getenv("CHAT_BATCH_PREFETCH_SIZE", "64"))
+
+        # 検索結果のしきい値による除外・重複チャンクの結合・トークン予算での詰め込み
+        self.context_assembler = ContextAssembler(
+            score_threshold=float(os.getenv("CONTEXT_SCORE_THRESHOLD", "0.75")),
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000")),
+        )
+
+        # "documents" はエイリアスで、検索のたびに解決されるため再インデックス後も再起動は不要
+        self.collection_name = "documents"
+        if CHAT_BACKEND == "fake":
+            self.qdrant_client = None
+            self.qdrant_aclient = None
+            vector_store = FakeVectorStore.from_env(self.embed_model, seed=seed)
+            print("Loading index from the fake vector store...")
+        else:
+            self.qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"))
+            # 検索はイベントループをブロックしないよう非同期クライアントで行い、接続は全リクエストで使い回す
+            self.qdrant_aclient = create_async_qdrant_client(
+                url=os.getenv("QDRANT_URL"),
+                prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true",
+                grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+                pool_size=int(os.getenv("QDRANT_POOL_SIZE", "16")),
+            )
+            vector_store = self._qdrant_vector_store()
+            print(f"Loading index from Qdrant collection '{self.collection_name}'...")
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=vector_store,
+            embed_model=self.embed_model,
+        )
+        print("Index loaded successfully.")
+
+        # 小さなコーパスでは、ネットワーク越しの検索よりプロセス内の総当たり検索の方が速い
+        self.mmap_index = MmapVectorIndex(MMAP_INDEX_PATH) if RETRIEVAL_BACKEND == "mmap" else None
+        self._mmap_checked_at = 0.0
+        self._mmap_index_version: Optional[str] = None
+        self._mmap_stale_warned: Optional[str] = None
+        self.search_params = build_search_params(hnsw_ef=QDRANT_HNSW_EF, oversampling=QDRANT_OVERSAMPLING)
+        # しきい値未満の検索結果はどうせ捨てるため、Qdrant 側で除外して転送量を減らす
+        self.lean_retriever = None
+        if RETRIEVAL_BACKEND == "qdrant_lean" and self.qdrant_aclient is not None:
+            self.lean_retriever = LeanQdrantRetriever(
+                self.qdrant_aclient,
+                self.collection_name,
+                score_threshold=self.context_assembler.score_threshold,
+                search_params=self.search_params,
+                prefix_dims=QDRANT_PREFIX_DIMS,
+                prefix_candidates=QDRANT_PREFIX_CANDIDATES,
+            )
+        # エイリアスの参照先のベクトル構成（名前付きか・候補検索用のベクトルがあるか）を、どのインデックスバージョンで調べたか
+        self._layout_checked = False
+        self._layout_version: Optional[str] = None
+        self._layout_lock = asyncio.Lock()
+
+    def _qdrant_vector_store(self) -> QdrantVectorStore:
+        return QdrantVectorStore(
+            client=self.qdrant_client,
+            aclient=self.qdrant_aclient,
+            collection_name=self.collection_name,
+        )
+
+    async def _check_mmap_snapshot(self) -> None:
+        """
+        メモリマップインデックスの書き出し元のコレクションが、現在のインデックスバージョン（エイリアスの参照先）と違えば警告する関数
+        再インデックス後にファイルを書き出し直していないと、古い内容のまま検索し続けるため（警告はバージョンごとに1度）
+        """
+        now = time.monotonic()
+        if now - self._mmap_checked_at < MMAP_SNAPSHOT_CHECK_SECONDS:
+            return
+        self._mmap_checked_at = now
+        version = await self._index_version()
+        self._mmap_index_version = version
+        if version and self.mmap_index.header.get("collection") != version:
+            # バージョンが上がる直前に書き出し直されたファイルを、まだ読み込んでいないだけの場合がある
+            self.mmap_index.refresh()
+        exported = self.mmap_index.header.get("collection")
+        if version and exported != version and self._mmap_stale_warned != version:
+            self._mmap_stale_warned = version
+            print(
+                f"メモリマップインデックスは '{exported}' から書き出されていますが、現在のインデックスは '{version}' です。"
+                " tools/export_mmap_index.py で書き出し直してください。"
+            )
+
+    async def _sync_collection_layout(self) -> None:
+        """
+        インデックスバージョンが変わったら（エイリアスが別のコレクションに切り替わったら）、検索に使うベクトルの構成を調べ直す関数
+        プロファイルを変えた再インデックスでは名前のないベクトルと名前付きベクトルが入れ替わるため、
+        切り替え前の構成のまま検索すると失敗する（QdrantVectorStore は構成を作成時に1度だけ判定するため作り直す）
+        """
+        if self.qdrant_aclient is None:
+            return
+        version = await self._index_version()
+        if self._layout_checked and version == self._layout_version:
+            return
+        async with self._layout_lock:
+            if self._layout_checked and version == self._layout_version:
+                return
+            try:
+                if self.lean_retriever is not None:
+                    await with_timeout("retrieve", RETRIEVE_TIMEOUT_SECONDS, self.lean_retriever.refresh_layout())
+                else:
+                    vector_store = await asyncio.to_thread(self._qdrant_vector_store)
+                    self.index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=self.embed_model)
+            except Exception as e:
+                print(f"コレクションのベクトル構成の確認に失敗しました: {e}")
+                return
+            self._layout_checked, self._layout_version = True, version
+
+    
+    async def close(self) -> None:
+        """
+        Qdrantクライアントの接続を閉じる関数
+        """
+        if self.qdrant_client is None:
+            return
+        await self.qdrant_aclient.close()
+        self.qdrant_client.close()
+
+    def _format_response_history(self, history: list[dict]) -> str:
+        if not history:
+            return "（過去の会話はありません）"
+        
+        formatted = ""
+        for i, item in enumerate(history[-3:], 1):  # 直近3件のみ
+            formatted += f"Q{i}: {item['query']}\nA{i}: {item['response']}...\n\n"
+
+        return formatted
+    
+    async def _index_version(self) -> Optional[str]:
+        """
+        Redisから現在のインデックスバージョンを読む関数
+        再インデックスの直後から古い回答を返さないよう、回答キャッシュを使うリクエストごとに読む（読めなければ最後に読めたバージョンを使う）
+        """
+        if self.cache_redis_client is None:
+            return self.answer_cache.version
+        try:
+            version = await self.cache_redis_client.get(INDEX_VERSION_KEY)
+        except Exception as e:
+            print(f"インデックスバージョンの取得に失敗しました: {e}")
+            return self.answer_cache.version
+        return version.decode("utf-8") if isinstance(version, bytes) else version
+
+    async def _lookup_answer_cache(
+        self, conversation: list[dict], query: str, use_cache: bool
+    ) -> tuple[Optional[list[float]], Optional[str], Optional[str]]:
+        """
+        回答キャッシュを参照し、(クエリ埋め込み, キャッシュ済みの回答, インデックスバージョン) を返す関数
+        会話履歴がある場合は回答が履歴に依存するため、キャッシュを使わない
+        """
+        if not use_cache or conversation:
+            return None, None, None
+        version = await self._index_version()
+        with stage("embed"):
+            embedding = await with_timeout("embed", EMBED_TIMEOUT_SECONDS, self.embedding_cache.get_query_embedding(query))
+        with stage("answer_cache"):
+            return embedding, self.answer_cache.lookup(embedding, version), version
 
+    def _store_answer_cache(self, embedding: Optional[list[float]], query: str, response: str, version: Optional[str]) -> None:
+        """
+        生成に成功した回答を、参照時に読んだインデックスバージョンとともに回答キャッシュに保存する関数
+        """
+        if embedding is None or not response or response in (NOT_FOUND_MESSAGE, GENERATION_FAILED_MESSAGE):
+            return
+        self.answer_cache.store(embedding, query, response, version)
+
+    def _coalesce_key(self, conversation: list[dict], query: str, use_cache: bool) -> str:
+        """
+        同時リクエストをまとめるためのキー（正規化した質問と、プロンプトに入る会話履歴が同じなら同じキーになる）
+        """
+        return self.single_flight.make_key(normalize_query(query), self._format_response_history(conversation), str(use_cache))
+
+    async def _retrieve(self, query: str, embedding: list[float]) -> list:
+        """
+        クエリ埋め込みとの類似度が高いノードを検索する関数
+        """
+        if self.mmap_index is not None:
+            nodes = self.mmap_index.search(embedding, top_k=RETRIEVAL_TOP_K)
+            await self._check_mmap_snapshot()
+            return nodes
+        await self._sync_collection_layout()
+        return await self._search(query, embedding)
+
+    async def _search(self, query: str, embedding: list[float]) -> list:
+        """
+        Qdrant を検索する関数（ベクトル構成の確認は呼び出し側で済ませておく）
+        """
+        if self.lean_retriever is not None:
+            return await with_timeout(
+                "retrieve", RETRIEVE_TIMEOUT_SECONDS, self.lean_retriever.aretrieve(embedding, top_k=RETRIEVAL_TOP_K)
+            )
+        retriever = self.index.as_retriever(
+            similarity_top_k=RETRIEVAL_TOP_K,
+            embed_model=self.embed_model,
+            vector_store_kwargs={"search_params": self.search_params},
+        )
+        return await with_timeout(
+            "retrieve", RETRIEVE_TIMEOUT_SECONDS, retriever.aretrieve(QueryBundle(query_str=query, embedding=embedding))
+        )
+
+    async def _retrieve_batch(self, queries: list[str], embeddings: list[list[float]]) -> list[list]:
+        """
+        複数のクエリの検索をまとめて行う関数
+        qdrant_lean では1回の問い合わせで全クエリを検索し、それ以外はクエリごとの検索を同時に行う
+        """
+        if self.mmap_index is not None:
+            nodes = [self.mmap_index.search(embedding, top_k=RETRIEVAL_TOP_K) for embedding in embeddings]
+            await self._check_mmap_snapshot()
+            return nodes
+        await self._sync_collection_layout()
+        if self.lean_retriever is not None:
+            return await with_timeout(
+                "retrieve", RETRIEVE_TIMEOUT_SECONDS, self.lean_retriever.aretrieve_batch(embeddings, top_k=RETRIEVAL_TOP_K)
+            )
+        return await asyncio.gather(*[self._search(query, embedding) for query, embedding in zip(queries, embeddings)])
+
+    async def _build_prompt(
+        self, conversation: list[dict], query: str, embedding: Optional[list[float]] = None, retrieved_nodes: Optional[list] = None
+    ) -> str:
+        """
+        関連情報を検索し、LLMに渡すプロンプト（システム指示以外の部分）を組み立てる関数
+        retrieved_nodes を渡した場合は検索せずにその結果を使う
+        """
+        if retrieved_nodes is None:
+            if embedding is None:
+                with stage("embed"):
+                    embedding = await with_timeout("embed", EMBED_TIMEOUT_SECONDS, self.embedding_cache.get_query_embedding(query))
+            with stage("retrieve"):
+                retrieved_nodes = await self._retrieve(query, embedding)
+
+        with stage("assemble"):
+            prompt, context_stats = self._assemble_prompt(conversation, query, retrieved_nodes)
+        RETRIEVED_NODES.observe(context_stats["nodes_retrieved"], kind="retrieved")
+        RETRIEVED_NODES.observe(context_stats["nodes_relevant"], kind="relevant")
+        TOKENS.observe(context_stats["tokens_used"], kind="reference")
+        TOKENS.observe(len(self.context_assembler.tokenizer(prompt)), kind="prompt")
+        return prompt
+
+    def _assemble_prompt(self, conversation: list[dict], query: str, retrieved_nodes: list) -> tuple[str, dict]:
+        """
+        検索結果から参考情報を選び、質問・会話履歴と合わせてプロンプトを組み立てる関数
+        """
+        sections, context_stats = self.context_assembler.assemble(retrieved_nodes)
+
+        reference = ""
+        if sections:
+            print(
+                f"Found {context_stats['nodes_relevant']}/{context_stats['nodes_retrieved']} relevant sources,"
+                f" {context_stats['sections']} sections, {context_stats['tokens_used']} tokens"
+                f" ({context_stats['tokens_saved']} tokens saved)."
+            )
+            for i, section in enumerate(sections):
+                reference += f"## 参考情報 {i+1}\n"
+                reference += f"{section}\n\n"
+        else:
+            print("No relevant sources found.")
+            reference = "TUNAシステムの機能に関連する情報は見つかりませんでした。"
+        
+        prompt = f"""
 # 質問
 {query}
 
@@ -147,21 +477,56 @@ class ChatService:
 上記の参考情報を基に、ユーザーの質問に対して有用で実践的な回答を提供してください。
 重要：参考情報が不十分または質問が不適切な場合は、必ず空文字列で応答してください。
 """
+        return prompt, context_stats
+
+    async def _generation_config(self) -> dict:
+        """
+        コンテキストキャッシュの generation_config を取得し、システム指示のトークン数を記録する関数
+        """
+        with stage("prompt_cache"):
+            generation_config = await self.prompt_cache.generation_config()
+        kind = "instruction_cached" if "cached_content" in generation_config else "instruction_inline"
+        TOKENS.observe(self.prompt_cache.static_tokens, kind=kind)
+        return generation_config
+
+    async def create_response(
+        self, conversation: list[dict], query: str, embedding: Optional[list[float]] = None, retrieved_nodes: Optional[list] = None
+    ) -> str:
+        """
+        ユーザーからのクエリに対するレスポンスを生成する関数
+        """
+        prompt = await self._build_prompt(conversation=conversation, query=query, embedding=embedding, retrieved_nodes=retrieved_nodes)
+
         # LLMを使用して応答を生成
-        response = Settings.llm.complete(prompt)
+        generation_config = await self._generation_config()
+        with stage("llm"):
+            try:
+                response = await with_timeout("llm", LLM_TIMEOUT_SECONDS, self.llm.acomplete(prompt, generation_config=generation_config))
+            except StageTimeout:
+                raise
+            except Exception as e:
+                if "cached_content" not in generation_config:
+                    raise
+                # キャッシュが期限切れ・削除済みの場合はシステム指示を直接送って再試行する
+                print(f"コンテキストキャッシュを使った生成に失敗したため再試行します: {e}")
+                self.prompt_cache.invalidate()
+                response = await with_timeout(
+                    "llm", LLM_TIMEOUT_SECONDS, self.llm.acomplete(prompt, generation_config=self.prompt_cache.inline_config())
+                )
         if response:
+            TOKENS.observe(len(self.context_assembler.tokenizer(response.text)), kind="completion")
             if response.text.strip() == "":
-                print("該当する情報が見つかりませんでした。")
-                return "該当する情報が見つかりませんでした。"
+                print(NOT_FOUND_MESSAGE)
+                return NOT_FOUND_MESSAGE
             else:
                 print("応答を生成に成功しました。")
                 return response.text.strip()
         else:
             print("応答の生成に失敗しました。")
-            return "応答の生成に失敗しました。もう一度お試しください。"
+            return GENERATION_FAILED_MESSAGE
         
     
-    async def handle_query(self, session_id: str, query: str) -> str:
+    async def handle_query(self, session_id: str, query: str, use_cache: bool = True) -> str:
         """
         ユーザーからのクエリを処理し、レスポンスを生成,
         レスポンスを保存する処理をする関数
@@ -170,27 +535,292 @@ class ChatService:
             raise RuntimeError("ConversationManagerが未設定です。")
 
         try: 
-            past_conversation = self.manager.get_conversation(session_id)
-            # 回答を生成
-            response = await self.create_response(
-                query=query,
-                conversation=past_conversation
-            )
+            with stage("redis_read"):
+                past_conversation = await self.manager.get_conversation(session_id)
+
+            async def generate() -> str:
+                embedding, response, index_version = await self._lookup_answer_cache(past_conversation, query, use_cache)
+                if response is not None:
+                    ANSWERS.inc(source="answer_cache")
+                else:
+                    # 回答を生成
+                    response = await self.create_response(
+                        query=query,
+                        conversation=past_conversation,
+                        embedding=embedding
+                    )
+                    ANSWERS.inc(source=self._answer_source(response))
+                    self._store_answer_cache(embedding, query, response, index_version)
+                return response
+
+            response = await self.single_flight.run(self._coalesce_key(past_conversation, query, use_cache), generate)
 
-            # 会話履歴を保存
-            self.manager.save_conversation(session_id=session_id, conversation={
+            # 会話履歴を保存（レスポンスを待たせないようバックグラウンドで書き込む）
+            # クライアントが切断して処理がキャンセルされた場合はここに到達せず、保存しない
+            self.manager.save_conversation_background(session_id=session_id, conversation={
                 "query": query,
                 "response": response
             })
         except Exception as e:
+            # 失敗を握りつぶすと未定義の response を返すことになるため、記録したうえでエンドポイントに伝える
             print("error", e)
+            raise
 
         return response
 
+    async def _batch_history(self, session_id: Optional[str]) -> list[dict]:
+        return await self.manager.get_conversation(session_id) if session_id else []
+
+    async def _prepare_batch(self, chunk: list[tuple[int, Optional[str], str]], use_cache: bool) -> list[dict]:
+        """
+        (番号, セッションID, 質問) のリストについて、会話履歴の取得・クエリ埋め込み・回答キャッシュの参照・検索をまとめて行う関数
+        """
+        with stage("redis_read"):
+            conversations = await asyncio.gather(*[self._batch_history(session_id) for _, session_id, _ in chunk])
+        queries = [query for _, _, query in chunk]
+        with stage("embed"):
+            embeddings = await with_timeout("embed", EMBED_TIMEOUT_SECONDS, self.embedding_cache.get_query_embeddings(queries))
+        index_version = await self._index_version() if use_cache else None
+        with stage("answer_cache"):
+            cached = [
+                self.answer_cache.lookup(embedding, index_version) if use_cache and not conversation else None
+                for conversation, embedding in zip(conversations, embeddings)
+            ]
+
+        # 回答キャッシュに無い質問だけを、正規化して同じになる質問は1回にまとめて検索する
+        pending = {normalize_query(query): (query, embedding) for query, embedding, response in zip(queries, embeddings, cached) if response is None}
+        with stage("retrieve"):
+            retrieved = await self._retrieve_batch([query for query, _ in pending.values()], [embedding for _, embedding in pending.values()])
+        nodes = dict(zip(pending, retrieved))
+        return [
+            {
+                "index": index,
+                "session_id": session_id,
+                "query": query,
+                "conversation": conversation,
+                "embedding": embedding,
+                "response": response,
+                "nodes": nodes.get(normalize_query(query)),
+                "index_version": index_version,
+            }
+            for (index, session_id, query), conversation, embedding, response in zip(chunk, conversations, embeddings, cached)
+        ]
+
+    async def _answer_batch_item(self, item: dict, use_cache: bool) -> str:
+        """
+        _prepare_batch で埋め込み・検索を済ませた1件の回答を生成し、セッションIDがあれば会話履歴に保存する関数
+        """
+        conversation, query, embedding = item["conversation"], item["query"], item["embedding"]
+        response = item["response"]
+        if response is not None:
+            ANSWERS.inc(source="answer_cache")
+        else:
+            async def generate() -> str:
+                response = await self.create_response(conversation, query, embedding=embedding, retrieved_nodes=item["nodes"])
+                ANSWERS.inc(source=self._answer_source(response))
+                # 会話履歴がある質問の回答は履歴に依存するため、回答キャッシュに入れない
+                self._store_answer_cache(embedding if use_cache and not conversation else None, query, response, item["index_version"])
+                return response
+
+            response = await self.single_flight.run(self._coalesce_key(conversation, query, use_cache), generate)
+
+        if item["session_id"]:
+            self.manager.save_conversation_background(session_id=item["session_id"], conversation={
+                "query": query,
+                "response": response
+            })
+        return response
+
+    async def handle_batch(
+        self, items: list[tuple[Optional[str], str]], use_cache: bool = True, concurrency: Optional[int] = None
+    ) -> AsyncIterator[tuple[int, str | Exception]]:
+        """
+        (セッションID, 質問) のリストを処理し、回答ができた順に (番号, 回答) を返す関数（失敗した質問は回答の代わりに例外を返す）
+        会話履歴・埋め込み・回答キャッシュの参照・検索は batch_prefetch_size 件ずつまとめて先に行い、
+        回答の生成は最大 concurrency 件を同時に行う（生成中に次の分の埋め込み・検索を進める）
+        セッションIDが None の質問は会話履歴を使わず、保存もしない
+        """
+        if self.manager is None and any(session_id for session_id, _ in items):
+            raise RuntimeError("ConversationManagerが未設定です。")
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.batch_concurrency))
+        results: asyncio.Queue[tuple[int, str | Exception]] = asyncio.Queue()
+        # 生成中のタスクがGCされないよう参照を保持し、途中で打ち切られたらキャンセルする
+        tasks: set[asyncio.Task] = set()
+        closing = False
+
+        async def answer(item: dict) -> None:
+            # どの番号にも必ず1件の結果を返す（共有している single-flight のタスクがキャンセルされた場合も含む）
+            # 結果が欠けると呼び出し側が results.get() で待ち続け、実行枠を握ったままになる
+            result: str | Exception = RuntimeError("回答の生成が中断されました。")
+            try:
+                result = await self._answer_batch_item(item, use_cache)
+            except asyncio.CancelledError as e:
+                # バッチ自体が打ち切られた場合だけキャンセルを伝える
+                if closing:
+                    raise
+                print("error", e)
+                result = RuntimeError("回答の生成がキャンセルされました。")
+            except Exception as e:
+                print("error", e)
+                result = e
+            finally:
+                semaphore.release()
+                results.put_nowait((item["index"], result))
+
+        async def produce() -> None:
+            numbered = [(index, session_id, query) for index, (session_id, query) in enumerate(items)]
+            for start in range(0, len(numbered), self.batch_prefetch_size):
+                chunk = numbered[start:start + self.batch_prefetch_size]
+                try:
+                    prepared = await self._prepare_batch(chunk, use_cache)
+                except Exception as e:
+                    print(f"質問のまとめ処理 ({len(chunk)}件) の埋め込み・検索に失敗しました: {e}")
+                    for index, _, _ in chunk:
+                        results.put_nowait((index, e))
+                    continue
+                for item in prepared:
+                    await semaphore.acquire()
+                    task = asyncio.ensure_future(answer(item))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            for _ in items:
+                yield await results.get()
+        finally:
+            closing = True
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    def _answer_source(self, response: str) -> str:
+        if response == NOT_FOUND_MESSAGE:
+            return "not_found"
+        if response == GENERATION_FAILED_MESSAGE:
+            return "failed"
+        return "generated"
+
+    async def _astream_complete(self, prompt: str):
+        """
+        コンテキストキャッシュを使ってストリーミング補完する関数
+        最初のチャンクを受け取る前にキャッシュ起因で失敗した場合は、システム指示を直接送って再試行する
+        """
+        generation_config = await self._generation_config()
+        received = False
+        try:
+            async for chunk in self._astream_with_timeout(prompt, generation_config):
+                received = True
+                yield chunk
+        except StageTimeout:
+            raise
+        except Exception as e:
+            if received or "cached_content" not in generation_config:
+                raise
+            print(f"コンテキストキャッシュを使った生成に失敗したため再試行します: {e}")
+            self.prompt_cache.invalidate()
+            async for chunk in self._astream_with_timeout(prompt, self.prompt_cache.inline_config()):
+                yield chunk
+
+    async def _astream_with_timeout(self, prompt: str, generation_config: dict):
+        """
+        ストリーミング補完を開始し、最初のチャンクとチャンク間の待ち時間を制限して返す関数
+        """
+        stream = await with_timeout("llm", LLM_TIMEOUT_SECONDS, self.llm.astream_complete(prompt, generation_config=generation_config))
+        async for chunk in iterate_with_timeout("llm", stream, LLM_TIMEOUT_SECONDS, LLM_CHUNK_TIMEOUT_SECONDS):
+            yield chunk
+
+    async def stream_response(self, conversation: list[dict], query: str, embedding: Optional[list[float]] = None) -> AsyncIterator[str]:
+        """
+        ユーザーからのクエリに対するレスポンスを、生成されたトークンから順に返す関数
+        """
+        prompt = await self._build_prompt(conversation=conversation, query=query, embedding=embedding)
+
+        # LLMのストリーミング補完を使用して応答を逐次生成
+        has_text = False
+        text = ""
+        start = time.perf_counter()
+        async for chunk in self._astream_complete(prompt):
+            if not chunk.delta:
+                continue
+            if not text:
+                record_stage("llm_first_chunk", time.perf_counter() - start)
+            text += chunk.delta
+            if not has_text:
+                # 先頭の空白は非ストリーミング版の strip() と揃える
+                delta = chunk.delta.lstrip()
+                if not delta:
+                    continue
+                has_text = True
+                yield delta
+            else:
+                yield chunk.delta
+
+        record_stage("llm", time.perf_counter() - start)
+        TOKENS.observe(len(self.context_assembler.tokenizer(text)), kind="completion")
+        if not has_text:
+            print(NOT_FOUND_MESSAGE)
+            yield NOT_FOUND_MESSAGE
+        else:
+            print("応答を生成に成功しました。")
+
+    async def handle_query_stream(self, session_id: str, query: str, use_cache: bool = True) -> AsyncIterator[str]:
+        """
+        ユーザーからのクエリを処理し、レスポンスを逐次返す。
+        ストリームの完了後に組み立てたレスポンスを保存する関数
+        """
+        if self.manager is None:
+            raise RuntimeError("ConversationManagerが未設定です。")
+
+        with stage("redis_read"):
+            past_conversation = await self.manager.get_conversation(session_id)
+        # 同じ質問を処理中であればその結果を待ち、なければ自分で生成する（ストリームは共有しない）
+        response = await self.single_flight.join(self._coalesce_key(past_conversation, query, use_cache))
+        embedding = index_version = None
+        if response is None:
+            embedding, response, index_version = await self._lookup_answer_cache(past_conversation, query, use_cache)
+
+        if response is not None:
+            # キャッシュ済みの回答は1チャンクで返す
+            ANSWERS.inc(source="answer_cache" if embedding is not None else "coalesced")
+            yield response
+        else:
+            chunks = []
+            async for delta in self.stream_response(query=query, conversation=past_conversation, embedding=embedding):
+                chunks.append(delta)
+                yield delta
+            response = "".join(chunks).strip()
+            ANSWERS.inc(source=self._answer_source(response))
+            self._store_answer_cache(embedding, query, response, index_version)
+
+        # ストリーム完了後に会話履歴を保存（バックグラウンドで書き込む）
+        # 途中でクライアントが切断した場合はストリームがキャンセルされ、保存しない
+        self.manager.save_conversation_background(session_id=session_id, conversation={
+            "query": query,
+            "response": response
+        })
+
+    def stats(self) -> dict:
+        """
+        同時リクエストのまとめ・埋め込み・回答キャッシュ・コンテキストキャッシュ・参考情報の組み立て・検索の統計を返す
+        """
+        return {
+            "coalescing": self.single_flight.stats(),
+            "embedding_cache": self.embedding_cache.stats(),
+            "embedding_batcher": self.embedding_batcher.stats() if self.embedding_batcher is not None else None,
+            "answer_cache": self.answer_cache.stats(),
+            "prompt_cache": self.prompt_cache.stats(),
+            "context": self.context_assembler.stats(),
+            "retrieval": self.lean_retriever.stats() if self.lean_retriever is not None else None,
+            "mmap_index": {**self.mmap_index.stats(), "index_version": self._mmap_index_version} if self.mmap_index is not None else None,
+        }
+
 
-def get_chat_service(manager: Optional[ConversationManager]) -> ChatService:
+def get_chat_service(manager: Optional[ConversationManager], cache_redis_client=None) -> ChatService:
     """ChatServiceのシングルトンインスタンスを取得"""
-    global _chat_service_instance
-    if _chat_service_instance is None:
-        _chat_service_instance = ChatService(manager=manager)
+    global _chat_service_instance, _chat_service_pid
+    # fork 前に作られたインスタンスは親プロセスの接続やイベントループを持つため、子プロセスでは使わない
+    if _chat_service_instance is None or _chat_service_pid != os.getpid():
+        _chat_service_instance = ChatService(manager=manager, cache_redis_client=cache_redis_client)
+        _chat_service_pid = os.getpid()
     return _chat_service_instance
\ No newline at end of file
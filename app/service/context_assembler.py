@@ -0,0 +1,111 @@
+from typing import Callable, Optional
+from llama_index.core.schema import NodeWithScore, MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+
+class ContextAssembler:
+    """
+    検索結果からプロンプトに入れる参考情報を組み立てるクラス
+    - スコアがしきい値未満のチャンクを除外する
+    - 同じ文書の隣接・重複するチャンク（chunk_overlap による重なり）を1つに結合する
+    - スコアの高い順にトークン予算の範囲で詰める
+    トークン数は llama_index の既定トークナイザーによる概算（Gemini の実際の数とは多少ずれる）
+    """
+
+    def __init__(self, score_threshold: float = 0.75, token_budget: int = 4000, tokenizer: Optional[Callable[[str], list]] = None):
+        self.score_threshold = score_threshold
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer or get_tokenizer()
+
+        self.requests = 0
+        self.total_tokens_retrieved = 0
+        self.total_tokens_used = 0
+
+    def _count(self, text: str) -> int:
+        return len(self.tokenizer(text))
+
+    def _merge(self, nodes: list[NodeWithScore]) -> list[tuple[float, str]]:
+        """
+        同じ文書のチャンクを文字位置で並べ、重なる・接するものを結合して (スコア, 本文) を返す
+        文字位置が本文と食い違うチャンクは結合せずにそのまま使う
+        """
+        blocks: list[tuple[float, str]] = []
+        spans_by_source: dict[str, list[tuple[int, int, float, str]]] = {}
+        for item in nodes:
+            text = item.node.get_content(metadata_mode=MetadataMode.NONE)
+            start, end = item.node.start_char_idx, item.node.end_char_idx
+            source = item.node.metadata.get("file_path") or item.node.ref_doc_id
+            if source is None or start is None or end is None or end - start != len(text):
+                blocks.append((item.score or 0.0, text))
+                continue
+            spans_by_source.setdefault(source, []).append((start, end, item.score or 0.0, text))
+
+        for spans in spans_by_source.values():
+            spans.sort(key=lambda span: span[0])
+            start, end, score, text = spans[0]
+            for next_start, next_end, next_score, next_text in spans[1:]:
+                if next_start <= end:
+                    # 重なり部分を除いた残りだけを後ろにつなげる
+                    if next_end > end:
+                        text += next_text[end - next_start:]
+                        end = next_end
+                    score = max(score, next_score)
+                else:
+                    blocks.append((score, text))
+                    start, end, score, text = next_start, next_end, next_score, next_text
+            blocks.append((score, text))
+
+        blocks.sort(key=lambda block: block[0], reverse=True)
+        return blocks
+
+    def _truncate(self, text: str, tokens: int, budget: int) -> str:
+        length = len(text) * budget // max(tokens, 1)
+        while length > 0 and self._count(text[:length]) > budget:
+            length = length * 9 // 10
+        return text[:length]
+
+    def assemble(self, nodes: list[NodeWithScore]) -> tuple[list[str], dict]:
+        """
+        参考情報の本文のリストと、削減できたトークン数などの統計を返す関数
+        """
+        retrieved_tokens = sum(self._count(item.node.get_content(metadata_mode=MetadataMode.NONE)) for item in nodes)
+        relevant = [item for item in nodes if item.score is None or item.score >= self.score_threshold]
+
+        sections: list[str] = []
+        used_tokens = 0
+        dropped = 0
+        for _, text in self._merge(relevant):
+            tokens = self._count(text)
+            if used_tokens + tokens > self.token_budget:
+                if sections:
+                    # 予算を超えるブロックは飛ばし、より短いブロックが入るか試す
+                    dropped += 1
+                    continue
+                # 最もスコアの高いブロックだけは予算に収まるよう切り詰めて使う
+                text = self._truncate(text, tokens, self.token_budget)
+                tokens = self._count(text)
+            sections.append(text)
+            used_tokens += tokens
+
+        self.requests += 1
+        self.total_tokens_retrieved += retrieved_tokens
+        self.total_tokens_used += used_tokens
+        return sections, {
+            "nodes_retrieved": len(nodes),
+            "nodes_relevant": len(relevant),
+            "sections": len(sections),
+            "sections_dropped": dropped,
+            "tokens_retrieved": retrieved_tokens,
+            "tokens_used": used_tokens,
+            "tokens_saved": retrieved_tokens - used_tokens,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "tokens_retrieved": self.total_tokens_retrieved,
+            "tokens_used": self.total_tokens_used,
+            "tokens_saved": self.total_tokens_retrieved - self.total_tokens_used,
+            "score_threshold": self.score_threshold,
+            "token_budget": self.token_budget,
+        }
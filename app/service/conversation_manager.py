@@ -1,41 +1,174 @@
+import os
 import json
+import time
+import zlib
+import asyncio
+from service.metrics import stage
 
-# シングルトンインスタンスの管理
+# シングルトンインスタンスの管理（fork 後の子プロセスでは作り直すため、作成したプロセスIDも保持する）
 _manager_instance = None
+_manager_pid = None
+
+# 最後の会話から一定時間で期限切れ（会話のたびに延長するスライディングTTL）
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# 1セッションに保存する会話の上限（古いものから切り詰める）
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+# この長さを超える会話は zlib で圧縮して保存する
+COMPRESS_THRESHOLD_BYTES = 512
+# 使用メモリを集計するときに MEMORY USAGE を問い合わせるセッション数の上限
+STATS_SAMPLE_SIZE = 1000
+
+# カウンターの採番とアクティブセッション索引への登録を1往復で行うスクリプト
+# KEYS[1]: カウンター, KEYS[2]: 索引(ZSET, スコアは期限切れ時刻)
+# ARGV[1]: プレフィックス, ARGV[2]: 現在時刻, ARGV[3]: TTL
+_CREATE_SESSION_SCRIPT = """
+local number = redis.call('INCR', KEYS[1])
+local session_id = ARGV[1] .. ':' .. string.format('%06d', number)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[2]) + tonumber(ARGV[3]), session_id)
+return session_id
+"""
+
+
+def _encode_turn(conversation: dict) -> bytes:
+    """
+    会話1件を [質問, 回答] のコンパクトなJSONにし、長いものは圧縮する
+    """
+    data = json.dumps(
+        [conversation["query"], conversation["response"]], ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    if len(data) > COMPRESS_THRESHOLD_BYTES:
+        return zlib.compress(data)
+    return data
+
+
+def _decode_turn(item: bytes | str) -> dict:
+    """
+    保存された会話1件を辞書に戻す（以前の {"query", "response"} 形式も読める）
+    """
+    if isinstance(item, bytes) and item[:1] not in (b"[", b"{"):
+        item = zlib.decompress(item)
+    value = json.loads(item)
+    if isinstance(value, list):
+        return {"query": value[0], "response": value[1]}
+    return value
+
 
 class ConversationManager:
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, prefix: str = "session"):
+        # 共有コネクションプールを使う redis.asyncio.Redis を想定
+        # (decode_responses=False のため、取得した値はここでデコードする)
         self.redis_client = redis_client
+        self._create_session = redis_client.register_script(_CREATE_SESSION_SCRIPT)
+        self.index_key = f"{prefix}:index"
+        # セッションごとの書き込み待ちタスク（後書き）
+        self._pending: dict[str, asyncio.Task] = {}
 
-    def generate_sequential_session_id(self, prefix: str = "session") -> str:
+    async def generate_sequential_session_id(self, prefix: str = "session") -> str:
         """
         Redisのカウンターを使用してシーケンシャルIDを生成
         """
         counter_key = f"{prefix}:counter"
-        session_number = self.redis_client.incr(counter_key)
-        session_id = f"{prefix}:{session_number:06d}"  # session:000001
-        self.redis_client.expire(session_id, 3600)  # 1時間後に期限切れ
-        return session_id
+        session_id = await self._create_session(
+            keys=[counter_key, self.index_key], args=[prefix, int(time.time()), SESSION_TTL_SECONDS]
+        )
+        return session_id.decode("utf-8") if isinstance(session_id, bytes) else session_id  # session:000001
 
-    def save_conversation(self, session_id: str, conversation: dict) -> None:
+    async def save_conversation(self, session_id: str, conversation: dict) -> None:
         """
         ユーザーの会話をRedisに保存
+        追加・件数の切り詰め・有効期限の延長を1回のパイプラインで送る
         """
         key = session_id
-        self.redis_client.rpush(key, json.dumps(conversation, ensure_ascii=False))
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, _encode_turn(conversation))
+            pipe.ltrim(key, -SESSION_MAX_TURNS, -1)
+            pipe.expire(key, SESSION_TTL_SECONDS)
+            pipe.zadd(self.index_key, {key: int(time.time()) + SESSION_TTL_SECONDS})
+            await pipe.execute()
+
+    def save_conversation_background(self, session_id: str, conversation: dict) -> None:
+        """
+        ユーザーの会話をバックグラウンドでRedisに保存（後書き）
+        同じセッションの書き込みは順番通りに実行される
+        """
+        previous = self._pending.get(session_id)
+        task = asyncio.create_task(self._write_behind(session_id, conversation, previous))
+        self._pending[session_id] = task
+
+        def _cleanup(done: asyncio.Task) -> None:
+            if self._pending.get(session_id) is done:
+                del self._pending[session_id]
 
-    def get_conversation(self, session_id: str) -> list[dict]:
+        task.add_done_callback(_cleanup)
+
+    async def _write_behind(self, session_id: str, conversation: dict, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await previous
+        try:
+            with stage("redis_write"):
+                await self.save_conversation(session_id=session_id, conversation=conversation)
+        except Exception as e:
+            print(f"会話履歴の保存に失敗しました ({session_id}): {e}")
+
+    async def get_conversation(self, session_id: str) -> list[dict]:
         """
         ユーザーの会話をRedisから取得
         """
+        # 同じセッションの書き込み待ちがあれば、その完了を待ってから読む
+        pending = self._pending.get(session_id)
+        if pending is not None:
+            await asyncio.shield(pending)
+
         key = session_id
         # 最新の3つの会話履歴を取得
-        return [json.loads(item) for item in self.redis_client.lrange(key, -3, -1)]
+        return [_decode_turn(item) for item in await self.redis_client.lrange(key, -3, -1)]
+
+    async def stats(self) -> dict:
+        """
+        アクティブなセッション数と、会話履歴が使用しているメモリ量を返す
+        セッション数が多い場合は一部をサンプリングして全体を推定する
+        """
+        now = int(time.time())
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self.index_key, "-inf", now)
+            pipe.zcard(self.index_key)
+            pipe.zrange(self.index_key, 0, STATS_SAMPLE_SIZE - 1)
+            _, active_sessions, sampled = await pipe.execute()
+
+        sampled_bytes = 0
+        stored_turns = 0
+        if sampled:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for session_id in sampled:
+                    pipe.memory_usage(session_id)
+                    pipe.llen(session_id)
+                results = await pipe.execute()
+            sampled_bytes = sum(usage or 0 for usage in results[0::2])
+            stored_turns = sum(results[1::2])
+
+        scale = active_sessions / len(sampled) if sampled else 0
+        return {
+            "active_sessions": active_sessions,
+            "bytes_used": int(sampled_bytes * scale),
+            "stored_turns": int(stored_turns * scale),
+            "sampled_sessions": len(sampled),
+            "ttl_seconds": SESSION_TTL_SECONDS,
+            "max_turns": SESSION_MAX_TURNS,
+        }
+
+    async def flush(self) -> None:
+        """
+        書き込み待ちの会話履歴を全て保存し終えるまで待つ
+        """
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
 
 
 def get_manager(redis_client) -> ConversationManager:
     """ChatServiceのシングルトンインスタンスを取得"""
-    global _manager_instance
-    if _manager_instance is None:
+    global _manager_instance, _manager_pid
+    if _manager_instance is None or _manager_pid != os.getpid():
         _manager_instance = ConversationManager(redis_client)
-    return _manager_instance
\ No newline at end of file
+        _manager_pid = os.getpid()
+    return _manager_instance
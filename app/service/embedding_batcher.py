@@ -0,0 +1,112 @@
+import asyncio
+from typing import Awaitable, Callable
+from google import genai
+from google.genai.types import EmbedContentConfig
+
+
+def gemini_batch_embedder(
+    client: genai.Client, model_name: str, task_type: str, dimensionality: int
+) -> Callable[[list[str]], Awaitable[list[list[float]]]]:
+    """
+    複数のテキストを1回の embed_content で埋め込む関数を返す
+    """
+    config = EmbedContentConfig(task_type=task_type, output_dimensionality=dimensionality)
+
+    async def embed_batch(texts: list[str]) -> list[list[float]]:
+        result = await client.aio.models.embed_content(model=model_name, contents=texts, config=config)
+        return [embedding.values for embedding in result.embeddings]
+
+    return embed_batch
+
+
+class EmbeddingBatcher:
+    """
+    同時に届いたクエリの埋め込みをまとめて1回のAPI呼び出しで行うクラス
+    最初のクエリから window_ms 経過するか、max_batch_size 件たまった時点で送信し、
+    それぞれの呼び出し元に対応するベクトルを返す
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[list[str]], Awaitable[list[list[float]]]],
+        max_batch_size: int = 32,
+        window_ms: float = 5.0,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.window_ms = window_ms
+
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # 送信中のタスクがGCされないよう参照を保持する
+        self._tasks: set[asyncio.Task] = set()
+
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.max_batch = 0
+        self.errors = 0
+
+    async def embed(self, text: str) -> list[float]:
+        """
+        テキストを次のバッチに加え、そのベクトルを返す
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # 同じバッチ内の同じテキストは1回だけ埋め込む
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.texts += len(texts)
+        self.max_batch = max(self.max_batch, len(texts))
+        try:
+            vectors = await self.embed_batch(texts)
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            self.errors += 1
+            print(f"クエリ埋め込みのバッチ ({len(texts)}件) に失敗しました: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        results = dict(zip(texts, vectors))
+        for text, future in batch:
+            # 待っている間に呼び出し元がキャンセルされた場合は結果を捨てる
+            if not future.done():
+                future.set_result(list(results[text]))
+
+    def stats(self) -> dict:
+        """
+        API呼び出し回数と平均バッチサイズなどを返す
+        """
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch,
+            "calls_saved": self.requests - self.batches,
+            "errors": self.errors,
+        }
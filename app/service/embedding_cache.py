@@ -0,0 +1,149 @@
+import asyncio
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """
+    キャッシュキー用にクエリ文字列を正規化する
+    全角/半角の揺れ(NFKC)、前後・連続する空白、大文字小文字を吸収する
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+class EmbeddingCache:
+    """
+    クエリ埋め込みの2段キャッシュ
+    1段目はプロセス内のLRU、2段目はRedisに float32 のバイト列として共有する
+    """
+
+    def __init__(
+        self,
+        embed_model,
+        model_name: str,
+        task_type: str,
+        dimensionality: int,
+        redis_client=None,
+        max_size: int = 2048,
+        ttl: int = 86400,
+        prefix: str = "embcache",
+        batcher=None,
+    ):
+        # redis_client は decode_responses=False の redis.asyncio.Redis を想定
+        self.embed_model = embed_model
+        self.model_name = model_name
+        self.task_type = task_type
+        self.dimensionality = dimensionality
+        self.redis_client = redis_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prefix = prefix
+        # 指定されていればキャッシュミスしたクエリを同時リクエスト間でまとめて埋め込む（EmbeddingBatcher）
+        self.batcher = batcher
+
+        self._memory: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    def _make_key(self, query: str) -> str:
+        raw = f"{self.model_name}|{self.task_type}|{self.dimensionality}|{normalize_query(query)}"
+        return f"{self.prefix}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    def _get_memory(self, key: str) -> Optional[np.ndarray]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return vector
+
+    def _set_memory(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = (time.monotonic() + self.ttl, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    async def _get_redis(self, key: str) -> Optional[np.ndarray]:
+        if self.redis_client is None:
+            return None
+        try:
+            blob = await self.redis_client.get(key)
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"埋め込みキャッシュ(Redis)の読み込みに失敗しました: {e}")
+            return None
+        if blob is None:
+            return None
+        vector = np.frombuffer(blob, dtype=np.float32)
+        if vector.shape[0] != self.dimensionality:
+            return None
+        return vector
+
+    async def _set_redis(self, key: str, vector: np.ndarray) -> None:
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.set(key, vector.tobytes(), ex=self.ttl)
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"埋め込みキャッシュ(Redis)の書き込みに失敗しました: {e}")
+
+    async def get_query_embedding(self, query: str) -> list[float]:
+        """
+        クエリの埋め込みを取得する
+        LRU → Redis → 埋め込みモデル の順に参照し、見つかった段より上の段を埋める
+        """
+        key = self._make_key(query)
+
+        vector = self._get_memory(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector.tolist()
+
+        vector = await self._get_redis(key)
+        if vector is not None:
+            self.redis_hits += 1
+            self._set_memory(key, vector)
+            return vector.tolist()
+
+        self.misses += 1
+        if self.batcher is not None:
+            embedding = await self.batcher.embed(query)
+        else:
+            embedding = await self.embed_model.aget_query_embedding(query)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._set_memory(key, vector)
+        await self._set_redis(key, vector)
+        return embedding
+
+    async def get_query_embeddings(self, queries: list[str]) -> list[list[float]]:
+        """
+        複数のクエリの埋め込みをまとめて取得する
+        正規化すると同じになるクエリは1回だけ引き、キャッシュミスしたものは同時に埋め込む（batcher があれば数回のAPI呼び出しにまとまる）
+        """
+        unique = {self._make_key(query): query for query in queries}
+        vectors = dict(zip(unique, await asyncio.gather(*[self.get_query_embedding(query) for query in unique.values()])))
+        return [vectors[self._make_key(query)] for query in queries]
+
+    def stats(self) -> dict:
+        """
+        キャッシュのヒット/ミス数を返す
+        """
+        lookups = self.memory_hits + self.redis_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "redis_errors": self.redis_errors,
+            "hit_rate": (self.memory_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "memory_size": len(self._memory),
+        }
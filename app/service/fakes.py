@@ -0,0 +1,257 @@
+import os
+import zlib
+import asyncio
+from typing import Any, AsyncGenerator, Optional, Sequence
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQuery, VectorStoreQueryResult
+
+# CHAT_BACKEND=fake のときに Gemini・Qdrant の代わりに使う、決まった結果と遅延を返すスタンドイン
+# 遅延は "fixed:ミリ秒" / "uniform:最小:最大" / "normal:平均:標準偏差" / "lognormal:中央値:シグマ" で指定する
+
+FAKE_TOPICS = [
+    ("ログイン", "トップページの「ログイン」ボタンを押し、IDとパスワードを入力してログインします。"),
+    ("投稿作成", "メニューの「投稿」から「新規作成」を選び、タイトルと本文を入力して「保存」を押します。"),
+    ("有給休暇の申請", "「申請」メニューの「休暇申請」で日付と種別を選び、承認者を指定して送信します。"),
+    ("パスワード変更", "右上のアカウントメニューから「設定」を開き、「パスワード変更」で新しいパスワードを入力します。"),
+    ("通知設定", "「設定」の「通知」タブで、メール通知とブラウザ通知のオン・オフを切り替えられます。"),
+    ("ファイル共有", "「ドキュメント」画面でファイルをドラッグ＆ドロップし、共有範囲を選んでアップロードします。"),
+    ("スケジュール登録", "「カレンダー」で日付をクリックし、予定名・時間・参加者を入力して登録します。"),
+    ("検索", "画面上部の検索欄にキーワードを入力すると、投稿・ファイル・ユーザーを横断して検索できます。"),
+]
+
+
+class Latency:
+    """
+    乱数で遅延時間を決めるクラス（シードを固定すれば同じ順序で同じ遅延になる）
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: int = 0):
+        kind, *params = spec.split(":")
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(value) for value in params]
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_env(cls, name: str, default: str, seed: int = 0) -> "Latency":
+        return cls(os.getenv(name, default), seed=seed)
+
+    def sample(self) -> float:
+        """
+        遅延時間（秒）を1つ返す
+        """
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self.rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            ms = self.rng.normal(self.params[0], self.params[1])
+        else:
+            ms = self.params[0] * np.exp(self.rng.normal(0.0, self.params[1]))
+        return max(float(ms), 0.0) / 1000
+
+    async def sleep(self) -> None:
+        seconds = self.sample()
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+
+def _fake_answer(prompt: str, tokens: int) -> list[str]:
+    """
+    プロンプトの質問部分から決まった回答を作り、ストリーミング用のチャンクに分けて返す
+    """
+    query = prompt.split("# 質問", 1)[-1].strip().split("\n", 1)[0] if "# 質問" in prompt else prompt.strip()[:40]
+    chunks = [f"「{query}」についてのテスト用の回答です。"]
+    for i in range(max(tokens // 8 - 1, 0)):
+        topic, text = FAKE_TOPICS[(zlib.crc32(query.encode("utf-8")) + i) % len(FAKE_TOPICS)]
+        chunks.append(f"\n{i + 1}. {topic}: {text}")
+    return chunks
+
+
+class FakeLLM(CustomLLM):
+    """
+    GoogleGenAI の代わりに決まった回答を返すLLM
+    応答全体（非ストリーミング）または最初のチャンクまでに latency、以降のチャンクごとに chunk_latency だけ待つ
+    """
+
+    answer_tokens: int = 200
+    _latency: Latency = PrivateAttr()
+    _chunk_latency: Latency = PrivateAttr()
+
+    def __init__(self, latency: Latency, chunk_latency: Latency, answer_tokens: int = 200, **kwargs: Any):
+        super().__init__(answer_tokens=answer_tokens, **kwargs)
+        self._latency = latency
+        self._chunk_latency = chunk_latency
+
+    @classmethod
+    def from_env(cls, seed: int = 0) -> "FakeLLM":
+        return cls(
+            latency=Latency.from_env("FAKE_LLM_LATENCY", "lognormal:800:0.4", seed=seed),
+            chunk_latency=Latency.from_env("FAKE_LLM_CHUNK_LATENCY", "fixed:30", seed=seed + 1),
+            answer_tokens=int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "200")),
+        )
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm", context_window=1_000_000, num_output=self.answer_tokens)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text="".join(_fake_answer(prompt, self.answer_tokens)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for chunk in _fake_answer(prompt, self.answer_tokens):
+                text += chunk
+                yield CompletionResponse(text=text, delta=chunk)
+
+        return gen()
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        chunks = _fake_answer(prompt, self.answer_tokens)
+        await asyncio.sleep(self._latency.sample() + sum(self._chunk_latency.sample() for _ in chunks[1:]))
+        return CompletionResponse(text="".join(chunks))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> AsyncGenerator[CompletionResponse, None]:
+        async def gen() -> AsyncGenerator[CompletionResponse, None]:
+            text = ""
+            await self._latency.sleep()
+            for i, chunk in enumerate(_fake_answer(prompt, self.answer_tokens)):
+                if i > 0:
+                    await self._chunk_latency.sleep()
+                text += chunk
+                yield CompletionResponse(text=text, delta=chunk)
+
+        return gen()
+
+
+def _hash_embedding(text: str, dimensionality: int) -> list[float]:
+    """
+    文字の2-gram を特徴ハッシュしたベクトル（似た文字列ほど類似度が高くなる決定的な埋め込み）
+    """
+    vector = np.zeros(dimensionality, dtype=np.float32)
+    for i in range(max(len(text) - 1, 1)):
+        h = zlib.crc32(text[i:i + 2].encode("utf-8"))
+        vector[h % dimensionality] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+
+class FakeEmbedding(BaseEmbedding):
+    """
+    GoogleGenAIEmbedding の代わりに決定的なベクトルを返す埋め込みモデル
+    """
+
+    dimensionality: int = 768
+    _latency: Latency = PrivateAttr()
+
+    def __init__(self, dimensionality: int, latency: Latency, **kwargs: Any):
+        super().__init__(model_name="fake-embedding", dimensionality=dimensionality, **kwargs)
+        self._latency = latency
+
+    @classmethod
+    def from_env(cls, dimensionality: int, seed: int = 0) -> "FakeEmbedding":
+        return cls(dimensionality, Latency.from_env("FAKE_EMBED_LATENCY", "lognormal:120:0.3", seed=seed + 2))
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return _hash_embedding(query, self.dimensionality)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        await self._latency.sleep()
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return _hash_embedding(text, self.dimensionality)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        await self._latency.sleep()
+        return self._get_text_embedding(text)
+
+    async def aembed_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        EmbeddingBatcher 用のバッチ埋め込み（件数によらず1回分の遅延）
+        """
+        await self._latency.sleep()
+        return [_hash_embedding(text, self.dimensionality) for text in texts]
+
+
+def build_fake_corpus(embed_model: FakeEmbedding, documents: int = 50) -> list[TextNode]:
+    """
+    FAKE_TOPICS を組み合わせた擬似的な文書のチャンクを作る
+    """
+    nodes = []
+    for i in range(documents):
+        topic, text = FAKE_TOPICS[i % len(FAKE_TOPICS)]
+        file_path = f"data/fake_{i:03d}.md"
+        body = f"# {topic}の方法\n{text}\n操作画面は https://tuna.example.com/{i} から開けます。"
+        nodes.append(TextNode(
+            id_=f"fake-{i:05d}",
+            text=body,
+            metadata={"file_path": file_path, "file_name": os.path.basename(file_path)},
+            start_char_idx=0,
+            end_char_idx=len(body),
+            embedding=embed_model.get_text_embedding(body),
+        ))
+    return nodes
+
+
+class FakeVectorStore(BasePydanticVectorStore):
+    """
+    Qdrant の代わりにメモリ上のノードを総当たりで検索するベクトルストア
+    """
+
+    stores_text: bool = True
+    _nodes: list[BaseNode] = PrivateAttr(default_factory=list)
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+    _latency: Latency = PrivateAttr()
+
+    def __init__(self, latency: Latency, nodes: Sequence[BaseNode] = (), **kwargs: Any):
+        super().__init__(**kwargs)
+        self._latency = latency
+        self.add(list(nodes))
+
+    @classmethod
+    def from_env(cls, embed_model: FakeEmbedding, seed: int = 0) -> "FakeVectorStore":
+        return cls(
+            latency=Latency.from_env("FAKE_VECTOR_LATENCY", "lognormal:8:0.5", seed=seed + 3),
+            nodes=build_fake_corpus(embed_model, int(os.getenv("FAKE_CORPUS_SIZE", "50"))),
+        )
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def add(self, nodes: list[BaseNode], **kwargs: Any) -> list[str]:
+        self._nodes.extend(nodes)
+        self._matrix = np.asarray([node.get_embedding() for node in self._nodes], dtype=np.float32) if self._nodes else None
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **kwargs: Any) -> None:
+        self._nodes = [node for node in self._nodes if node.ref_doc_id != ref_doc_id]
+        self._matrix = np.asarray([node.get_embedding() for node in self._nodes], dtype=np.float32) if self._nodes else None
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if self._matrix is None or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        scores = self._matrix @ np.asarray(query.query_embedding, dtype=np.float32)
+        rows = np.argsort(-scores)[: query.similarity_top_k]
+        return VectorStoreQueryResult(
+            nodes=[self._nodes[row] for row in rows],
+            similarities=[float(scores[row]) for row in rows],
+            ids=[self._nodes[row].node_id for row in rows],
+        )
+
+    async def aquery(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        await self._latency.sleep()
+        return self.query(query, **kwargs)
@@ -0,0 +1,243 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from service.metrics import ADMISSIONS, STAGE_TIMEOUTS
+
+T = TypeVar("T")
+
+
+class AdmissionRejected(Exception):
+    """
+    同時実行数の上限に達し、待ち行列もいっぱい（または待ちきれなかった）ためにリクエストを断ったことを表す例外
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"too many concurrent chat requests ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class StageTimeout(Exception):
+    """
+    処理段階（埋め込み・検索・LLM）が制限時間内に終わらなかったことを表す例外
+    """
+
+    def __init__(self, stage: str, seconds: float):
+        super().__init__(f"{stage} timed out after {seconds}s")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class ClientDisconnected(Exception):
+    """
+    処理中に HTTP クライアントが切断したことを表す例外
+    """
+
+
+class AdmissionLease:
+    """
+    受け付けたリクエストが持つ実行枠（slots 個。release は何度呼んでもよい）
+    """
+
+    def __init__(self, controller: "AdmissionController", slots: int = 1):
+        self._controller = controller
+        self.slots = slots
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self.slots)
+
+    async def __aenter__(self) -> "AdmissionLease":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """
+    チャットの同時実行数を max_concurrent に制限するクラス
+    枠が空いていなければ max_queue 件まで最大 queue_timeout 秒待たせ、それを超えるリクエストはすぐに断る
+    （Gemini の呼び出しを抱えたリクエストを無制限に受けると、割り当て量を使い切って全員のレイテンシが伸びるため）
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_queue: int = 64, queue_timeout: float = 2.0, retry_after: int = 1):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # 枠を取る処理は1つずつ順番に行う（複数枠を待つリクエスト同士が一部ずつ取り合い、互いを待ち続けないように）
+        self._lock = asyncio.Lock()
+
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.max_queued = 0
+
+    async def acquire(self, slots: int = 1) -> AdmissionLease:
+        """
+        実行枠を slots 個（max_concurrent まで）まとめて取得する。断る場合は AdmissionRejected を送出する
+        全部の枠が取れるまで待ち、待ちきれなければ取得済みの枠も返す（一部だけ持ったまま待ち続けることはない）
+        """
+        slots = max(1, min(slots, self.max_concurrent))
+        if self._lock.locked() or self.max_concurrent - self.active < slots:
+            if self.queued >= self.max_queue:
+                self._reject("queue_full")
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            try:
+                await asyncio.wait_for(self._take(slots), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout")
+            finally:
+                self.queued -= 1
+        else:
+            await self._take(slots)
+        self.active += slots
+        self.admitted += 1
+        ADMISSIONS.inc(result="admitted")
+        return AdmissionLease(self, slots)
+
+    async def _take(self, slots: int) -> None:
+        async with self._lock:
+            taken = 0
+            try:
+                for _ in range(slots):
+                    await self._semaphore.acquire()
+                    taken += 1
+            except BaseException:
+                for _ in range(taken):
+                    self._semaphore.release()
+                raise
+
+    def _reject(self, reason: str) -> None:
+        if reason == "queue_full":
+            self.rejected_queue_full += 1
+        else:
+            self.rejected_timeout += 1
+        ADMISSIONS.inc(result=f"rejected_{reason}")
+        raise AdmissionRejected(reason, self.retry_after)
+
+    def _release(self, slots: int = 1) -> None:
+        self.active -= slots
+        for _ in range(slots):
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+
+async def with_timeout(stage: str, seconds: Optional[float], awaitable: Awaitable[T]) -> T:
+    """
+    awaitable を seconds 秒で打ち切る（seconds が None・0 以下なら制限しない）
+    """
+    if not seconds or seconds <= 0:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=seconds)
+    except asyncio.TimeoutError:
+        STAGE_TIMEOUTS.inc(stage=stage)
+        raise StageTimeout(stage, seconds) from None
+
+
+async def _close(iterator: AsyncIterator, pending: Optional[asyncio.Future]) -> None:
+    """
+    ストリームを閉じる。次の要素を待っている途中であればそれをキャンセルする（例外とともにストリームも終了する）
+    実行中のストリームに aclose() を呼ぶとエラーになるため、待っている途中の場合は呼ばない
+    """
+    if pending is None or pending.done():
+        await iterator.aclose()
+    else:
+        pending.cancel()
+
+
+async def iterate_with_timeout(stage: str, iterator: AsyncIterator[T], first_seconds: Optional[float], next_seconds: Optional[float]) -> AsyncIterator[T]:
+    """
+    ストリームの最初の要素は first_seconds 秒、以降の要素は前の要素から next_seconds 秒以内に届かなければ打ち切る
+    """
+    seconds = first_seconds
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=seconds if seconds and seconds > 0 else None)
+            if not done:
+                STAGE_TIMEOUTS.inc(stage=stage)
+                raise StageTimeout(stage, seconds)
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            seconds = next_seconds
+            yield item
+    finally:
+        await _close(iterator, pending)
+
+
+async def _race_disconnect(disconnected: asyncio.Future, task: asyncio.Future) -> T:
+    """
+    task とクライアントの切断のどちらか早い方を待ち、切断が先なら task をキャンセルして ClientDisconnected を送出する
+    """
+    try:
+        done, _ = await asyncio.wait({task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if task in done:
+        return task.result()
+    task.cancel()
+    raise ClientDisconnected()
+
+
+def _stop_watching(disconnected: asyncio.Future) -> None:
+    if disconnected.done():
+        if not disconnected.cancelled():
+            # 接続の監視自体の失敗は切断として扱ったので、例外は読み捨てる
+            disconnected.exception()
+    else:
+        disconnected.cancel()
+
+
+async def cancel_on_disconnect(wait_disconnect: Callable[[], Awaitable[None]], awaitable: Awaitable[T]) -> T:
+    """
+    wait_disconnect（クライアントが切断すると完了する）と並行して awaitable を待ち、
+    切断されたら処理をキャンセルして ClientDisconnected を送出する（検索・LLM の呼び出しを最後まで続けない）
+    """
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    try:
+        return await _race_disconnect(disconnected, asyncio.ensure_future(awaitable))
+    finally:
+        _stop_watching(disconnected)
+
+
+async def iterate_until_disconnect(wait_disconnect: Callable[[], Awaitable[None]], iterator: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    ストリームの次の要素を待つ間もクライアントの切断を監視し、切断されたらストリームの生成をキャンセルする
+    """
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            try:
+                item = await _race_disconnect(disconnected, pending)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        _stop_watching(disconnected)
+        await _close(iterator, pending)
@@ -0,0 +1,185 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Sequence
+
+# リクエストごとの処理段階の所要時間（Server-Timing ヘッダー用）。ミドルウェアがリクエストの開始時に空のリストを設定する
+_request_timings: ContextVar[Optional[list[tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+INF_LABEL = 'le="+Inf"'
+
+
+def _format_labels(labelnames: Sequence[str], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # ラベルの組 -> (バケットごとの件数, 合計, 件数)
+        self._series: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_LABEL)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Prometheus のテキスト形式で出力するメトリクスの登録先
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, labelnames: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, help, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges: Optional[dict] = None) -> str:
+        """
+        登録済みのメトリクスと、各コンポーネントの stats() から作るゲージをテキスト形式で返す
+        """
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, value in sorted(_flatten_gauges(gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten_gauges(stats: dict, prefix: str = "") -> dict[str, float]:
+    """
+    入れ子の stats() の数値だけを chat_<コンポーネント>_<項目> の名前に平らにする
+    """
+    gauges: dict[str, float] = {}
+    for key, value in stats.items():
+        name = f"{prefix}_{key}" if prefix else key
+        if isinstance(value, dict):
+            gauges.update(_flatten_gauges(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauges[name] = value
+    return gauges
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "chat_stage_duration_seconds", "Time spent in each stage of a chat request.", labelnames=("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response headers are sent.", labelnames=("method", "path", "status")
+)
+TOKENS = REGISTRY.histogram(
+    "chat_tokens", "Approximate tokens per request (prompt, reference, cached instruction, completion).", buckets=TOKEN_BUCKETS, labelnames=("kind",)
+)
+RETRIEVED_NODES = REGISTRY.histogram(
+    "chat_retrieved_nodes", "Retrieved and relevant nodes per request.", buckets=COUNT_BUCKETS, labelnames=("kind",)
+)
+ANSWERS = REGISTRY.counter("chat_answers_total", "Chat answers by where they came from.", labelnames=("source",))
+ADMISSIONS = REGISTRY.counter(
+    "chat_admissions_total", "Chat requests admitted or rejected by the concurrency limiter.", labelnames=("result",)
+)
+STAGE_TIMEOUTS = REGISTRY.counter("chat_stage_timeouts_total", "Chat stages that hit their timeout.", labelnames=("stage",))
+CLIENT_DISCONNECTS = REGISTRY.counter(
+    "chat_client_disconnects_total", "Chat requests cancelled because the client disconnected.", labelnames=("endpoint",)
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    処理段階の所要時間をヒストグラムと、リクエストの Server-Timing 用のリストに記録する
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name: str, elapsed: float) -> None:
+    """
+    計測済みの所要時間を記録する（with で囲めないストリーミングの段階に使う）
+    """
+    STAGE_SECONDS.observe(elapsed, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, elapsed))
+
+
+def start_request_timings() -> list[tuple[str, float]]:
+    timings: list[tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: list[tuple[str, float]], total: float) -> str:
+    """
+    Server-Timing ヘッダーの値を作る（同じ段階が複数回あれば合計する）
+    """
+    durations: dict[str, float] = {}
+    for name, elapsed in timings:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    entries = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in durations.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
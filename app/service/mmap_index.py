@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import struct
+from typing import Optional
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+# ファイル形式: マジック(4) + ヘッダ長(uint32) + ヘッダJSON, 続いて
+# ベクトル行列 (count x dim, 正規化済み) / ペイロードの位置 (int64, count+1) / ペイロード (UTF-8 JSON の連結)
+MAGIC = b"MMVI"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# float16 の行列は一度に float32 へ変換する行数を区切って内積を取る
+SEARCH_BLOCK_ROWS = 4096
+# ファイルが差し替えられていないかを確認する間隔（秒）
+RELOAD_CHECK_SECONDS = 1.0
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_index(path: str, ids: list[str], vectors: np.ndarray, payloads: list[dict], collection: str, dtype: str = "float32") -> None:
+    """
+    ベクトルとQdrantのペイロードを1つのファイルに書き出す関数
+    一時ファイルに書いてから置き換えるため、検索中のプロセスは古いファイルを読み続けられる
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = (vectors / np.where(norms == 0, 1, norms)).astype(dtype)
+
+    records = [json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False).encode("utf-8") for point_id, payload in zip(ids, payloads)]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(record) for record in records])
+
+    header = {
+        "version": FORMAT_VERSION,
+        "collection": collection,
+        "dtype": dtype,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    # 位置はヘッダ長に依存するため、ヘッダ長が固定になるまで計算し直す
+    header.update(vectors_offset=0, offsets_offset=0, payload_offset=0)
+    while True:
+        header_bytes = json.dumps(header).encode("utf-8")
+        vectors_offset = _align(8 + len(header_bytes))
+        offsets_offset = _align(vectors_offset + vectors.nbytes)
+        payload_offset = _align(offsets_offset + offsets.nbytes)
+        if (header["vectors_offset"], header["offsets_offset"], header["payload_offset"]) == (vectors_offset, offsets_offset, payload_offset):
+            break
+        header.update(vectors_offset=vectors_offset, offsets_offset=offsets_offset, payload_offset=payload_offset)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        f.seek(vectors_offset)
+        f.write(vectors.tobytes())
+        f.seek(offsets_offset)
+        f.write(offsets.tobytes())
+        f.seek(payload_offset)
+        for record in records:
+            f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MmapVectorIndex:
+    """
+    エクスポートしたファイルをメモリマップして、NumPyの内積で top-k 検索するインデックス
+    ファイルはページキャッシュを介して全ワーカープロセスで共有され、
+    差し替えられると次の検索で読み込み直す
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header: dict = {}
+        self._buffer: Optional[np.memmap] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._stat: Optional[tuple[int, int]] = None
+        self._checked_at = 0.0
+        self.searches = 0
+        self.reloads = 0
+        self._load()
+
+    def _load(self) -> None:
+        stat = os.stat(self.path)
+        buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(buffer[:4]) != MAGIC:
+            raise ValueError(f"{self.path} はメモリマップインデックスのファイルではありません。")
+        header_length = struct.unpack("<I", bytes(buffer[4:8]))[0]
+        header = json.loads(bytes(buffer[8:8 + header_length]))
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{self.path} の形式バージョンに対応していません。")
+
+        count, dim = header["count"], header["dim"]
+        self._vectors = np.frombuffer(buffer, dtype=header["dtype"], count=count * dim, offset=header["vectors_offset"]).reshape(count, dim)
+        self._offsets = np.frombuffer(buffer, dtype=np.int64, count=count + 1, offset=header["offsets_offset"])
+        self._buffer = buffer
+        self.header = header
+        self._stat = (stat.st_ino, stat.st_mtime_ns)
+        print(f"Memory-mapped index loaded: {count} vectors ({header['dtype']}) from '{header['collection']}'.")
+
+    def refresh(self) -> None:
+        """
+        確認の間隔を待たずに、ファイルが差し替えられていれば読み込み直す
+        """
+        self._reload_if_changed(force=True)
+
+    def _reload_if_changed(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) != self._stat:
+            self._load()
+            self.reloads += 1
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        if self._vectors.dtype == np.float32:
+            return self._vectors @ query
+        scores = np.empty(self._vectors.shape[0], dtype=np.float32)
+        for start in range(0, self._vectors.shape[0], SEARCH_BLOCK_ROWS):
+            block = self._vectors[start:start + SEARCH_BLOCK_ROWS]
+            scores[start:start + block.shape[0]] = block.astype(np.float32) @ query
+        return scores
+
+    def _payload(self, row: int) -> dict:
+        start = self.header["payload_offset"] + int(self._offsets[row])
+        end = self.header["payload_offset"] + int(self._offsets[row + 1])
+        return json.loads(bytes(self._buffer[start:end]))
+
+    def search(self, embedding: list[float], top_k: int = 10) -> list[NodeWithScore]:
+        """
+        クエリ埋め込みとのコサイン類似度が高い順にノードを返す関数
+        """
+        self._reload_if_changed()
+        self.searches += 1
+        count = self._vectors.shape[0]
+        if count == 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if query.shape[0] != self._vectors.shape[1] or norm == 0:
+            return []
+        scores = self._scores(query / norm)
+
+        k = min(top_k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for row in top:
+            record = self._payload(int(row))
+            node = metadata_dict_to_node(record["payload"])
+            node.id_ = record["id"]
+            results.append(NodeWithScore(node=node, score=float(scores[row])))
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "collection": self.header.get("collection"),
+            "exported_at": self.header.get("exported_at"),
+            "dtype": self.header.get("dtype"),
+            "count": self.header.get("count", 0),
+            "bytes": int(self._buffer.shape[0]) if self._buffer is not None else 0,
+            "searches": self.searches,
+            "reloads": self.reloads,
+        }
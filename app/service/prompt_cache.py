@@ -0,0 +1,207 @@
+import time
+import uuid
+import asyncio
+import hashlib
+from typing import Callable, Optional
+from google import genai
+from google.genai import types
+from llama_index.core.utils import get_tokenizer
+
+
+class GeminiCacheBackend:
+    """
+    Gemini のコンテキストキャッシュ (client.aio.caches) を操作するバックエンド
+    """
+
+    def __init__(self, client: genai.Client, model: str):
+        self.client = client
+        self.model = model
+
+    async def find(self, display_name: str) -> Optional[tuple[str, float]]:
+        """
+        同じ表示名のキャッシュがあれば (名前, 残り秒数) を返す（他のワーカーが作成したものを共有する）
+        """
+        async for cache in await self.client.aio.caches.list():
+            if cache.display_name == display_name and cache.expire_time is not None:
+                return cache.name, cache.expire_time.timestamp() - time.time()
+        return None
+
+    async def create(self, display_name: str, system_instruction: str, ttl_seconds: int) -> str:
+        cache = await self.client.aio.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                display_name=display_name,
+                system_instruction=system_instruction,
+                ttl=f"{ttl_seconds}s",
+            ),
+        )
+        return cache.name
+
+    async def refresh(self, name: str, ttl_seconds: int) -> None:
+        await self.client.aio.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl_seconds}s"))
+
+
+class StubCacheError(Exception):
+    pass
+
+
+class StubCacheBackend:
+    """
+    オフライン確認用のキャッシュバックエンド
+    キャッシュを時計付きでメモリに保持し、実APIと同じく期限切れや最小トークン数未満を拒否する
+    """
+
+    def __init__(self, min_tokens: int = 0, clock: Callable[[], float] = time.time, tokenizer=None):
+        self.min_tokens = min_tokens
+        self.clock = clock
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.caches: dict[str, dict] = {}
+
+    async def find(self, display_name: str) -> Optional[tuple[str, float]]:
+        for name, cache in self.caches.items():
+            remaining = cache["expires_at"] - self.clock()
+            if cache["display_name"] == display_name and remaining > 0:
+                return name, remaining
+        return None
+
+    async def create(self, display_name: str, system_instruction: str, ttl_seconds: int) -> str:
+        tokens = len(self.tokenizer(system_instruction))
+        if tokens < self.min_tokens:
+            raise StubCacheError(f"cached content is too small ({tokens} < {self.min_tokens} tokens)")
+        name = f"cachedContents/stub-{uuid.uuid4().hex[:12]}"
+        self.caches[name] = {
+            "display_name": display_name,
+            "tokens": tokens,
+            "expires_at": self.clock() + ttl_seconds,
+        }
+        return name
+
+    async def refresh(self, name: str, ttl_seconds: int) -> None:
+        cache = self.caches.get(name)
+        if cache is None or cache["expires_at"] <= self.clock():
+            raise StubCacheError(f"{name} not found")
+        cache["expires_at"] = self.clock() + ttl_seconds
+
+    def input_tokens(self, generation_config: dict, prompt: str) -> int:
+        """
+        リクエストごとに新たに処理される入力トークン数（キャッシュ済みの部分は含まない）
+        """
+        tokens = len(self.tokenizer(prompt))
+        name = generation_config.get("cached_content")
+        if name is not None:
+            cache = self.caches.get(name)
+            if cache is None or cache["expires_at"] <= self.clock():
+                raise StubCacheError(f"{name} not found")
+            return tokens
+        return tokens + len(self.tokenizer(generation_config.get("system_instruction") or ""))
+
+
+class PromptCache:
+    """
+    固定のシステム指示をプロバイダーのコンテキストキャッシュに登録し、
+    期限が近づいたら延長して、リクエストごとの generation_config を返すクラス
+    キャッシュを使えない場合（最小トークン数未満・APIエラー等）は、システム指示をそのまま送る
+    """
+
+    def __init__(
+        self,
+        backend,
+        system_instruction: str,
+        model: str,
+        ttl_seconds: int = 3600,
+        refresh_margin_seconds: int = 300,
+        retry_seconds: int = 600,
+        clock: Callable[[], float] = time.monotonic,
+        tokenizer=None,
+    ):
+        self.backend = backend
+        self.system_instruction = system_instruction.strip()
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        # 指示文かモデルが変われば別のキャッシュになる
+        digest = hashlib.sha256(f"{model}\n{self.system_instruction}".encode("utf-8")).hexdigest()[:16]
+        self.display_name = f"system-instruction-{digest}"
+        self.static_tokens = len((tokenizer or get_tokenizer())(self.system_instruction))
+
+        self._name: Optional[str] = None
+        self._expires_at = 0.0
+        self._disabled_until = 0.0
+        self._lock = asyncio.Lock()
+
+        self.cached_requests = 0
+        self.inline_requests = 0
+        self.creates = 0
+        self.adopted = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def inline_config(self) -> dict:
+        self.inline_requests += 1
+        return {"system_instruction": self.system_instruction}
+
+    def _cached_config(self) -> dict:
+        self.cached_requests += 1
+        return {"cached_content": self._name}
+
+    async def generation_config(self) -> dict:
+        """
+        キャッシュ名、またはシステム指示を含む generation_config を返す関数
+        """
+        if self.backend is None:
+            return self.inline_config()
+        if self._name is not None and self.clock() < self._expires_at - self.refresh_margin_seconds:
+            return self._cached_config()
+        if self.clock() < self._disabled_until:
+            return self.inline_config()
+
+        async with self._lock:
+            now = self.clock()
+            # 待っている間に他のリクエストが更新済みならそれを使う
+            if self._name is not None and now < self._expires_at - self.refresh_margin_seconds:
+                return self._cached_config()
+            try:
+                if self._name is not None and now < self._expires_at:
+                    await self.backend.refresh(self._name, self.ttl_seconds)
+                    self.refreshes += 1
+                    self._expires_at = now + self.ttl_seconds
+                else:
+                    found = await self.backend.find(self.display_name)
+                    if found is not None and found[1] > self.refresh_margin_seconds:
+                        self._name = found[0]
+                        self._expires_at = now + found[1]
+                        self.adopted += 1
+                    else:
+                        self._name = await self.backend.create(self.display_name, self.system_instruction, self.ttl_seconds)
+                        self._expires_at = now + self.ttl_seconds
+                        self.creates += 1
+                        print(f"システム指示をコンテキストキャッシュに登録しました: {self._name}")
+            except Exception as e:
+                self.failures += 1
+                self._name = None
+                self._disabled_until = now + self.retry_seconds
+                print(f"コンテキストキャッシュを利用できないため、システム指示を毎回送信します: {e}")
+                return self.inline_config()
+        return self._cached_config()
+
+    def invalidate(self) -> None:
+        """
+        キャッシュが見つからない等で生成に失敗したときに呼び、次回作成し直す
+        """
+        self._name = None
+        self._expires_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "cache_name": self._name,
+            "expires_in": round(max(self._expires_at - self.clock(), 0.0), 1) if self._name else 0.0,
+            "cached_requests": self.cached_requests,
+            "inline_requests": self.inline_requests,
+            "creates": self.creates,
+            "adopted": self.adopted,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "static_tokens": self.static_tokens,
+            "input_tokens_avoided": self.cached_requests * self.static_tokens,
+        }
@@ -0,0 +1,197 @@
+import math
+from typing import Optional, Sequence
+import httpx
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import SearchParams, QuantizationSearchParams, Prefetch, QueryRequest, ScoredPoint
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+# プロンプトの組み立てに必要なのはチャンク本文・文字位置・出典で、全て _node_content（ノード全体のJSON）に含まれる
+# llama_index が重複して書き込む平らなメタデータ（file_name, file_size, 日付など）や doc_id は取得しない
+DEFAULT_PAYLOAD_FIELDS = ("_node_content",)
+
+# 先頭の次元だけを使う候補検索用のベクトルを持つコレクションでは、ベクトルに名前を付ける
+# 元のベクトルの名前は llama_index の QdrantVectorStore が名前付きベクトルに使うものに合わせる
+FULL_VECTOR_NAME = "text-dense"
+PREFIX_VECTOR_NAME = "prefix"
+
+
+def create_async_qdrant_client(url: Optional[str], prefer_grpc: bool = False, grpc_port: int = 6334, pool_size: int = 16, **kwargs) -> AsyncQdrantClient:
+    """
+    接続を使い回す非同期クライアントを作る
+    qdrant-client は localhost への REST 接続では keep-alive を無効にするため、REST では接続プールを明示する
+    gRPC の場合は pool_size 本のチャネルを使い回す
+    """
+    if prefer_grpc:
+        return AsyncQdrantClient(url=url, prefer_grpc=True, grpc_port=grpc_port, pool_size=pool_size, **kwargs)
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return AsyncQdrantClient(url=url, limits=limits, **kwargs)
+
+
+def truncate_embedding(embedding: Sequence[float], dims: int) -> list[float]:
+    """
+    gemini-embedding-001 の埋め込みは先頭の次元だけでも使える（Matryoshka 表現）ため、先頭 dims 次元を取り出して正規化する
+    """
+    prefix = list(embedding[:dims])
+    norm = math.sqrt(sum(value * value for value in prefix))
+    return [value / norm for value in prefix] if norm > 0 else prefix
+
+
+def build_search_params(hnsw_ef: Optional[int] = None, oversampling: Optional[float] = None) -> Optional[SearchParams]:
+    """
+    検索時のパラメータを作る（指定がなければ None で、コレクションの設定が使われる）
+    hnsw_ef: HNSW の探索幅（大きいほど再現率が上がり遅くなる、既定は ef_construct）
+    oversampling: 量子化したベクトルで top_k の何倍を候補にし、元のベクトルで再スコアするか
+    量子化していないコレクションでは oversampling は無視される
+    """
+    if hnsw_ef is None and oversampling is None:
+        return None
+    quantization = QuantizationSearchParams(rescore=True, oversampling=oversampling) if oversampling is not None else None
+    return SearchParams(hnsw_ef=hnsw_ef, quantization=quantization)
+
+
+async def fetch_vector_layout(client: AsyncQdrantClient, collection_name: str) -> tuple[Optional[str], bool]:
+    """
+    コレクション（エイリアスなら現在の参照先）のベクトル構成を調べ、(検索に使うベクトルの名前, 候補検索用のベクトルがあるか) を返す
+    名前のないベクトル1本のコレクションでは名前は None になる
+    """
+    info = await client.get_collection(collection_name)
+    vectors = info.config.params.vectors
+    if not isinstance(vectors, dict):
+        return None, False
+    return (FULL_VECTOR_NAME if FULL_VECTOR_NAME in vectors else None), PREFIX_VECTOR_NAME in vectors
+
+
+def build_query_args(
+    embedding: list[float],
+    top_k: int,
+    search_params: Optional[SearchParams] = None,
+    prefix_dims: Optional[int] = None,
+    prefix_candidates: int = 100,
+    using: Optional[str] = None,
+) -> dict:
+    """
+    query_points に渡す検索ベクトルと検索時パラメータ
+    prefix_dims を指定した場合、候補は先頭の次元だけのベクトルで探し、最終的なスコアは元のベクトルで計算する
+    using は名前付きベクトルのコレクションで検索に使うベクトルの名前（prefix_dims を指定した場合は常に FULL_VECTOR_NAME）
+    """
+    if prefix_dims is None:
+        return {"query": embedding, "search_params": search_params, "using": using}
+    return {
+        "prefetch": Prefetch(
+            query=truncate_embedding(embedding, prefix_dims),
+            using=PREFIX_VECTOR_NAME,
+            limit=max(prefix_candidates, top_k),
+            params=search_params,
+        ),
+        "query": embedding,
+        "using": FULL_VECTOR_NAME,
+    }
+
+
+class LeanQdrantRetriever:
+    """
+    llama_index のリトリーバーを通さず、Qdrant に直接問い合わせる検索
+    - 取得するペイロードを payload_fields に絞る
+    - score_threshold 未満の点はサーバー側で除外し、転送しない
+    - prefix_dims を指定すると、先頭の次元だけのベクトルで prefix_candidates 件の候補を探し、
+      候補だけを元のベクトルで再スコアする（2段階の検索を1回の問い合わせで Qdrant 側が行う）
+    - ベクトルの名前の有無・候補検索用のベクトルの有無は refresh_layout で調べる（エイリアスの切り替え後にも呼び直す）
+    """
+
+    def __init__(
+        self,
+        client: AsyncQdrantClient,
+        collection_name: str,
+        score_threshold: Optional[float] = None,
+        payload_fields: Sequence[str] = DEFAULT_PAYLOAD_FIELDS,
+        search_params: Optional[SearchParams] = None,
+        prefix_dims: Optional[int] = None,
+        prefix_candidates: int = 100,
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self.score_threshold = score_threshold
+        self.payload_fields = list(payload_fields)
+        self.search_params = search_params
+        self.prefix_dims = prefix_dims
+        self.prefix_candidates = prefix_candidates
+        # refresh_layout を呼ぶまでは、prefix_dims の指定どおりの構成だとみなす
+        self.vector_name: Optional[str] = FULL_VECTOR_NAME if prefix_dims is not None else None
+        self.has_prefix_vector = prefix_dims is not None
+
+        self.searches = 0
+        self.batches = 0
+        self.points_returned = 0
+
+    async def refresh_layout(self) -> None:
+        """
+        コレクションのベクトル構成を調べ直す関数
+        候補検索用のベクトルが無いコレクションでは、prefix_dims を指定していても元のベクトルだけで検索する
+        """
+        self.vector_name, self.has_prefix_vector = await fetch_vector_layout(self.client, self.collection_name)
+        if self.prefix_dims is not None and not self.has_prefix_vector:
+            print(f"コレクション '{self.collection_name}' に '{PREFIX_VECTOR_NAME}' ベクトルが無いため、2段階の検索を行いません。")
+
+    async def aretrieve(self, embedding: list[float], top_k: int = 10) -> list[NodeWithScore]:
+        """
+        クエリ埋め込みとの類似度が高い順にノードを返す関数
+        """
+        response = await self.client.query_points(
+            collection_name=self.collection_name,
+            limit=top_k,
+            with_payload=self.payload_fields,
+            with_vectors=False,
+            score_threshold=self.score_threshold,
+            **self.query_args(embedding, top_k),
+        )
+        return self._to_nodes(response.points)
+
+    async def aretrieve_batch(self, embeddings: list[list[float]], top_k: int = 10) -> list[list[NodeWithScore]]:
+        """
+        複数のクエリ埋め込みの検索を1回の問い合わせ（query_batch_points）で行い、クエリごとのノードのリストを返す関数
+        """
+        if not embeddings:
+            return []
+        requests = []
+        for embedding in embeddings:
+            args = self.query_args(embedding, top_k)
+            # query_points の search_params は QueryRequest では params という名前になる
+            args["params"] = args.pop("search_params", None)
+            requests.append(QueryRequest(
+                limit=top_k,
+                with_payload=self.payload_fields,
+                with_vector=False,
+                score_threshold=self.score_threshold,
+                **args,
+            ))
+        responses = await self.client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        self.batches += 1
+        return [self._to_nodes(response.points) for response in responses]
+
+    def _to_nodes(self, points: list[ScoredPoint]) -> list[NodeWithScore]:
+        self.searches += 1
+        self.points_returned += len(points)
+
+        results = []
+        for point in points:
+            node = metadata_dict_to_node(point.payload)
+            node.id_ = str(point.id)
+            results.append(NodeWithScore(node=node, score=point.score))
+        return results
+
+    def query_args(self, embedding: list[float], top_k: int) -> dict:
+        prefix_dims = self.prefix_dims if self.has_prefix_vector else None
+        return build_query_args(embedding, top_k, self.search_params, prefix_dims, self.prefix_candidates, using=self.vector_name)
+
+    def stats(self) -> dict:
+        return {
+            "searches": self.searches,
+            "batches": self.batches,
+            "points_returned": self.points_returned,
+            "avg_points": self.points_returned / self.searches if self.searches else 0.0,
+            "score_threshold": self.score_threshold,
+            "prefix_dims": self.prefix_dims,
+            "vector_name": self.vector_name,
+            "has_prefix_vector": self.has_prefix_vector,
+        }
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    同じキーの処理が実行中であれば新しく実行せず、その結果を待って共有するクラス
+    最初のリクエスト（リーダー）の処理はタスクとして実行するため、リーダーが切断されても後続は結果を受け取れる
+    後続が wait_seconds 以上待った場合は待つのをやめ、自分で処理を実行する
+    待っていたリクエストが全てキャンセルされた（クライアントが切断した）場合は、処理もキャンセルする
+    """
+
+    def __init__(self, wait_seconds: float = 30.0):
+        self.wait_seconds = wait_seconds
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _start(self, key: str, factory: Callable[[], Awaitable[T]]) -> asyncio.Task:
+        task = asyncio.ensure_future(factory())
+        self._in_flight[key] = task
+        self.leaders += 1
+
+        def _done(finished: asyncio.Task) -> None:
+            if self._in_flight.get(key) is finished:
+                del self._in_flight[key]
+                self._waiters.pop(key, None)
+            if not finished.cancelled() and finished.exception() is not None:
+                self.errors += 1
+
+        task.add_done_callback(_done)
+        return task
+
+    async def join(self, key: str) -> Optional[T]:
+        """
+        同じキーの処理が実行中であればその結果を待って返す。実行中でない・待ちきれなかった場合は None
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            return None
+        self.followers += 1
+        try:
+            return await asyncio.wait_for(self._wait(key, task), timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            print(f"実行中の同じ質問の応答を {self.wait_seconds} 秒待っても完了しないため、個別に処理します。")
+            return None
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        同じキーの処理が実行中であればその結果を共有し、なければ factory を実行する
+        リーダーの処理が失敗した場合は、待っていたリクエストにも同じ例外を送出する
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            result = await self.join(key)
+            if result is not None:
+                return result
+            # 待ちきれなかった場合は、実行中のタスクを残したまま個別に実行する
+            return await factory()
+        return await self._wait(key, self._start(key, factory))
+
+    async def _wait(self, key: str, task: asyncio.Task) -> T:
+        """
+        task の結果を待つ。待っている全員がキャンセルされたら task もキャンセルする
+        """
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._in_flight.get(key) is task and self._waiters.get(key) == 1 and not task.done():
+                task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            if self._in_flight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def stats(self) -> dict:
+        """
+        実行した上流の処理数と、まとめられたリクエスト数などを返す
+        """
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "collapsed": self.followers - self.timeouts,
+            "collapse_rate": (self.followers - self.timeouts) / requests if requests else 0.0,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,46 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class StartupState:
+    """
+    起動の各段階の所要時間と、リクエストを受け付けられる状態かどうかを保持するクラス
+    時間は started_at（main モジュールの読み込み開始時点）からの経過で記録する
+    """
+
+    def __init__(self, mode: str, started_at: Optional[float] = None):
+        self.mode = mode
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timings[name] = round(seconds, 3)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        self.record("ready", time.perf_counter() - self.started_at)
+        print("⏱ 起動時間: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()))
+
+    def mark_failed(self, error: Exception) -> None:
+        self.error = str(error)
+        self.record("failed", time.perf_counter() - self.started_at)
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "ready": self.ready,
+            "error": self.error,
+            "uptime_seconds": round(time.perf_counter() - self.started_at, 3),
+            "timings": self.timings,
+        }
@@ -0,0 +1,67 @@
+import os
+import mimetypes
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+# tools/image_variants.py が書き出す、名前に内容のハッシュを含む画像のディレクトリ（/static/_v/...）
+VARIANT_DIR = "_v"
+# 名前が同じなら内容も同じため、1年間キャッシュさせて再検証もさせない
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 名前にハッシュを含まない元の画像は差し替えられることがあるため、毎回 ETag で確認させる（変わっていなければ 304）
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# 事前に圧縮したファイルの (Content-Encoding, 拡張子)。クライアントが受け付けるものを先頭から選ぶ
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """
+    Accept-Encoding ヘッダーから受け付けるエンコーディングを返す（q=0 のものは除く）
+    """
+    encodings = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class ImageStaticFiles(StaticFiles):
+    """
+    操作画像を配信する StaticFiles
+    - VARIANT_DIR 以下は IMMUTABLE_CACHE_CONTROL、それ以外は REVALIDATE_CACHE_CONTROL を付ける（どちらも ETag / Last-Modified 付き）
+    - <ファイル>.br / <ファイル>.gz があり、クライアントが受け付ける場合はそちらを Content-Encoding を付けて返す
+    """
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+        encoding, has_variants = None, False
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        served_path = full_path
+        for name, extension in PRECOMPRESSED:
+            try:
+                compressed_stat = os.stat(f"{full_path}{extension}")
+            except OSError:
+                continue
+            has_variants = True
+            if encoding is None and name in accepted:
+                encoding, served_path, stat_result = name, f"{full_path}{extension}", compressed_stat
+
+        # ETag は実際に返すファイルから作られるため、圧縮の有無で別の値になる
+        response = FileResponse(served_path, status_code=status_code, stat_result=stat_result, media_type=media_type)
+        immutable = self.get_path(scope).split(os.sep, 1)[0] == VARIANT_DIR
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if has_variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# tools/ にも main.py があるため、app/ を先に探す
+sys.path.insert(0, os.path.join(APP_DIR, "tools"))
+sys.path.insert(0, APP_DIR)
+
+# Gemini・Qdrant の代わりに service/fakes.py のスタンドインを使う（service.chat の読み込み前に設定する）
+os.environ["CHAT_BACKEND"] = "fake"
+os.environ["CONTEXT_SCORE_THRESHOLD"] = "0.15"
+os.environ["FAKE_EMBED_LATENCY"] = "fixed:0"
+os.environ["FAKE_VECTOR_LATENCY"] = "fixed:0"
+os.environ["FAKE_LLM_CHUNK_LATENCY"] = "fixed:0"
+os.environ.setdefault("FAKE_LLM_LATENCY", "fixed:0")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def async_redis(redis_server):
+    return fakeredis.FakeAsyncRedis(server=redis_server)
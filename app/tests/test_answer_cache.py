@@ -0,0 +1,64 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import embedding
+from service.chat import ChatService
+from service.conversation_manager import ConversationManager
+
+QUERY = "ログインの方法を教えてください"
+
+
+@pytest.fixture
+def bump(monkeypatch, redis_server):
+    """tools/embedding.py の bump_index_version を、テスト用の Redis に向けて呼ぶ"""
+    monkeypatch.setattr(embedding.redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=redis_server))
+    return embedding.bump_index_version
+
+
+@pytest.fixture
+def chat_service(async_redis):
+    return ChatService(manager=ConversationManager(async_redis), cache_redis_client=async_redis)
+
+
+@pytest.mark.anyio
+async def test_no_stale_hit_after_bump(chat_service, bump):
+    bump("documents_v1")
+    await chat_service.handle_query("session:a", QUERY)
+    await chat_service.handle_query("session:b", QUERY)
+    assert chat_service.answer_cache.hits == 1
+
+    # 再インデックスの直後のリクエストから、古いインデックスで生成した回答は返さない
+    bump("documents_v2")
+    await chat_service.handle_query("session:c", QUERY)
+    assert chat_service.answer_cache.hits == 1
+    assert chat_service.answer_cache.version == "documents_v2"
+
+
+@pytest.mark.anyio
+async def test_answer_generated_before_bump_is_not_stored(chat_service, bump, monkeypatch):
+    bump("documents_v1")
+    generating = asyncio.Event()
+    release = asyncio.Event()
+    create_response = chat_service.create_response
+
+    async def slow_create_response(*args, **kwargs):
+        generating.set()
+        await release.wait()
+        return await create_response(*args, **kwargs)
+
+    monkeypatch.setattr(chat_service, "create_response", slow_create_response)
+    stale = asyncio.create_task(chat_service.handle_query("session:a", QUERY))
+    await generating.wait()
+
+    # 生成中にバージョンが変わり、別のリクエストが新しいバージョンを読んだ後に古い回答が保存されようとする
+    bump("documents_v2")
+    monkeypatch.setattr(chat_service, "create_response", create_response)
+    await chat_service.handle_query("session:b", "パスワードを変更したい")
+    release.set()
+    await stale
+    assert chat_service.answer_cache.stale_stores == 1
+
+    await chat_service.handle_query("session:c", QUERY)
+    assert chat_service.answer_cache.hits == 0
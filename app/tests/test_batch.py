@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from service.chat import ChatService
+from service.conversation_manager import ConversationManager
+
+QUERIES = ["ログインの方法を教えてください", "パスワードを変更したい", "請求書をダウンロードしたい"]
+
+
+@pytest.fixture
+def chat_service(async_redis):
+    return ChatService(manager=ConversationManager(async_redis), cache_redis_client=async_redis)
+
+
+async def collect(chat_service, items, **kwargs) -> dict:
+    return {index: result async for index, result in chat_service.handle_batch(items, **kwargs)}
+
+
+@pytest.mark.anyio
+async def test_cancelled_generation_still_yields_a_result(chat_service, monkeypatch):
+    create_response = chat_service.create_response
+
+    async def create_response_cancelled_for_one(conversation, query, **kwargs):
+        # 共有している single-flight のタスクが別のリクエスト側でキャンセルされた場合と同じく CancelledError が届く
+        if query == QUERIES[1]:
+            raise asyncio.CancelledError()
+        return await create_response(conversation, query, **kwargs)
+
+    monkeypatch.setattr(chat_service, "create_response", create_response_cancelled_for_one)
+    results = await asyncio.wait_for(collect(chat_service, [(None, query) for query in QUERIES], concurrency=1), timeout=5)
+
+    assert sorted(results) == [0, 1, 2]
+    assert isinstance(results[1], Exception)
+    assert isinstance(results[0], str) and isinstance(results[2], str)
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import time
+
+import fakeredis
+import httpx
+import pytest
+import redis.asyncio
+
+import service.chat
+
+LLM_LATENCY_SECONDS = 0.5
+CONCURRENCY = 8
+# 同時実行時の所要時間が LLM 1回分の何倍以内なら並行処理できているとみなすか（tools/concurrency_check.py と同じ）
+ACCEPTABLE_RATIO = 2.0
+
+
+class FakeConnectionPool:
+    @classmethod
+    def from_url(cls, *args, **kwargs) -> "FakeConnectionPool":
+        return cls()
+
+    async def aclose(self) -> None:
+        pass
+
+
+@pytest.fixture
+async def client(monkeypatch, redis_server):
+    """Redis を fakeredis に差し替え、LLM の応答に LLM_LATENCY_SECONDS かかるアプリ"""
+    monkeypatch.setattr(redis.asyncio, "ConnectionPool", FakeConnectionPool)
+    monkeypatch.setattr(redis.asyncio, "Redis", lambda connection_pool=None, **kwargs: fakeredis.FakeAsyncRedis(server=redis_server))
+    monkeypatch.setenv("FAKE_LLM_LATENCY", f"fixed:{int(LLM_LATENCY_SECONDS * 1000)}")
+    monkeypatch.setattr(service.chat, "_chat_service_instance", None)
+    # 操作画像は app/ からの相対パスでマウントされる
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test/api/v1", timeout=30) as client:
+            yield client
+
+
+@pytest.mark.anyio
+async def test_concurrent_chats_take_about_one_llm_latency(client):
+    session_ids = [(await client.get("/create/session")).json()["session_id"] for _ in range(CONCURRENCY)]
+
+    async def chat(session_id: str, number: int) -> httpx.Response:
+        # 質問を変え、回答キャッシュも使わないため、同時リクエストのまとめ（single-flight）では1件にならない
+        return await client.post("/create/chat", json={"session_id": session_id, "query": f"ログインの方法 {number}", "use_cache": False})
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[chat(session_id, number) for number, session_id in enumerate(session_ids)])
+    elapsed = time.perf_counter() - start
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENCY
+    # 直列に処理されていれば CONCURRENCY 倍かかる
+    assert LLM_LATENCY_SECONDS <= elapsed < LLM_LATENCY_SECONDS * ACCEPTABLE_RATIO
+    assert service.chat._chat_service_instance.single_flight.stats()["collapsed"] == 0
+
+
+@pytest.mark.anyio
+async def test_generation_error_is_reported_as_500(client, monkeypatch):
+    from service.fakes import FakeLLM
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        raise RuntimeError("LLM unavailable")
+
+    monkeypatch.setattr(FakeLLM, "acomplete", acomplete)
+    session_id = (await client.get("/create/session")).json()["session_id"]
+    response = await client.post("/create/chat", json={"session_id": session_id, "query": "ログインの方法", "use_cache": False})
+    # 失敗を握りつぶすと未定義の response を返そうとして UnboundLocalError になる
+    assert response.status_code == 500
+    assert "LLM unavailable" in response.json()["detail"]
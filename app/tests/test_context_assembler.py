@@ -0,0 +1,41 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from service.context_assembler import ContextAssembler
+
+DOCUMENT = "ログイン画面を開き、メールアドレスとパスワードを入力して、ログインボタンを押します。"
+
+
+def chunk(start: int, end: int, score: float, file_path: str = "data/login.md") -> NodeWithScore:
+    text = DOCUMENT[start:end]
+    return NodeWithScore(node=TextNode(text=text, start_char_idx=start, end_char_idx=end, metadata={"file_path": file_path}), score=score)
+
+
+def assembler(token_budget: int = 1000) -> ContextAssembler:
+    # 1文字を1トークンとして数え、予算を文字数で確かめられるようにする
+    return ContextAssembler(score_threshold=0.5, token_budget=token_budget, tokenizer=list)
+
+
+def test_chunks_below_the_threshold_are_dropped():
+    sections, stats = assembler().assemble([chunk(0, 10, 0.9), chunk(20, 30, 0.4, file_path="data/other.md")])
+    assert sections == [DOCUMENT[0:10]]
+    assert (stats["nodes_retrieved"], stats["nodes_relevant"]) == (2, 1)
+    assert stats["tokens_saved"] == 10
+
+
+def test_overlapping_chunks_of_the_same_file_are_merged():
+    # chunk_overlap で重なるチャンクと、接するチャンクは1つの区間になり、重なり部分は1回だけ入る
+    sections, stats = assembler().assemble([chunk(10, 25, 0.7), chunk(0, 15, 0.9), chunk(25, 30, 0.6), chunk(0, 8, 0.8, file_path="data/other.md")])
+    assert sections[0] == DOCUMENT[0:30]
+    assert len(sections) == 2
+    assert stats["tokens_used"] == 30 + 8
+    assert stats["tokens_saved"] == (15 + 15 + 5 + 8) - (30 + 8)
+
+
+def test_sections_are_truncated_at_the_budget():
+    context = assembler(token_budget=12)
+    sections, stats = context.assemble([chunk(0, 30, 0.9), chunk(0, 8, 0.8, file_path="data/other.md")])
+    # 最もスコアの高い区間は予算に収まるよう切り詰め、予算を超える残りの区間は入れない
+    assert sections == [DOCUMENT[0:12]]
+    assert stats["tokens_used"] <= 12
+    assert stats["sections_dropped"] == 1
+    assert context.stats()["tokens_saved"] == 38 - stats["tokens_used"]
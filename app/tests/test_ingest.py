@@ -0,0 +1,104 @@
+import os
+
+import qdrant_client
+import pytest
+
+import embedding
+from ingest_manifest import IngestManifest
+
+
+class NewVersionCreated(Exception):
+    pass
+
+
+@pytest.fixture
+def live(monkeypatch, tmp_path):
+    """エイリアス documents が documents_v1 を指し、data/ の内容が全て documents_v1 のマニフェストに記録されている状態"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "login.md").write_text("ログインの方法", encoding="utf-8")
+    (data_dir / "password.md").write_text("パスワードの変更", encoding="utf-8")
+    monkeypatch.setattr(embedding, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(embedding, "MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(embedding, "LEGACY_MANIFEST_PATH", str(tmp_path / "ingest_manifest.json"))
+    monkeypatch.setattr(embedding, "CHECKPOINT_PATH", str(tmp_path / "ingest_checkpoint.jsonl"))
+    monkeypatch.setattr(embedding, "build_image_variants", lambda: {})
+
+    client = qdrant_client.QdrantClient(location=":memory:")
+    client.create_collection("documents_v1", vectors_config=embedding.PROFILES["default"].vectors_config(embedding.VECTOR_SIZE))
+    client.update_collection_aliases(change_aliases_operations=[
+        qdrant_client.models.CreateAliasOperation(
+            create_alias=qdrant_client.models.CreateAlias(collection_name="documents_v1", alias_name="documents"),
+        ),
+    ])
+    monkeypatch.setattr(embedding.qdrant_client, "QdrantClient", lambda url: client)
+
+    (tmp_path / "manifests").mkdir()
+    manifest = IngestManifest(embedding.manifest_path("documents_v1"), collection="documents_v1", profile="default")
+    for path in sorted(data_dir.iterdir()):
+        manifest.set_document(str(path), embedding.document_hash(str(path), {}), {})
+    manifest.save()
+
+    def version_name(alias: str) -> str:
+        raise NewVersionCreated(alias)
+
+    bumped = []
+    monkeypatch.setattr(embedding, "version_name", version_name)
+    monkeypatch.setattr(embedding, "bump_index_version", bumped.append)
+    return data_dir, bumped, client
+
+
+@pytest.mark.anyio
+async def test_unchanged_run_keeps_the_live_version(live):
+    _, bumped, _ = live
+    await embedding.ingest()
+    assert bumped == []
+
+
+@pytest.mark.anyio
+async def test_changed_file_builds_a_new_version(live):
+    data_dir, _, _ = live
+    (data_dir / "login.md").write_text("ログインの方法（更新）", encoding="utf-8")
+    with pytest.raises(NewVersionCreated):
+        await embedding.ingest()
+
+
+@pytest.mark.anyio
+async def test_profile_change_builds_a_new_version(live):
+    with pytest.raises(NewVersionCreated):
+        await embedding.ingest(profile="matryoshka256")
+
+
+@pytest.mark.anyio
+async def test_failed_verification_deletes_the_new_version(live, monkeypatch):
+    data_dir, bumped, client = live
+    # 削除だけの差分更新は埋め込みを行わない
+    (data_dir / "password.md").unlink()
+    monkeypatch.setattr(embedding, "version_name", lambda alias: "documents_v2")
+    monkeypatch.setattr(embedding, "verify_collection", lambda *args, **kwargs: ["point count mismatch"])
+
+    with pytest.raises(SystemExit):
+        await embedding.ingest()
+
+    # 作りかけのバージョンは再開も prune_versions の対象にもならないよう、マニフェスト・チェックポイントごと消える
+    assert not client.collection_exists("documents_v2")
+    assert not os.path.exists(embedding.manifest_path("documents_v2"))
+    assert not os.path.exists(embedding.CHECKPOINT_PATH)
+    assert client.get_aliases().aliases[0].collection_name == "documents_v1"
+    assert bumped == []
+
+
+def test_image_urls_are_rewritten_only_where_they_are_hashed(tmp_path):
+    image_manifest = {"login.png": {"hash": "screenshot-v1", "default": "login.w800.webp"}}
+    text = "![ログイン画面](images/login.png)"
+    (tmp_path / "login.md").write_text(text, encoding="utf-8")
+    (tmp_path / "login.rst").write_text(text, encoding="utf-8")
+    paths = [str(tmp_path / "login.md"), str(tmp_path / "login.rst")]
+
+    nodes_by_file = embedding.load_window(paths, image_manifest)
+    # 画像のハッシュを含めない文書の URL を書き換えると、スクリーンショットの差し替えで書き換え先が古いまま残る
+    md, rst = (" ".join(node.text for node in nodes_by_file[path]) for path in paths)
+    assert "login.w800.webp" in md
+    assert rst == text
+    assert embedding.document_hash(paths[0], image_manifest) != embedding.file_hash(paths[0])
+    assert embedding.document_hash(paths[1], image_manifest) == embedding.file_hash(paths[1])
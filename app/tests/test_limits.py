@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from service.limits import AdmissionController, AdmissionRejected
+
+
+@pytest.mark.anyio
+async def test_concurrent_multi_slot_acquires_do_not_starve_each_other():
+    admission = AdmissionController(max_concurrent=4, max_queue=4, queue_timeout=1.0)
+    single = await admission.acquire()
+
+    # 3枠ずつ待つ2つのバッチ。1つずつ取り合うと、それぞれ一部の枠を持ったまま互いを待ち続ける
+    first = asyncio.create_task(admission.acquire(3))
+    second = asyncio.create_task(admission.acquire(3))
+    await asyncio.sleep(0)
+    single.release()
+
+    lease = await asyncio.wait_for(first, timeout=0.5)
+    assert lease.slots == 3 and admission.active == 3
+    lease.release()
+    lease = await asyncio.wait_for(second, timeout=0.5)
+    assert admission.active == 3
+    lease.release()
+    assert admission.active == 0
+
+
+@pytest.mark.anyio
+async def test_timed_out_multi_slot_acquire_returns_partial_slots():
+    admission = AdmissionController(max_concurrent=4, max_queue=4, queue_timeout=0.05)
+    held = await admission.acquire(2)
+
+    with pytest.raises(AdmissionRejected):
+        await admission.acquire(3)
+
+    # 待っている間に取った2枠も返しているため、残りの2枠はすぐに取れる
+    lease = await asyncio.wait_for(admission.acquire(2), timeout=0.01)
+    lease.release()
+    held.release()
+    assert admission.active == 0
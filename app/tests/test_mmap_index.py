@@ -0,0 +1,71 @@
+import fakeredis
+import numpy as np
+import pytest
+import qdrant_client
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+import embedding
+import export_mmap_index
+from service.chat import ChatService
+from service.conversation_manager import ConversationManager
+from service.mmap_index import MmapVectorIndex, write_index
+
+DIMS = 4
+
+
+def write(path: str, collection: str, count: int = 2) -> None:
+    payloads = [node_to_metadata_dict(TextNode(text=str(i))) for i in range(count)]
+    write_index(path, [str(i) for i in range(count)], np.eye(count, DIMS), payloads, collection=collection)
+
+
+@pytest.fixture
+def bump(monkeypatch, redis_server):
+    monkeypatch.setattr(embedding.redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=redis_server))
+    return embedding.bump_index_version
+
+
+@pytest.fixture
+def chat_service(async_redis, tmp_path):
+    path = str(tmp_path / "documents.mmvi")
+    write(path, "documents_v1")
+    service = ChatService(manager=ConversationManager(async_redis), cache_redis_client=async_redis)
+    service.mmap_index = MmapVectorIndex(path)
+    return service
+
+
+@pytest.mark.anyio
+async def test_stale_snapshot_is_reported_once_per_version(chat_service, bump, capsys, monkeypatch):
+    monkeypatch.setattr("service.chat.MMAP_SNAPSHOT_CHECK_SECONDS", 0)
+    bump("documents_v1")
+    await chat_service._retrieve("q", [1.0, 0.0, 0.0, 0.0])
+    assert "書き出し直してください" not in capsys.readouterr().out
+
+    bump("documents_v2")
+    await chat_service._retrieve("q", [1.0, 0.0, 0.0, 0.0])
+    await chat_service._retrieve("q", [1.0, 0.0, 0.0, 0.0])
+    assert capsys.readouterr().out.count("書き出し直してください") == 1
+
+    # 書き出し直したファイルは、読み込み直す間隔を待たずに使われる
+    write(chat_service.mmap_index.path, "documents_v2")
+    await chat_service._retrieve("q", [1.0, 0.0, 0.0, 0.0])
+    assert chat_service.stats()["mmap_index"]["collection"] == "documents_v2"
+    assert chat_service.stats()["mmap_index"]["index_version"] == "documents_v2"
+
+
+def test_refresh_index_reexports_an_existing_file(tmp_path, monkeypatch):
+    client = qdrant_client.QdrantClient(location=":memory:")
+    client.create_collection("documents_v2", vectors_config=qdrant_client.models.VectorParams(size=DIMS, distance="Cosine"))
+    client.upsert("documents_v2", points=[
+        qdrant_client.models.PointStruct(id=i, vector=list(np.eye(3, DIMS)[i]), payload={"text": str(i)}) for i in range(3)
+    ])
+    path = str(tmp_path / "documents.mmvi")
+    monkeypatch.delenv("MMAP_INDEX_PATH", raising=False)
+    monkeypatch.setattr(export_mmap_index, "DEFAULT_INDEX_PATH", path)
+
+    # 設定も既存のファイルもなければ何もしない
+    assert export_mmap_index.refresh_index(client, "documents_v2") is None
+
+    write_index(path, ["0"], np.eye(1, DIMS), [{}], collection="documents_v1", dtype="float16")
+    stats = export_mmap_index.refresh_index(client, "documents_v2")
+    assert (stats["collection"], stats["count"], stats["dtype"]) == ("documents_v2", 3, "float16")
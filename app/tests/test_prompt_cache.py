@@ -0,0 +1,93 @@
+import pytest
+
+from service.prompt_cache import PromptCache, StubCacheBackend, StubCacheError
+
+SYSTEM_INSTRUCTION = "あなたはTUNAシステムの専門案内AIアシスタントです。参考情報にない内容は推測で回答しないでください。"
+PROMPT = "# 質問\nログイン方法を教えてください"
+TTL = 3600
+MARGIN = 300
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def backend(clock):
+    # 1文字を1トークンとして数える
+    return StubCacheBackend(clock=clock, tokenizer=list)
+
+
+@pytest.fixture
+def cache(backend, clock):
+    return PromptCache(backend, SYSTEM_INSTRUCTION, model="models/test", ttl_seconds=TTL, refresh_margin_seconds=MARGIN, clock=clock, tokenizer=list)
+
+
+@pytest.mark.anyio
+async def test_cache_is_created_once_and_refreshed_before_expiry(cache, backend, clock):
+    first = await cache.generation_config()
+    clock.now = 60
+    assert await cache.generation_config() == first
+    assert (cache.creates, cache.refreshes) == (1, 0)
+
+    # 期限の refresh_margin_seconds 前を過ぎたら、同じキャッシュの期限を延ばす
+    clock.now = TTL - MARGIN + 1
+    assert await cache.generation_config() == first
+    assert (cache.creates, cache.refreshes) == (1, 1)
+    assert backend.caches[first["cached_content"]]["expires_at"] == clock.now + TTL
+
+
+@pytest.mark.anyio
+async def test_cache_is_recreated_after_idle_expiry(cache, clock):
+    first = await cache.generation_config()
+    # アクセスがないまま期限が切れたキャッシュは延長できないため、作り直す
+    clock.now = TTL * 3
+    second = await cache.generation_config()
+    assert second["cached_content"] != first["cached_content"]
+    assert (cache.creates, cache.refreshes) == (2, 0)
+
+
+@pytest.mark.anyio
+async def test_falls_back_to_the_inline_instruction_after_invalidate(cache, backend):
+    config = await cache.generation_config()
+    # プロバイダー側でキャッシュが消えていると生成に失敗するため、無効にしてシステム指示を直接送る
+    backend.caches.clear()
+    with pytest.raises(StubCacheError):
+        backend.input_tokens(config, PROMPT)
+    cache.invalidate()
+    inline = cache.inline_config()
+    assert inline == {"system_instruction": SYSTEM_INSTRUCTION}
+    assert backend.input_tokens(inline, PROMPT) == len(PROMPT) + len(SYSTEM_INSTRUCTION)
+
+    # 次のリクエストで作り直す
+    assert "cached_content" in await cache.generation_config()
+    assert cache.creates == 2
+
+
+@pytest.mark.anyio
+async def test_uncacheable_instruction_is_sent_inline_until_retry(backend, clock):
+    backend.min_tokens = len(SYSTEM_INSTRUCTION) + 1
+    cache = PromptCache(backend, SYSTEM_INSTRUCTION, model="models/test", retry_seconds=600, clock=clock, tokenizer=list)
+    assert await cache.generation_config() == {"system_instruction": SYSTEM_INSTRUCTION}
+    clock.now = 599
+    assert "system_instruction" in await cache.generation_config()
+    assert cache.failures == 1
+
+
+@pytest.mark.anyio
+async def test_cached_requests_send_only_the_dynamic_prompt(cache, backend):
+    for _ in range(3):
+        config = await cache.generation_config()
+        assert backend.input_tokens(config, PROMPT) == len(PROMPT)
+    stats = cache.stats()
+    assert stats["cached_requests"] == 3
+    assert stats["input_tokens_avoided"] == 3 * len(SYSTEM_INSTRUCTION)
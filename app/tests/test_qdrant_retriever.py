@@ -0,0 +1,57 @@
+import dataclasses
+
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from collection_profiles import PROFILES
+from service.qdrant_retriever import LeanQdrantRetriever
+
+DIMS = 8
+VECTORS = [[1.0 if i == j else 0.1 for i in range(DIMS)] for j in range(4)]
+
+
+async def create_version(client: AsyncQdrantClient, name: str, profile: str, prefix_dims: int | None = None) -> None:
+    profile = dataclasses.replace(PROFILES[profile], prefix_dims=prefix_dims or PROFILES[profile].prefix_dims)
+    await client.create_collection(name, vectors_config=profile.vectors_config(DIMS))
+    await client.upsert(name, points=[
+        models.PointStruct(id=i, vector=profile.point_vectors(vector), payload={"text": str(i)})
+        for i, vector in enumerate(VECTORS)
+    ])
+
+
+async def point_alias(client: AsyncQdrantClient, collection: str) -> None:
+    await client.update_collection_aliases(change_aliases_operations=[
+        models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=collection, alias_name="documents")),
+    ])
+
+
+async def search(retriever: LeanQdrantRetriever, embedding: list[float]) -> list:
+    response = await retriever.client.query_points(
+        collection_name=retriever.collection_name, limit=2, with_payload=True, **retriever.query_args(embedding, 2),
+    )
+    return [point.id for point in response.points]
+
+
+@pytest.mark.anyio
+async def test_refresh_layout_follows_alias_swap_between_vector_layouts():
+    client = AsyncQdrantClient(location=":memory:")
+    await create_version(client, "documents_v1", "default")
+    await create_version(client, "documents_v2", "matryoshka128", prefix_dims=4)
+    await point_alias(client, "documents_v1")
+    # 2段階の検索を設定していても、エイリアスの参照先が名前のないベクトルなら元のベクトルだけで検索する
+    retriever = LeanQdrantRetriever(client, "documents", prefix_dims=4, prefix_candidates=4)
+    await retriever.refresh_layout()
+    assert (retriever.vector_name, retriever.has_prefix_vector) == (None, False)
+    assert (await search(retriever, VECTORS[2]))[0] == 2
+
+    # プロファイルを変えた再インデックスで名前付きベクトルのコレクションに切り替わる
+    await point_alias(client, "documents_v2")
+    await retriever.refresh_layout()
+    assert retriever.has_prefix_vector
+    assert (await search(retriever, VECTORS[1]))[0] == 1
+
+    # prefix_dims を指定していなくても、名前付きベクトルのコレクションでは using を付けて検索する
+    retriever = LeanQdrantRetriever(client, "documents")
+    await retriever.refresh_layout()
+    assert retriever.query_args(VECTORS[3], 2)["using"] == "text-dense"
+    assert (await search(retriever, VECTORS[3]))[0] == 3
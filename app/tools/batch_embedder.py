@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable
+
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """quota (429) and server side (5xx) errors, timeouts and connection errors are retried"""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or 500 <= code < 600
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+class IngestCheckpoint:
+    """
+    Append-only record of the batches that were embedded and upserted.
+
+    The first line holds the run header ({"full": bool, "collection": target, "source": live, "profile": name}),
+    every following line either the point ids of one committed batch or a finished step
+    ({"step": name}). An interrupted run resumes by skipping them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.full = False
+        self.collection: str | None = None
+        self.source: str | None = None
+        self.profile = "default"
+        self.steps: set[str] = set()
+        self.committed: set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for i, line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a torn last line from a crash, the batch is simply redone
+                        break
+                    if i == 0:
+                        self.full = record.get("full", False)
+                        self.collection = record.get("collection")
+                        self.source = record.get("source")
+                        self.profile = record.get("profile", "default")
+                    elif "step" in record:
+                        self.steps.add(record["step"])
+                    else:
+                        self.committed.update(record["ids"])
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def start(self, full: bool, collection: str, source: str | None, profile: str = "default") -> None:
+        if self.exists():
+            return
+        self.full = full
+        self.collection = collection
+        self.source = source
+        self.profile = profile
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"full": full, "collection": collection, "source": source, "profile": profile}) + "\n")
+
+    def _append(self, record: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, ids: list[str]) -> None:
+        self._append({"ids": ids})
+        self.committed.update(ids)
+
+    def finish_step(self, step: str) -> None:
+        self._append({"step": step})
+        self.steps.add(step)
+
+    def clear(self) -> None:
+        if self.exists():
+            os.remove(self.path)
+        self.committed.clear()
+        self.steps.clear()
+
+
+class BatchEmbedder:
+    """
+    Embeds nodes in fixed size batches with bounded parallelism.
+
+    Parallelism is adaptive: a 429/5xx halves the number of batches in flight and
+    pauses every worker for a backoff period, consecutive successes raise it again
+    up to the configured maximum.
+    """
+
+    def __init__(
+        self,
+        embed_model,
+        batch_size: int = 50,
+        concurrency: int = 4,
+        max_retries: int = 8,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        checkpoint: IngestCheckpoint | None = None,
+    ):
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.max_concurrency = concurrency
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.checkpoint = checkpoint
+        self.tokenizer = get_tokenizer()
+
+        self._limit = concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._condition: asyncio.Condition | None = None
+
+        self.embedded_chunks = 0
+        self.embedded_tokens = 0
+        self.resumed_chunks = 0
+        self.throttled = 0
+        self._started_at = 0.0
+
+    async def _acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def _on_success(self) -> None:
+        async with self._condition:
+            self._successes += 1
+            if self._limit < self.max_concurrency and self._successes >= self._limit * 2:
+                self._limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    async def _on_throttled(self, attempt: int) -> float:
+        backoff = min(self.max_backoff, self.min_backoff * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        async with self._condition:
+            self.throttled += 1
+            self._successes = 0
+            self._limit = max(1, self._limit // 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+        return backoff
+
+    async def _embed_batch(self, nodes: list[BaseNode]) -> None:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            try:
+                embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_retries:
+                    raise
+                backoff = await self._on_throttled(attempt)
+                print(f"[embed] retryable error ({e}), backing off {backoff:.1f}s, concurrency -> {self._limit}")
+                continue
+            finally:
+                await self._release()
+            await self._on_success()
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            self.embedded_tokens += sum(len(self.tokenizer(text)) for text in texts)
+            return
+
+    def _print_progress(self, done: int, total: int) -> None:
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        print(
+            f"[embed] {done}/{total} chunks of this run ({self.embedded_chunks} total)"
+            f" | {self.embedded_chunks / elapsed:.1f} chunks/s"
+            f" | {self.embedded_tokens / elapsed:.0f} tokens/s"
+            f" | concurrency {self._limit}/{self.max_concurrency}"
+        )
+
+    async def run(self, nodes: list[BaseNode], on_batch: Callable[[list[BaseNode]], Awaitable[None]]) -> dict:
+        """
+        embed the nodes and hand every finished batch to on_batch (e.g. upsert to Qdrant);
+        a batch is checkpointed only after on_batch returned.
+        may be called repeatedly (e.g. once per window), the statistics accumulate
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+            self._started_at = time.monotonic()
+
+        skipped = 0
+        if self.checkpoint is not None:
+            pending = [node for node in nodes if node.node_id not in self.checkpoint.committed]
+            skipped = len(nodes) - len(pending)
+            self.resumed_chunks += skipped
+            if skipped:
+                print(f"[embed] resuming from checkpoint, {skipped} chunks were already committed.")
+        else:
+            pending = nodes
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        commit_lock = asyncio.Lock()
+        done = 0
+
+        async def process(batch: list[BaseNode]) -> None:
+            nonlocal done
+            await self._embed_batch(batch)
+            async with commit_lock:
+                await on_batch(batch)
+                if self.checkpoint is not None:
+                    self.checkpoint.commit([node.node_id for node in batch])
+                self.embedded_chunks += len(batch)
+                done += len(batch)
+                self._print_progress(done, len(pending))
+
+        # the adaptive limiter bounds how many batches are embedding at the same time
+        await asyncio.gather(*[process(batch) for batch in batches])
+        return self.stats()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "chunks": self.embedded_chunks,
+            "chunks_resumed": self.resumed_chunks,
+            "tokens": self.embedded_tokens,
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.embedded_chunks / elapsed, 2) if elapsed > 0 else 0.0,
+            "tokens_per_second": round(self.embedded_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Collection Profile Benchmark Script
+collection_profiles.py のプロファイルごとに documents の内容を一時コレクションへコピーし、
+メモリ使用量（見積もり）・検索レイテンシ・厳密検索に対する recall@k を比較するスクリプト
+
+- 正解は現在 documents が指すコレクション（float32）の厳密検索 (exact=True) の結果とする
+- 質問は保存済みのベクトルにノイズを加えたものを使う（埋め込みAPIを呼ばずに計測できる）
+- 小さなコーパスでも HNSW と量子化を通した検索を計測するため、一時コレクションは件数によらずインデックスを作る
+- --ef で検索時の探索幅（ChatService の QDRANT_HNSW_EF）、--oversampling で量子化時の候補の倍率を変えて計測できる
+- matryoshka プロファイルは先頭の次元だけのベクトルで候補を探し、元のベクトルで再スコアする2段階の検索で計測し、
+  --candidates で候補数（ChatService の QDRANT_PREFIX_CANDIDATES）を変えて再現率との兼ね合いを確認できる
+
+一時コレクション（documents_bench_<プロファイル>）は計測後に削除する（--keep で残す）。
+結果は bench_results/profiles_<日時>_<コミット>.json に保存される。
+
+使い方:
+    python3 bench_collection_profiles.py [--profiles default,int8,int8_disk] [--ef 32,64,128] [--queries 200] [--top-k 10]
+    python3 bench_collection_profiles.py --profiles default,matryoshka256,matryoshka128 --candidates 50,100,200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+
+import numpy as np
+import qdrant_client
+from qdrant_client.http import models
+
+from bench_load import RESULTS_DIR, git_commit, summarize
+from collection_profiles import PROFILES, create_collection_with_profile, dense_vector
+from collection_versions import resolve_alias, copy_points
+from service.qdrant_retriever import FULL_VECTOR_NAME, build_query_args  # collection_profiles が app/ を sys.path に追加する
+
+load_dotenv()
+
+COLLECTION_ALIAS = "documents"
+BENCH_PREFIX = f"{COLLECTION_ALIAS}_bench_"
+# 擬似クエリを作るときに保存済みベクトルへ加えるノイズの大きさ
+QUERY_NOISE = 0.05
+# 件数が少なくてもセグメントのインデックスを作り、総当たりに切り替えないようにする（単位は KB）
+FORCE_INDEX_OPTIMIZERS = models.OptimizersConfigDiff(indexing_threshold=1)
+FORCE_INDEX_FULL_SCAN_THRESHOLD = 1
+
+
+def sample_queries(client: qdrant_client.QdrantClient, collection: str, count: int, seed: int = 0) -> list[list[float]]:
+    """保存済みのベクトルにノイズを加えて擬似的なクエリを作る"""
+    points, _ = client.scroll(collection_name=collection, limit=count, with_payload=False, with_vectors=True)
+    rng = np.random.default_rng(seed)
+    vectors = np.array([dense_vector(point.vector) for point in points], dtype=np.float32)
+    vectors += rng.normal(0, QUERY_NOISE, size=vectors.shape).astype(np.float32)
+    return vectors.tolist()
+
+
+def wait_indexed(client: qdrant_client.QdrantClient, collection: str, timeout: float) -> models.CollectionInfo:
+    """最適化（HNSW と量子化の構築）が終わるまで待つ"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        info = client.get_collection(collection)
+        if info.status == models.CollectionStatus.GREEN and (info.indexed_vectors_count or 0) >= (info.points_count or 0):
+            return info
+        if time.perf_counter() > deadline:
+            print(f"  '{collection}' is still optimizing after {timeout}s, measuring anyway.")
+            return info
+        time.sleep(0.5)
+
+
+def vector_size(client: qdrant_client.QdrantClient, collection: str) -> int:
+    vectors = client.get_collection(collection).config.params.vectors
+    return vectors[FULL_VECTOR_NAME].size if isinstance(vectors, dict) else vectors.size
+
+
+def build(client: qdrant_client.QdrantClient, source: str, name: str, timeout: float) -> tuple[str, float]:
+    """プロファイルの一時コレクションを作り、(コレクション名, 構築秒数) を返す"""
+    profile = PROFILES[name]
+    collection = f"{BENCH_PREFIX}{name}"
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    start = time.perf_counter()
+    create_collection_with_profile(client, collection, vector_size(client, source), profile, FORCE_INDEX_OPTIMIZERS)
+    client.update_collection(collection, hnsw_config=models.HnswConfigDiff(full_scan_threshold=FORCE_INDEX_FULL_SCAN_THRESHOLD))
+    copy_points(client, source, collection, vector_fn=profile.point_vectors)
+    wait_indexed(client, collection, timeout)
+    return collection, time.perf_counter() - start
+
+
+def measure(
+    client: qdrant_client.QdrantClient,
+    collection: str,
+    queries: list[list[float]],
+    expected: list[set],
+    top_k: int,
+    query_args,
+) -> dict:
+    """query_args(query) で作った問い合わせでレイテンシと recall@k を計測する"""
+    # 1回目の呼び出しは接続確立やページの読み込みを含むため除外する
+    client.query_points(collection_name=collection, limit=top_k, **query_args(queries[0]))
+
+    latencies, recalls = [], []
+    start = time.perf_counter()
+    for query, truth in zip(queries, expected):
+        begin = time.perf_counter()
+        points = client.query_points(collection_name=collection, limit=top_k, **query_args(query)).points
+        latencies.append(time.perf_counter() - begin)
+        recalls.append(len(truth & {str(point.id) for point in points}) / len(truth))
+    summary = summarize(latencies, 0, time.perf_counter() - start)
+    summary["recall"] = round(float(np.mean(recalls)), 4)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare memory, latency and recall of the collection profiles")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="comma separated profile names")
+    parser.add_argument("--ef", default="", help="comma separated search-time hnsw_ef values (empty: collection default)")
+    parser.add_argument("--oversampling", type=float, default=None, help="candidate multiplier for quantized profiles")
+    parser.add_argument("--candidates", default="100", help="comma separated prefix candidate counts for matryoshka profiles")
+    parser.add_argument("--queries", type=int, default=200, help="number of sampled queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--index-timeout", type=float, default=600.0, help="seconds to wait for each collection to be indexed")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark collections")
+    args = parser.parse_args()
+    names = [name for name in args.profiles.split(",") if name]
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        print(f"unknown profiles: {', '.join(unknown)} (available: {', '.join(PROFILES)})")
+        sys.exit(1)
+    ef_values = [int(value) for value in args.ef.split(",") if value] or [None]
+    candidate_values = [int(value) for value in args.candidates.split(",") if value]
+
+    client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"), timeout=60)
+    source = resolve_alias(client, COLLECTION_ALIAS) or COLLECTION_ALIAS
+    count = client.count(collection_name=source, exact=True).count
+    size = vector_size(client, source)
+    using = FULL_VECTOR_NAME if isinstance(client.get_collection(source).config.params.vectors, dict) else None
+    queries = sample_queries(client, source, args.queries)
+    if not queries:
+        print("no vectors in the collection.")
+        sys.exit(1)
+    exact = models.SearchParams(exact=True)
+    expected = [
+        {str(point.id) for point in client.query_points(collection_name=source, query=query, using=using, limit=args.top_k, search_params=exact).points}
+        for query in queries
+    ]
+    print(f"source: '{source}' ({count} points, {size} dims), {len(queries)} queries, top-{args.top_k}")
+
+    results = {}
+    for name in names:
+        profile = PROFILES[name]
+        print(f"building '{name}': {profile.description}")
+        collection, build_seconds = build(client, source, name, args.index_timeout)
+        try:
+            for ef in ef_values:
+                oversampling = args.oversampling if profile.quantization else None
+                search_params = models.SearchParams(
+                    hnsw_ef=ef,
+                    quantization=models.QuantizationSearchParams(rescore=True, oversampling=oversampling) if oversampling else None,
+                )
+                for candidates in candidate_values if profile.prefix_dims is not None else [None]:
+                    summary = measure(client, collection, queries, expected, args.top_k, lambda query: build_query_args(
+                        query, args.top_k, search_params, profile.prefix_dims, candidates or 0, using=profile.vector_name,
+                    ))
+                    summary.update(profile.estimate_memory(count, size))
+                    summary["build_s"] = round(build_seconds, 2)
+                    key = f"{name}@ef={ef or 'default'}" + (f",cand={candidates}" if candidates else "")
+                    results[key] = summary
+        finally:
+            if not args.keep:
+                client.delete_collection(collection)
+
+    def mb(value: int) -> float:
+        return value / (1024 * 1024)
+
+    print(f"\n{'profile':<34} {'RAM MB':>8} {'disk MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    for key, summary in results.items():
+        print(f"{key:<34} {mb(summary['ram_bytes']):>8.1f} {mb(summary['disk_bytes']):>8.1f}"
+              f" {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['recall']:>7.4f}")
+    print("RAM / disk are estimates from the profile settings (vectors, int8 copies and HNSW links), not measured by Qdrant.")
+
+    commit = git_commit()
+    output = os.path.join(RESULTS_DIR, f"profiles_{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "source": {"collection": source, "points": count, "dims": size},
+            "config": {"queries": len(queries), "top_k": args.top_k, "ef": ef_values, "oversampling": args.oversampling,
+                       "candidates": candidate_values},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Embedding Batch Benchmark Script
+同時に届いたクエリを1件ずつ埋め込む場合と、EmbeddingBatcher でまとめて埋め込む場合の
+スループットとレイテンシを比較するスクリプト
+
+既定ではAPIを呼ばず、1回の呼び出しに固定の往復時間 + 1件あたりの処理時間がかかり、
+同時に実行できる呼び出し数に上限がある擬似的な埋め込みAPIで計測する。
+--live を付けると Gemini の埋め込みAPIを実際に呼び出す（クォータを消費する）。
+
+使い方:
+    python3 bench_embedding_batch.py [--requests 400] [--concurrency 64] [--batch-size 32] [--window-ms 5]
+    python3 bench_embedding_batch.py --live --requests 100 --concurrency 20
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.embedding_batcher import EmbeddingBatcher, gemini_batch_embedder  # noqa: E402
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = "models/gemini-embedding-001"
+EMBEDDING_DIMENSIONALITY = 768
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+
+def simulated_embedder(call_ms: float, per_text_ms: float, max_calls: int):
+    """
+    擬似的な埋め込みAPI（呼び出しごとの往復時間 + 件数に比例する処理時間、同時呼び出し数の上限あり）
+    """
+    semaphore = asyncio.Semaphore(max_calls)
+    rng = np.random.default_rng(0)
+
+    async def embed_batch(texts: list[str]) -> list[list[float]]:
+        async with semaphore:
+            await asyncio.sleep((call_ms + per_text_ms * len(texts)) / 1000)
+        return rng.normal(size=(len(texts), EMBEDDING_DIMENSIONALITY)).astype(np.float32).tolist()
+
+    return embed_batch
+
+
+def live_embedder():
+    from google import genai
+
+    client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    return gemini_batch_embedder(client, EMBEDDING_MODEL_NAME, QUERY_TASK_TYPE, EMBEDDING_DIMENSIONALITY)
+
+
+async def drive(embed_one, queries: list[str], concurrency: int) -> tuple[float, list[float]]:
+    """
+    concurrency 件ずつ並行にクエリを埋め込み、(全体の所要時間, 各リクエストのレイテンシ) を返す
+    """
+    queue = list(reversed(queries))
+    latencies = []
+
+    async def worker():
+        while queue:
+            query = queue.pop()
+            start = time.perf_counter()
+            await embed_one(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies
+
+
+def summarize(name: str, total: float, latencies: list[float], calls: int) -> float:
+    throughput = len(latencies) / total if total > 0 else 0.0
+    print(
+        f"{name:<12} {throughput:8.1f} req/s"
+        f" | p50 {np.percentile(latencies, 50) * 1000:7.1f} ms"
+        f" | p95 {np.percentile(latencies, 95) * 1000:7.1f} ms"
+        f" | API calls {calls}"
+    )
+    return throughput
+
+
+async def run(args) -> None:
+    # 同じ質問は上位のキャッシュで吸収されるため、計測では全て異なる質問にする
+    queries = [f"TUNAシステムの機能について教えてください ({i})" for i in range(args.requests)]
+
+    embed_batch = live_embedder() if args.live else simulated_embedder(args.call_ms, args.per_text_ms, args.max_calls)
+    calls = 0
+
+    async def embed_single(query: str) -> list[float]:
+        nonlocal calls
+        calls += 1
+        return (await embed_batch([query]))[0]
+
+    print(f"=== {args.requests} queries, concurrency {args.concurrency} ({'live' if args.live else 'simulated'}) ===")
+    total, latencies = await drive(embed_single, queries, args.concurrency)
+    single = summarize("per-request", total, latencies, calls)
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=args.batch_size, window_ms=args.window_ms)
+    total, latencies = await drive(batcher.embed, queries, args.concurrency)
+    batched = summarize("batched", total, latencies, batcher.stats()["batches"])
+
+    stats = batcher.stats()
+    print(f"avg batch size {stats['avg_batch_size']:.1f} (max {stats['max_batch_size']}), errors {stats['errors']}")
+    print(f"throughput gain: {batched / single:.1f}x" if single > 0 else "throughput gain: n/a")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare per-request and micro-batched query embedding")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent requests")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")))
+    parser.add_argument("--window-ms", type=float, default=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")))
+    parser.add_argument("--live", action="store_true", help="call the Gemini embedding API")
+    parser.add_argument("--call-ms", type=float, default=80.0, help="simulated round trip per API call")
+    parser.add_argument("--per-text-ms", type=float, default=2.0, help="simulated processing time per text")
+    parser.add_argument("--max-calls", type=int, default=8, help="simulated limit of concurrent API calls")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
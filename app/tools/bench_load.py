@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Load Benchmark Script
+FastAPI アプリに一定の同時実行数でリクエストを送り、セッション作成・チャット・ストリーミングの
+p50/p95/p99 レイテンシと req/s を計測して JSON に保存するスクリプト
+
+既定では CHAT_BACKEND=fake（service/fakes.py の LLM・埋め込み・ベクトルストア）でアプリをこのプロセス内に起動するため、
+Gemini のクォータや Qdrant は不要（会話履歴の保存に Redis は必要: docker compose up -d）。
+スタンドインの遅延は FAKE_LLM_LATENCY などの環境変数で変えられる（.env.sample 参照）。
+--url を指定すると、起動済みのサーバーに対して計測する。
+
+結果は bench_results/<日時>_<コミット>.json に保存され、--compare で以前の結果との差を表示できる。
+
+使い方:
+    python3 bench_load.py [--requests 200] [--concurrency 16] [--scenarios session,chat,stream]
+    python3 bench_load.py --compare bench_results/20261017-120000_abc1234.json
+    python3 bench_load.py --url http://localhost:8000
+    python3 bench_load.py --scenarios chat,batch --requests 500   # 1件ずつのチャットとまとめ処理の比較
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import httpx
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+API_PREFIX = "/api/v1"
+SCENARIOS = ("session", "chat", "stream")
+QUERY_TOPICS = ["ログイン", "投稿作成", "有給休暇の申請", "パスワード変更", "通知設定", "ファイル共有", "スケジュール登録", "検索"]
+# 結果に記録する環境変数（スタンドインの遅延とチューニング項目）
+RECORDED_ENV = (
+    "CHAT_BACKEND", "FAKE_SEED", "FAKE_LLM_LATENCY", "FAKE_LLM_CHUNK_LATENCY", "FAKE_LLM_ANSWER_TOKENS",
+    "FAKE_EMBED_LATENCY", "FAKE_VECTOR_LATENCY", "FAKE_CORPUS_SIZE", "CONTEXT_SCORE_THRESHOLD",
+    "EMBEDDING_BATCH_SIZE", "EMBEDDING_BATCH_WINDOW_MS", "PROMPT_CACHE", "RETRIEVAL_BACKEND", "CHAT_BATCH_PREFETCH_SIZE",
+)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def summarize(latencies: list[float], errors: int, total: float, first_bytes: list[float] | None = None) -> dict:
+    """
+    レイテンシ（秒）のリストから p50/p95/p99 と req/s をまとめる
+    """
+    def ms(values: list[float], q: float) -> float:
+        return round(float(np.percentile(values, q)) * 1000, 2) if values else 0.0
+
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "duration_s": round(total, 3),
+        "rps": round(len(latencies) / total, 2) if total > 0 else 0.0,
+        "p50_ms": ms(latencies, 50),
+        "p95_ms": ms(latencies, 95),
+        "p99_ms": ms(latencies, 99),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 2) if latencies else 0.0,
+    }
+    if first_bytes is not None:
+        summary["ttft_p50_ms"] = ms(first_bytes, 50)
+        summary["ttft_p95_ms"] = ms(first_bytes, 95)
+        summary["ttft_p99_ms"] = ms(first_bytes, 99)
+    return summary
+
+
+async def drive(count: int, concurrency: int, request) -> tuple[float, list, int]:
+    """
+    concurrency 件の同時実行で request(i) を count 回呼び、(所要時間, 成功した結果のリスト, 失敗数) を返す
+    """
+    next_index = 0
+    results = []
+    errors = 0
+
+    async def worker(worker_id: int):
+        nonlocal next_index, errors
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            try:
+                results.append(await request(worker_id, i))
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  request {i} failed: {e!r}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(w) for w in range(concurrency)])
+    return time.perf_counter() - start, results, errors
+
+
+def make_query(i: int, repeat: bool) -> str:
+    topic = QUERY_TOPICS[i % len(QUERY_TOPICS)]
+    # 既定では毎回異なる質問にし、回答キャッシュや同時リクエストのまとめを通らない経路を計測する
+    return f"{topic}の方法を教えてください" if repeat else f"{topic}の方法を教えてください (#{i})"
+
+
+async def bench_session(client: httpx.AsyncClient, args) -> dict:
+    async def request(worker_id: int, i: int) -> float:
+        start = time.perf_counter()
+        response = await client.get(f"{API_PREFIX}/create/session")
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    total, latencies, errors = await drive(args.requests, args.concurrency, request)
+    return summarize(latencies, errors, total)
+
+
+async def create_sessions(client: httpx.AsyncClient, count: int) -> list[str]:
+    responses = await asyncio.gather(*[client.get(f"{API_PREFIX}/create/session") for _ in range(count)])
+    return [response.raise_for_status().json()["session_id"] for response in responses]
+
+
+async def bench_chat(client: httpx.AsyncClient, args) -> dict:
+    session_ids = await create_sessions(client, args.concurrency)
+
+    async def request(worker_id: int, i: int) -> float:
+        start = time.perf_counter()
+        response = await client.post(f"{API_PREFIX}/create/chat", json={
+            "session_id": session_ids[worker_id], "query": make_query(i, args.repeat), "use_cache": not args.no_cache,
+        })
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    total, latencies, errors = await drive(args.requests, args.concurrency, request)
+    return summarize(latencies, errors, total)
+
+
+async def bench_stream(client: httpx.AsyncClient, args) -> dict:
+    session_ids = await create_sessions(client, args.concurrency)
+
+    async def request(worker_id: int, i: int) -> tuple[float, float]:
+        start = time.perf_counter()
+        first_byte = None
+        payload = {"session_id": session_ids[worker_id], "query": make_query(i, args.repeat), "use_cache": not args.no_cache}
+        async with client.stream("POST", f"{API_PREFIX}/create/chat/stream", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_byte is None and line.startswith("data:"):
+                    first_byte = time.perf_counter() - start
+                if line.startswith("event: error"):
+                    raise RuntimeError("stream returned an error event")
+        return time.perf_counter() - start, first_byte if first_byte is not None else time.perf_counter() - start
+
+    total, results, errors = await drive(args.requests, args.concurrency, request)
+    return summarize([r[0] for r in results], errors, total, first_bytes=[r[1] for r in results])
+
+
+async def bench_batch(client: httpx.AsyncClient, args) -> dict:
+    """
+    chat と同じ質問を1回の /create/chat/batch で送り、各質問の結果が届くまでの時間を計測する（req/s はバッチ全体の処理量）
+    """
+    payload = {
+        "queries": [{"query": make_query(i, args.repeat)} for i in range(args.requests)],
+        "use_cache": not args.no_cache,
+        "concurrency": args.concurrency,
+    }
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    async with client.stream("POST", f"{API_PREFIX}/create/chat/batch", json=payload) as response:
+        response.raise_for_status()
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line.removeprefix("event:").strip()
+            elif line.startswith("data:"):
+                if event == "error":
+                    raise RuntimeError(f"batch returned an error event: {line}")
+                if event == "result":
+                    if "response" in json.loads(line.removeprefix("data:")):
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+BENCHES = {"session": bench_session, "chat": bench_chat, "stream": bench_stream, "batch": bench_batch}
+
+
+async def run_against(base_url: str, args) -> dict:
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        for name in args.scenarios:
+            if args.warmup:
+                warmup = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+                await BENCHES[name](client, warmup)
+            print(f"running {name}: {args.requests} requests, concurrency {args.concurrency}")
+            results[name] = await BENCHES[name](client, args)
+    return results
+
+
+async def run(args) -> dict:
+    if args.url:
+        return await run_against(args.url.rstrip("/"), args)
+
+    # アプリをこのプロセス内の uvicorn で起動する（ストリーミングの最初のチャンクまでの時間を実際のHTTPで測るため）
+    import uvicorn
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)  # /static のマウントが app/ からの相対パスのため
+    from main import app  # noqa: E402
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if serve_task.done():
+            serve_task.result()
+            raise RuntimeError("server exited during startup")
+        await asyncio.sleep(0.05)
+    try:
+        return await run_against(f"http://127.0.0.1:{port}", args)
+    finally:
+        server.should_exit = True
+        await serve_task
+
+
+def print_results(results: dict, baseline: dict | None) -> None:
+    keys = ("rps", "p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "ttft_p95_ms", "errors")
+    for name, summary in results.items():
+        print(f"\n=== {name} ===")
+        before = (baseline or {}).get("results", {}).get(name, {})
+        for key in keys:
+            if key not in summary:
+                continue
+            line = f"{key:<12} {summary[key]:>10}"
+            if key in before:
+                diff = summary[key] - before[key]
+                ratio = f" ({diff / before[key] * 100:+.1f}%)" if before[key] else ""
+                line += f"   was {before[key]:>10}{ratio}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load-test the chat API and save p50/p95/p99 latency and req/s as JSON")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated: session,chat,stream,batch")
+    parser.add_argument("--warmup", type=int, default=10, help="requests per scenario before measuring")
+    parser.add_argument("--repeat", action="store_true", help="reuse the same 8 questions (exercises the caches)")
+    parser.add_argument("--no-cache", action="store_true", help="send use_cache=false")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--url", help="benchmark a running server instead of starting one in-process")
+    parser.add_argument("--output", help="result file (default: bench_results/<time>_<commit>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in BENCHES]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    if not args.url:
+        # スタンドインの検索スコアは実際の埋め込みより低いため、しきい値を下げて参考情報が入るようにする
+        os.environ.setdefault("CHAT_BACKEND", "fake")
+        if os.environ["CHAT_BACKEND"] == "fake":
+            os.environ.setdefault("CONTEXT_SCORE_THRESHOLD", "0.15")
+
+    # アプリの起動時に作業ディレクトリが app/ に変わるため、先に絶対パスにしておく
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(args))
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "target": args.url or "in-process",
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "use_cache": not args.no_cache,
+            "env": {name: os.environ[name] for name in RECORDED_ENV if name in os.environ},
+        },
+        "results": results,
+    }
+    print_results(results, baseline)
+
+    output = output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Qdrant Retrieval Path Benchmark Script
+同じ擬似クエリで Qdrant の検索経路ごとの1クエリあたりのレイテンシと転送量を比較するスクリプト
+
+- llama_index  : これまでの経路（QdrantVectorStore.aquery、ペイロード全体を取得、keep-alive なし）
+- lean_rest    : 接続プールを使い回す REST クライアントで、必要なペイロードだけを取得し、しきい値未満をサーバー側で除外
+- lean_grpc    : lean_rest と同じ問い合わせを gRPC で行う（--grpc を指定した場合）
+
+転送量は REST ではレスポンスボディのバイト数、全経路共通の指標として受け取ったペイロードをJSONにしたときのバイト数を表示する。
+質問は保存済みのベクトルにノイズを加えたものを使う（埋め込みAPIを呼ばずに計測できる）。
+結果は bench_results/qdrant_paths_<日時>_<コミット>.json に保存される。
+
+使い方:
+    python3 bench_qdrant_paths.py [--queries 200] [--concurrency 8] [--threshold 0.75] [--grpc]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+
+import httpx
+import numpy as np
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+from bench_load import RESULTS_DIR, APP_DIR, git_commit, summarize
+sys.path.insert(0, APP_DIR)
+from service.qdrant_retriever import LeanQdrantRetriever, create_async_qdrant_client  # noqa: E402
+
+load_dotenv()
+
+COLLECTION_ALIAS = "documents"
+# 擬似クエリを作るときに保存済みベクトルへ加えるノイズの大きさ
+QUERY_NOISE = 0.05
+
+
+class WireCounter:
+    """
+    httpx のレスポンスフックで、受け取ったレスポンスボディのバイト数を数える
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.responses = 0
+
+    async def __call__(self, response: httpx.Response) -> None:
+        await response.aread()
+        self.bytes += len(response.content)
+        self.responses += 1
+
+    def hooks(self) -> dict:
+        return {"response": [self]}
+
+
+def sample_queries(client: QdrantClient, collection: str, count: int, seed: int = 0) -> list[list[float]]:
+    """保存済みのベクトルにノイズを加えて擬似的なクエリを作る"""
+    points, _ = client.scroll(collection_name=collection, limit=count, with_payload=False, with_vectors=True)
+    rng = np.random.default_rng(seed)
+    vectors = np.array([point.vector for point in points], dtype=np.float32)
+    vectors += rng.normal(0, QUERY_NOISE, size=vectors.shape).astype(np.float32)
+    return vectors.tolist()
+
+
+def payload_bytes(payloads: list[dict]) -> int:
+    return sum(len(json.dumps(payload, ensure_ascii=False).encode("utf-8")) for payload in payloads)
+
+
+async def measure(search, queries: list[list[float]], concurrency: int) -> tuple[float, list[float], int, int]:
+    """
+    search(query) -> 取得したペイロードのリスト を並列に実行し、(所要時間, レイテンシ, 取得件数, ペイロードのバイト数) を返す
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, counts, sizes = [], [], []
+
+    async def one(query: list[float]) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            payloads = await search(query)
+            latencies.append(time.perf_counter() - start)
+            counts.append(len(payloads))
+            sizes.append(payload_bytes(payloads))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(query) for query in queries])
+    return time.perf_counter() - start, latencies, sum(counts), sum(sizes)
+
+
+async def run(args, queries: list[list[float]]) -> dict:
+    url = os.getenv("QDRANT_URL")
+    results = {}
+
+    async def bench(name: str, search, wire: WireCounter | None) -> None:
+        # 1回目の呼び出しは接続確立を含むため除外する
+        await search(queries[0])
+        if wire is not None:
+            wire.bytes = wire.responses = 0
+        total, latencies, points, sizes = await measure(search, queries, args.concurrency)
+        summary = summarize(latencies, 0, total)
+        summary["points_per_query"] = round(points / len(queries), 2)
+        summary["payload_bytes_per_query"] = round(sizes / len(queries))
+        summary["wire_bytes_per_query"] = round(wire.bytes / max(wire.responses, 1)) if wire is not None else None
+        results[name] = summary
+
+    # これまでの経路（QdrantVectorStore.aquery と同じ問い合わせと、ノードへの変換）
+    wire = WireCounter()
+    aclient = AsyncQdrantClient(url=url, event_hooks=wire.hooks())
+    store = QdrantVectorStore(client=QdrantClient(url=url), aclient=aclient, collection_name=args.collection)
+
+    async def llama_index_search(query):
+        response = await aclient.query_points(
+            collection_name=args.collection, query=query, using=store.dense_vector_name, limit=args.top_k,
+        )
+        store.parse_to_query_result(response.points)
+        return [point.payload for point in response.points]
+
+    await bench("llama_index", llama_index_search, wire)
+    await aclient.close()
+
+    # 接続を使い回す REST
+    wire = WireCounter()
+    aclient = create_async_qdrant_client(url, pool_size=args.pool_size, event_hooks=wire.hooks())
+    retriever = LeanQdrantRetriever(aclient, args.collection, score_threshold=args.threshold)
+    await retriever.refresh_layout()
+
+    async def lean_search(query):
+        response = await retriever.client.query_points(
+            collection_name=retriever.collection_name, limit=args.top_k,
+            with_payload=retriever.payload_fields, with_vectors=False, score_threshold=retriever.score_threshold,
+            **retriever.query_args(query, args.top_k),
+        )
+        for point in response.points:
+            metadata_dict_to_node(point.payload)
+        return [point.payload for point in response.points]
+
+    await bench("lean_rest", lean_search, wire)
+    await aclient.close()
+
+    if args.grpc:
+        aclient = create_async_qdrant_client(url, prefer_grpc=True, grpc_port=args.grpc_port, pool_size=args.pool_size)
+        retriever = LeanQdrantRetriever(aclient, args.collection, score_threshold=args.threshold)
+        await retriever.refresh_layout()
+        await bench("lean_grpc", lean_search, None)
+        await aclient.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare latency and transfer size of Qdrant retrieval paths")
+    parser.add_argument("--collection", default=COLLECTION_ALIAS)
+    parser.add_argument("--queries", type=int, default=200, help="number of sampled queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("CONTEXT_SCORE_THRESHOLD", "0.75")))
+    parser.add_argument("--pool-size", type=int, default=int(os.getenv("QDRANT_POOL_SIZE", "16")))
+    parser.add_argument("--grpc", action="store_true", help="also measure the gRPC transport")
+    parser.add_argument("--grpc-port", type=int, default=int(os.getenv("QDRANT_GRPC_PORT", "6334")))
+    args = parser.parse_args()
+
+    queries = sample_queries(QdrantClient(url=os.getenv("QDRANT_URL")), args.collection, args.queries)
+    if not queries:
+        print("no vectors in the collection.")
+        sys.exit(1)
+    results = asyncio.run(run(args, queries))
+
+    base = results["llama_index"]
+    print(f"\n=== top-{args.top_k} retrieval, {len(queries)} queries, concurrency {args.concurrency} ===")
+    print(f"{'path':<12} {'p50 ms':>8} {'p95 ms':>8} {'points':>7} {'payload B':>10} {'wire B':>9}")
+    for name, summary in results.items():
+        wire = summary["wire_bytes_per_query"]
+        print(f"{name:<12} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['points_per_query']:>7.2f}"
+              f" {summary['payload_bytes_per_query']:>10} {wire if wire is not None else '-':>9}")
+    for name, summary in results.items():
+        if name != "llama_index" and base["p50_ms"] and base["payload_bytes_per_query"]:
+            print(f"{name}: p50 {summary['p50_ms'] / base['p50_ms']:.2f}x, "
+                  f"payload {summary['payload_bytes_per_query'] / base['payload_bytes_per_query']:.2f}x of llama_index")
+
+    commit = git_commit()
+    output = os.path.join(RESULTS_DIR, f"qdrant_paths_{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {"queries": len(queries), "top_k": args.top_k, "concurrency": args.concurrency,
+                       "threshold": args.threshold, "pool_size": args.pool_size},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Retrieval Benchmark Script
+Qdrant (HNSW) と メモリマップインデックス (NumPy の総当たり内積) の
+top-k 検索のレイテンシと再現率を比較するスクリプト
+
+正解は Qdrant の厳密検索 (exact=True) の結果とする。
+質問文を指定しない場合は、保存済みのベクトルにノイズを加えたものを質問として使う
+（埋め込みAPIを呼ばずに計測できる）。
+
+使い方:
+    python3 export_mmap_index.py
+    python3 bench_retrieval.py [--queries 200] [--top-k 10] [--query "ログイン方法"]
+"""
+
+import os
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+import numpy as np
+import qdrant_client
+from qdrant_client.http.models import SearchParams
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.mmap_index import MmapVectorIndex  # noqa: E402
+
+load_dotenv()
+
+COLLECTION_ALIAS = "documents"
+DEFAULT_INDEX_PATH = os.getenv("MMAP_INDEX_PATH", "mmap_index/documents.mmvi")
+# 擬似クエリを作るときに保存済みベクトルへ加えるノイズの大きさ
+QUERY_NOISE = 0.05
+
+
+def sample_queries(index: MmapVectorIndex, count: int, seed: int = 0) -> list[list[float]]:
+    """保存済みのベクトルにノイズを加えて擬似的なクエリを作る"""
+    rng = np.random.default_rng(seed)
+    vectors = index._vectors
+    rows = rng.choice(vectors.shape[0], size=min(count, vectors.shape[0]), replace=False)
+    queries = vectors[rows].astype(np.float32)
+    queries += rng.normal(0, QUERY_NOISE, size=queries.shape).astype(np.float32)
+    return queries.tolist()
+
+
+def embed_queries(texts: list[str]) -> list[list[float]]:
+    """質問文を RETRIEVAL_QUERY で埋め込む"""
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+    from google.genai.types import EmbedContentConfig
+
+    embed_model = GoogleGenAIEmbedding(
+        api_key=os.getenv("GOOGLE_API_KEY"),
+        model_name="models/gemini-embedding-001",
+        embedding_config=EmbedContentConfig(output_dimensionality=768),
+    )
+    return [embed_model.get_query_embedding(text) for text in texts]
+
+
+def percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(name: str, latencies: list[float], recalls: list[float]) -> None:
+    print(
+        f"{name:<8} p50 {percentile(latencies, 50) * 1000:7.2f} ms"
+        f" | p95 {percentile(latencies, 95) * 1000:7.2f} ms"
+        f" | mean {np.mean(latencies) * 1000:7.2f} ms"
+        f" | recall@k {np.mean(recalls):.4f}"
+    )
+
+
+def run(client: qdrant_client.QdrantClient, collection: str, index: MmapVectorIndex, queries: list[list[float]], top_k: int) -> None:
+    qdrant_latencies, qdrant_recalls = [], []
+    mmap_latencies, mmap_recalls = [], []
+
+    # 1回目の呼び出しは接続確立やページの読み込みを含むため除外する
+    client.query_points(collection_name=collection, query=queries[0], limit=top_k)
+    index.search(queries[0], top_k=top_k)
+
+    for query in queries:
+        exact = client.query_points(
+            collection_name=collection, query=query, limit=top_k, search_params=SearchParams(exact=True)
+        ).points
+        expected = {str(point.id) for point in exact}
+        if not expected:
+            continue
+
+        start = time.perf_counter()
+        points = client.query_points(collection_name=collection, query=query, limit=top_k).points
+        qdrant_latencies.append(time.perf_counter() - start)
+        qdrant_recalls.append(len(expected & {str(point.id) for point in points}) / len(expected))
+
+        start = time.perf_counter()
+        nodes = index.search(query, top_k=top_k)
+        mmap_latencies.append(time.perf_counter() - start)
+        mmap_recalls.append(len(expected & {node.node.node_id for node in nodes}) / len(expected))
+
+    print(f"\n=== top-{top_k} retrieval, {len(qdrant_latencies)} queries ===")
+    summarize("qdrant", qdrant_latencies, qdrant_recalls)
+    summarize("mmap", mmap_latencies, mmap_recalls)
+    if mmap_latencies:
+        print(f"speedup (p50): {percentile(qdrant_latencies, 50) / max(percentile(mmap_latencies, 50), 1e-9):.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare Qdrant and memory-mapped retrieval latency and recall")
+    parser.add_argument("--collection", default=COLLECTION_ALIAS)
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="index file (relative paths are resolved against app/)")
+    parser.add_argument("--queries", type=int, default=200, help="number of sampled queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--query", action="append", default=[], help="query text to embed (may be repeated)")
+    args = parser.parse_args()
+
+    path = args.index if os.path.isabs(args.index) else os.path.join(APP_DIR, args.index)
+    index = MmapVectorIndex(path)
+    client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"))
+    queries = embed_queries(args.query) if args.query else sample_queries(index, args.queries)
+    if not queries:
+        print("no queries to run.")
+        sys.exit(1)
+    stats = index.stats()
+    print(f"index: {stats['count']} vectors ({stats['dtype']}, {stats['bytes'] / (1024 * 1024):.1f} MB) from '{stats['collection']}'")
+    run(client, args.collection, index, queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Worker Scaling Benchmark Script
+serve.py をワーカー数を変えて起動し、/api/v1/create/chat のスループットがワーカー数に対して
+どれだけ伸びるか（1ワーカーの何倍か、理想値に対する効率）を計測するスクリプト
+
+CHAT_BACKEND=fake で起動し、スタンドインの遅延は既定で 0 にする（FAKE_*_LATENCY で変更可）。
+遅延を 0 にすると1リクエストあたりのCPU時間（検索・プロンプトの組み立て・トークン数の計算・HTTP処理）で
+スループットが決まるため、ワーカーを増やしたときの伸びを確認できる。
+負荷をかける側が頭打ちにならないよう、クライアントも --client-procs 個のプロセスに分ける。
+CPUコア数がワーカー数より少ない環境では伸びない。Redis は必要（docker compose up -d）。
+
+結果は bench_results/workers_<日時>_<コミット>.json に保存される。
+
+使い方:
+    python3 bench_workers.py [--workers 1,2,4] [--requests 2000] [--concurrency 64]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+import httpx
+
+from bench_load import APP_DIR, RESULTS_DIR, API_PREFIX, free_port, git_commit, drive, make_query, summarize
+
+FAKE_LATENCY_ENV = ("FAKE_LLM_LATENCY", "FAKE_LLM_CHUNK_LATENCY", "FAKE_EMBED_LATENCY", "FAKE_VECTOR_LATENCY")
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "CHAT_BACKEND": "fake", "STARTUP_MODE": "eager"}
+    env.setdefault("CONTEXT_SCORE_THRESHOLD", "0.15")
+    for name in FAKE_LATENCY_ENV:
+        env.setdefault(name, "fixed:0")
+    return subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, workers: int, timeout: float) -> None:
+    """
+    全ワーカーの準備ができるまで待つ（応答したワーカーのプロセスIDは区別できないため、連続して ready になるまで待つ）
+    """
+    deadline = time.perf_counter() + timeout
+    consecutive = 0
+    while consecutive < workers * 4:
+        if process.poll() is not None or time.perf_counter() > deadline:
+            raise RuntimeError(f"server with {workers} workers did not become ready")
+        try:
+            ok = httpx.get(f"{base_url}/healthz/ready", timeout=1.0).status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        consecutive = consecutive + 1 if ok else 0
+        time.sleep(0.05 if ok else 0.2)
+
+
+def client_process(base_url: str, requests: int, concurrency: int, offset: int, timeout: float) -> tuple[float, list[float], int]:
+    """
+    クライアント1プロセス分の負荷をかけ、(所要時間, レイテンシ, 失敗数) を返す
+    """
+    async def run():
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+            responses = await asyncio.gather(*[client.get(f"{API_PREFIX}/create/session") for _ in range(concurrency)])
+            session_ids = [response.raise_for_status().json()["session_id"] for response in responses]
+
+            async def request(worker_id: int, i: int) -> float:
+                start = time.perf_counter()
+                response = await client.post(f"{API_PREFIX}/create/chat", json={
+                    "session_id": session_ids[worker_id], "query": make_query(offset + i, False),
+                })
+                response.raise_for_status()
+                return time.perf_counter() - start
+
+            return await drive(requests, concurrency, request)
+
+    return asyncio.run(run())
+
+
+def measure(workers: int, args) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = start_server(workers, port)
+    try:
+        wait_ready(base_url, process, workers, args.timeout)
+        # 接続の確立や各ワーカーの初回処理を計測から除く
+        client_process(base_url, args.warmup, min(args.concurrency, args.warmup), 10_000_000, args.timeout)
+
+        procs = args.client_procs
+        per_proc = args.requests // procs
+        with multiprocessing.get_context("spawn").Pool(procs) as pool:
+            results = pool.starmap(client_process, [
+                (base_url, per_proc, max(args.concurrency // procs, 1), p * per_proc, args.timeout) for p in range(procs)
+            ])
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    total = max(result[0] for result in results)
+    latencies = [latency for result in results for latency in result[1]]
+    errors = sum(result[2] for result in results)
+    return summarize(latencies, errors, total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure chat throughput scaling with the number of workers (fake backends)")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64, help="total concurrent requests across client processes")
+    parser.add_argument("--client-procs", type=int, default=4, help="processes used to generate load")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    worker_counts = [int(value) for value in args.workers.split(",")]
+
+    print(f"cpu cores: {os.cpu_count()}")
+    results = {}
+    for workers in worker_counts:
+        print(f"running with {workers} worker(s)...")
+        results[str(workers)] = measure(workers, args)
+
+    base = results[str(worker_counts[0])]["rps"] / worker_counts[0]
+    print(f"\n{'workers':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'speedup':>8} {'efficiency':>10}")
+    for workers in worker_counts:
+        summary = results[str(workers)]
+        speedup = summary["rps"] / (base * worker_counts[0]) if base else 0.0
+        summary["speedup"] = round(speedup, 2)
+        summary["efficiency"] = round(summary["rps"] / (base * workers), 2) if base else 0.0
+        print(f"{workers:>7} {summary['rps']:>9.1f} {summary['p50_ms']:>9.1f} {summary['p99_ms']:>9.1f}"
+              f" {speedup:>7.2f}x {summary['efficiency']:>10.2f}")
+
+    commit = git_commit()
+    output = os.path.join(RESULTS_DIR, f"workers_{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "cpu_count": os.cpu_count(),
+            "config": {"requests": args.requests, "concurrency": args.concurrency, "client_procs": args.client_procs},
+            "env": {name: os.getenv(name, "fixed:0") for name in FAKE_LATENCY_ENV},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
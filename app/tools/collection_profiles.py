@@ -0,0 +1,133 @@
+import os
+import sys
+from dataclasses import dataclass
+
+import qdrant_client
+from qdrant_client.http import models
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.qdrant_retriever import FULL_VECTOR_NAME, PREFIX_VECTOR_NAME, truncate_embedding  # noqa: E402
+
+# Qdrant's own defaults, used when a profile does not override them
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCT = 100
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    storage and index settings a versioned collection is created with
+
+    - quantization: keep an int8 copy of every vector in RAM and search with it,
+      the originals are only read to rescore the candidates
+    - on_disk: keep the original float32 vectors on disk (memory mapped) instead of in RAM
+    - m / ef_construct: HNSW graph degree and build-time beam width
+    - prefix_dims: also store the first prefix_dims dimensions (renormalized) as a named
+      vector; the HNSW graph is built only on that vector and the full vectors are only
+      used to rescore the candidates it returns (Matryoshka two-stage retrieval)
+    """
+    name: str
+    description: str
+    quantization: bool = False
+    on_disk: bool = False
+    m: int = DEFAULT_M
+    ef_construct: int = DEFAULT_EF_CONSTRUCT
+    prefix_dims: int | None = None
+
+    @property
+    def vector_name(self) -> str | None:
+        """name of the full vector (None for the unnamed vector of the single-vector profiles)"""
+        return FULL_VECTOR_NAME if self.prefix_dims is not None else None
+
+    def vectors_config(self, size: int) -> models.VectorParams | dict[str, models.VectorParams]:
+        if self.prefix_dims is None:
+            return models.VectorParams(size=size, distance=models.Distance.COSINE, on_disk=self.on_disk)
+        return {
+            # m=0: no graph for the full vectors, they are never searched directly
+            FULL_VECTOR_NAME: models.VectorParams(
+                size=size, distance=models.Distance.COSINE, on_disk=self.on_disk, hnsw_config=models.HnswConfigDiff(m=0)
+            ),
+            PREFIX_VECTOR_NAME: models.VectorParams(size=self.prefix_dims, distance=models.Distance.COSINE),
+        }
+
+    def point_vectors(self, vector: list[float] | dict) -> list[float] | dict[str, list[float]]:
+        """vectors of one point in this profile's layout, from a point of any profile"""
+        full = dense_vector(vector)
+        if self.prefix_dims is None:
+            return full
+        return {FULL_VECTOR_NAME: full, PREFIX_VECTOR_NAME: truncate_embedding(full, self.prefix_dims)}
+
+    def hnsw_config(self) -> models.HnswConfigDiff | None:
+        if self.m == DEFAULT_M and self.ef_construct == DEFAULT_EF_CONSTRUCT:
+            return None
+        return models.HnswConfigDiff(m=self.m, ef_construct=self.ef_construct)
+
+    def quantization_config(self) -> models.ScalarQuantization | None:
+        if not self.quantization:
+            return None
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+
+    def estimate_memory(self, count: int, size: int) -> dict:
+        """
+        rough RAM / disk footprint in bytes: float32 originals, prefix vectors, int8 copies
+        and the HNSW links (about 2 * m links of 4 bytes per point on the base layer)
+        """
+        originals = count * size * 4
+        prefixes = count * (self.prefix_dims or 0) * 4
+        quantized = (originals + prefixes) // 4 if self.quantization else 0
+        graph = count * self.m * 2 * 4
+        return {
+            "ram_bytes": (0 if self.on_disk else originals) + prefixes + quantized + graph,
+            "disk_bytes": originals if self.on_disk else 0,
+        }
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        CollectionProfile("default", "float32 vectors in RAM, default HNSW (m=16, ef_construct=100)"),
+        CollectionProfile("int8", "int8 scalar quantization in RAM, float32 originals in RAM for rescoring", quantization=True),
+        CollectionProfile("int8_disk", "int8 scalar quantization in RAM, float32 originals on disk for rescoring", quantization=True, on_disk=True),
+        CollectionProfile("hnsw_small", "float32 vectors in RAM, sparser graph (m=8, ef_construct=64)", m=8, ef_construct=64),
+        CollectionProfile("hnsw_accurate", "float32 vectors in RAM, denser graph (m=32, ef_construct=256)", m=32, ef_construct=256),
+        CollectionProfile("matryoshka256", "graph on 256-d prefix vectors in RAM, full vectors on disk for rescoring", on_disk=True, prefix_dims=256),
+        CollectionProfile("matryoshka128", "graph on 128-d prefix vectors in RAM, full vectors on disk for rescoring", on_disk=True, prefix_dims=128),
+    )
+}
+
+
+def dense_vector(vector: list[float] | dict) -> list[float]:
+    """the full vector of a scrolled point, whether the collection uses named vectors or not"""
+    return vector[FULL_VECTOR_NAME] if isinstance(vector, dict) else vector
+
+
+def create_collection_with_profile(
+    client: qdrant_client.QdrantClient,
+    collection: str,
+    size: int,
+    profile: CollectionProfile,
+    optimizers_config: models.OptimizersConfigDiff | None = None,
+) -> None:
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=profile.vectors_config(size),
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config(),
+        optimizers_config=optimizers_config,
+    )
+
+
+def upsert_prefix_vectors(client: qdrant_client.QdrantClient, collection: str, profile: CollectionProfile, nodes: list) -> None:
+    """llama_index only writes the full vector, the prefix vector is added to the same points afterwards"""
+    if profile.prefix_dims is None:
+        return
+    client.update_vectors(
+        collection_name=collection,
+        points=[
+            models.PointVectors(id=node.node_id, vector={PREFIX_VECTOR_NAME: truncate_embedding(node.embedding, profile.prefix_dims)})
+            for node in nodes
+        ],
+    )
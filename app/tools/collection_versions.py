@@ -0,0 +1,136 @@
+import random
+from datetime import datetime
+from typing import Callable
+
+import qdrant_client
+from qdrant_client.http import models
+
+
+def version_name(alias: str) -> str:
+    """name of a new versioned collection, e.g. documents_v20250708153000"""
+    return f"{alias}_v{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+
+def list_versions(client: qdrant_client.QdrantClient, alias: str) -> list[str]:
+    """versioned collections behind the alias, oldest first"""
+    prefix = f"{alias}_v"
+    return sorted(c.name for c in client.get_collections().collections if c.name.startswith(prefix))
+
+
+def resolve_alias(client: qdrant_client.QdrantClient, alias: str) -> str | None:
+    """collection the alias currently points to (None if the alias does not exist)"""
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def is_legacy_collection(client: qdrant_client.QdrantClient, alias: str) -> bool:
+    """a real collection still occupies the alias name (created before versioning was introduced)"""
+    return resolve_alias(client, alias) is None and client.collection_exists(alias)
+
+
+def copy_points(
+    client: qdrant_client.QdrantClient,
+    source: str,
+    target: str,
+    batch_size: int = 256,
+    vector_fn: Callable[[list[float] | dict], list[float] | dict] | None = None,
+) -> int:
+    """
+    copy every point (vectors and payload) from source into target, no re-embedding needed
+    vector_fn converts the vectors when the target uses a different layout (e.g. another profile)
+    """
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[
+                    models.PointStruct(id=p.id, vector=vector_fn(p.vector) if vector_fn else p.vector, payload=p.payload)
+                    for p in points
+                ],
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+
+def verify_collection(
+    client: qdrant_client.QdrantClient,
+    collection: str,
+    point_ids: list[str],
+    expected_count: int,
+    query_vectors: dict[str, list[float]] | None = None,
+    samples: int = 5,
+    using: str | None = None,
+) -> list[str]:
+    """
+    check a freshly built collection before it goes live, returns a list of problems (empty if ok)
+
+    - the point count matches the manifest
+    - a few stored chunks are found again (score ~1) with their own vector
+    - every sample query returns at least one hit
+
+    using is the name of the full vector in collections with named vectors
+    """
+    problems = []
+    count = client.count(collection_name=collection, exact=True).count
+    if count == 0:
+        problems.append("collection is empty")
+    if count != expected_count:
+        problems.append(f"point count {count} does not match the manifest ({expected_count})")
+
+    sample_ids = random.sample(point_ids, min(samples, len(point_ids)))
+    if sample_ids:
+        for point in client.retrieve(collection_name=collection, ids=sample_ids, with_vectors=True):
+            vector = point.vector[using] if using else point.vector
+            # duplicated chunks in different files share a vector, so only the top score is checked
+            hits = client.query_points(collection_name=collection, query=vector, using=using, limit=1).points
+            if not hits or hits[0].score < 0.999:
+                problems.append(f"point {point.id} is not retrievable with its own vector")
+
+    for query, vector in (query_vectors or {}).items():
+        if not client.query_points(collection_name=collection, query=vector, using=using, limit=1).points:
+            problems.append(f"sample query '{query}' returned nothing")
+    return problems
+
+
+def swap_alias(client: qdrant_client.QdrantClient, alias: str, target: str) -> str | None:
+    """atomically repoint the alias to target, returns the previous collection"""
+    previous = resolve_alias(client, alias)
+    operations = []
+    if previous is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    elif client.collection_exists(alias):
+        # one-time migration: the alias name is still a real collection and has to go first
+        print(f"deleting the legacy collection '{alias}' to free the name for the alias.")
+        client.delete_collection(alias)
+    operations.append(
+        models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=alias))
+    )
+    client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+
+def prune_versions(client: qdrant_client.QdrantClient, alias: str, keep: int) -> list[str]:
+    """delete old versions, keeping the newest `keep` ones and always the live one"""
+    live = resolve_alias(client, alias)
+    versions = list_versions(client, alias)
+    removed = []
+    for name in versions[:-keep] if keep > 0 else versions:
+        if name != live:
+            client.delete_collection(name)
+            removed.append(name)
+    return removed
+
+
+def previous_version(client: qdrant_client.QdrantClient, alias: str) -> str | None:
+    """the newest version that is older than the live one"""
+    live = resolve_alias(client, alias)
+    older = [name for name in list_versions(client, alias) if live is None or name < live]
+    return older[-1] if older else None
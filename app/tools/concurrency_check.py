@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Concurrency Check Script
+起動中のバックエンドに対して /api/v1/create/chat を同時に N 件送信し、
+1件だけ送った場合の所要時間と比較するスクリプト
+
+非同期パイプラインが正しく動作していれば、N件の同時リクエストは
+おおよそ1件分の時間で完了する（比率が 1.0 に近くなる）。
+並行処理の判定には、回答キャッシュを使わない互いに異なる N 件の質問を送る
+（同じ質問では回答キャッシュや実行中の1件へのまとめで、生成が直列でも速く終わるため）。
+同じ質問の同時リクエストのまとめは、別の段階として計測・表示する。
+
+使い方:
+    python3 concurrency_check.py [同時リクエスト数] [質問文]
+"""
+
+import sys
+import time
+import asyncio
+import httpx
+
+BASE_URL = "http://localhost:8000/api/v1"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_QUERY = "ログイン方法を教えてください"
+# 同時実行時の所要時間が単発の何倍以内なら並行処理できているとみなすか
+ACCEPTABLE_RATIO = 2.0
+
+
+async def create_session(client: httpx.AsyncClient) -> str:
+    """セッションを作成し、セッションIDを返す"""
+    response = await client.get(f"{BASE_URL}/create/session")
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+async def send_chat(client: httpx.AsyncClient, session_id: str, query: str, use_cache: bool = False) -> float:
+    """チャットリクエストを1件送信し、所要時間（秒）を返す"""
+    start = time.perf_counter()
+    response = await client.post(
+        f"{BASE_URL}/create/chat",
+        json={"session_id": session_id, "query": query, "use_cache": use_cache},
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def get_coalescing(client: httpx.AsyncClient) -> dict:
+    response = await client.get(f"{BASE_URL}/chat/stats")
+    response.raise_for_status()
+    return response.json()["coalescing"]
+
+
+async def run(concurrency: int, query: str) -> bool:
+    """単発と同時実行の所要時間を計測して比較し、同じ質問の同時リクエストのまとめを別に計測する"""
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        session_ids = await asyncio.gather(*[create_session(client) for _ in range(2 * concurrency + 1)])
+        # 番号を付けて質問を変え、回答キャッシュも使わないため、どのリクエストも生成まで行う
+        queries = [f"{query} ({i})" for i in range(concurrency + 1)]
+
+        print("=== 単発リクエスト ===")
+        single = await send_chat(client, session_ids[0], queries[0])
+        print(f"所要時間: {single:.2f}s")
+
+        print(f"\n=== 異なる質問の同時リクエスト ({concurrency}件) ===")
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[
+            send_chat(client, sid, q) for sid, q in zip(session_ids[1:concurrency + 1], queries[1:])
+        ])
+        total = time.perf_counter() - start
+        print(f"全体の所要時間: {total:.2f}s")
+        print(f"最小/最大レイテンシ: {min(latencies):.2f}s / {max(latencies):.2f}s")
+
+        # 同じ質問の同時リクエストは1件の生成にまとめられる（回答キャッシュは使わず、まとめだけを見る）
+        print(f"\n=== 同じ質問の同時リクエスト ({concurrency}件) ===")
+        before = await get_coalescing(client)
+        start = time.perf_counter()
+        await asyncio.gather(*[send_chat(client, sid, query) for sid in session_ids[concurrency + 1:]])
+        same_total = time.perf_counter() - start
+        after = await get_coalescing(client)
+        collapsed = after["collapsed"] - before["collapsed"]
+        print(f"全体の所要時間: {same_total:.2f}s")
+        print(
+            f"まとめられたリクエスト: {collapsed}/{concurrency - 1}件"
+            f" (上流の処理: {after['leaders'] - before['leaders']}件, 待ちきれず個別に処理: {after['timeouts'] - before['timeouts']}件)"
+        )
+
+    ratio = total / single if single > 0 else float("inf")
+    print(f"\n同時実行 / 単発 の比率: {ratio:.2f} (許容値: {ACCEPTABLE_RATIO})")
+    if ratio <= ACCEPTABLE_RATIO:
+        print("✅ リクエストは並行に処理されています")
+        return True
+    print("❌ リクエストが直列化されている可能性があります")
+    return False
+
+
+def main():
+    """メイン関数"""
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CONCURRENCY
+    query = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_QUERY
+    ok = asyncio.run(run(concurrency, query))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,401 @@
 import os
+import sys
+import asyncio
+import argparse
+import resource
+from typing import Iterator
 from dotenv import load_dotenv
 
+import redis
 import qdrant_client
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import PointIdsList, SetPayload, SetPayloadOperation
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
 from google.genai.types import EmbedContentConfig
-from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex
+from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode, NodeRelationship
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+from ingest_manifest import IngestManifest, file_hash, text_hash, chunk_id
+from batch_embedder import BatchEmbedder, IngestCheckpoint
+from image_variants import build_image_variants, referenced_images, rewrite_image_urls
+from export_mmap_index import refresh_index as refresh_mmap_index
+from collection_profiles import PROFILES, CollectionProfile, create_collection_with_profile, upsert_prefix_vectors
+from collection_versions import (
+    version_name, resolve_alias, is_legacy_collection, copy_points, verify_collection,
+    swap_alias, prune_versions, previous_version,
+)
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-# google-genai embed model 
+# the chat server reads this alias; every ingestion builds a new versioned collection
+# (documents_v<timestamp>) and repoints the alias to it once it is verified
+COLLECTION_ALIAS = "documents"
+VECTOR_SIZE = 768
+DATA_DIR = "../data"
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_DIR = os.path.join(TOOLS_DIR, "ingest_manifests")
+LEGACY_MANIFEST_PATH = os.path.join(TOOLS_DIR, "ingest_manifest.json")
+CHECKPOINT_PATH = os.path.join(TOOLS_DIR, "ingest_checkpoint.jsonl")
+# documents whose image references are rewritten to the optimized screenshots (see image_variants.py)
+IMAGE_REFERENCE_EXTENSIONS = {".md", ".markdown", ".txt", ".html", ".htm"}
+
+# the chat server drops its cached answers when this key changes
+INDEX_VERSION_KEY = "index_version:documents"
+
+# google-genai embed model
+# retries are handled by BatchEmbedder, which backs off across all in-flight batches
 embed_model = GoogleGenAIEmbedding(
     api_key=GOOGLE_API_KEY,
     model_name="models/gemini-embedding-001",
-    embedding_config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT", output_dimensionality=768),
+    embedding_config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT", output_dimensionality=VECTOR_SIZE),
+    retries=1,
 )
 
-embeddings = embed_model.get_text_embedding("Google Gemini Embeddings.")
+splitter = SentenceSplitter(chunk_size=512, chunk_overlap=128)
 
-# qdrant client
-client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"))
-vector_store = QdrantVectorStore(
-    collection_name="documents", client=client
-)
 
-# if collection exists, recreate collection
-COLLECTION_NAME = "documents"
-VECTOR_SIZE = 768
+def manifest_path(collection: str) -> str:
+    """every versioned collection has its own manifest, so a rollback keeps them consistent"""
+    return os.path.join(MANIFEST_DIR, f"{collection}.json")
+
+
+def create_collection(client: qdrant_client.QdrantClient, collection: str, profile: CollectionProfile) -> None:
+    if not client.collection_exists(collection):
+        create_collection_with_profile(client, collection, VECTOR_SIZE, profile)
+        print(f"collection '{collection}' is created with the '{profile.name}' profile ({profile.description}).")
+
+
+def split_with_stable_ids(documents: list) -> list:
+    """
+    split documents into chunks whose ids are derived from the file path and the
+    chunk content, so an unchanged chunk keeps its id (and its vector) across runs
+    """
+    nodes = splitter.get_nodes_from_documents(documents)
+
+    id_map = {}
+    for node in nodes:
+        path = node.metadata["file_path"]
+        node.metadata["chunk_hash"] = text_hash(node.get_content(metadata_mode=MetadataMode.EMBED))
+        id_map[node.node_id] = chunk_id(path, node.metadata["chunk_hash"])
+    node_map = {}
+    for node in nodes:
+        node.excluded_embed_metadata_keys.append("chunk_hash")
+        node.excluded_llm_metadata_keys.append("chunk_hash")
+        node.id_ = id_map[node.node_id]
+        for relationship in (NodeRelationship.PREVIOUS, NodeRelationship.NEXT):
+            related = node.relationships.get(relationship)
+            if related is not None and related.node_id in id_map:
+                related.node_id = id_map[related.node_id]
+        # identical chunks inside one document collapse into a single point
+        node_map[node.node_id] = node
+    return list(node_map.values())
+
+
+def bump_index_version(index_version: str) -> None:
+    """update the index version so that the chat server drops its cached answers"""
+    try:
+        redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")).set(INDEX_VERSION_KEY, index_version)
+        print(f"index version is updated to '{index_version}'.")
+    except Exception as e:
+        print(f"index version update failed. : {e}")
+
+
+def iter_windows(paths: list[str], window_size: int) -> Iterator[list[str]]:
+    """yield the files in fixed size windows so only one window of documents is in memory"""
+    for i in range(0, len(paths), window_size):
+        yield paths[i:i + window_size]
+
+
+def may_reference_images(path: str) -> bool:
+    """only text documents have their image references hashed and rewritten, so the two always agree"""
+    return os.path.splitext(path)[1].lower() in IMAGE_REFERENCE_EXTENSIONS
+
+
+def document_hash(path: str, image_manifest: dict) -> str:
+    """
+    the file hash, combined with the hashes of the screenshots a text document references,
+    so replacing a screenshot re-ingests the documents whose chunks point at its variants
+    """
+    digest = file_hash(path)
+    if not image_manifest or not may_reference_images(path):
+        return digest
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        images = referenced_images(f.read(), image_manifest)
+    return text_hash(digest + "".join(image_manifest[image]["hash"] for image in images)) if images else digest
+
+
+def load_window(paths: list[str], image_manifest: dict) -> dict[str, list]:
+    """load and split one window of files, grouping the chunks by file"""
+    reader = SimpleDirectoryReader(input_files=paths, encoding="utf-8", filename_as_id=True)
+    nodes_by_file: dict[str, list] = {path: [] for path in paths}
+    for documents in reader.iter_data():
+        # image references are rewritten before splitting, so the chunk hashes cover the optimized urls
+        for document in documents:
+            if may_reference_images(document.metadata["file_path"]):
+                document.set_content(rewrite_image_urls(document.text, image_manifest))
+        for node in split_with_stable_ids(documents):
+            nodes_by_file[node.metadata["file_path"]].append(node)
+    return nodes_by_file
+
+
+def peak_rss_mb() -> float:
+    """peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
 
-try:
-    client.recreate_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
+
+def refresh_payloads(client: qdrant_client.QdrantClient, collection: str, vector_store: QdrantVectorStore, nodes: list) -> None:
+    """unchanged chunks keep their vectors, only the payload (offsets, neighbours) is refreshed"""
+    client.batch_update_points(
+        collection_name=collection,
+        update_operations=[
+            SetPayloadOperation(
+                set_payload=SetPayload(
+                    payload=node_to_metadata_dict(node, remove_text=False, flat_metadata=vector_store.flat_metadata),
+                    points=[node.node_id],
+                )
+            )
+            for node in nodes
+        ],
     )
-    print(f"collection '{COLLECTION_NAME}' is recreated.")
-except Exception as e:
-    print(f"collection recreation failed. : {e}")
 
-# configure the destination vector store 
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
-# load documents data
-reader = SimpleDirectoryReader(input_dir="../data", encoding="utf-8")
-documents = reader.load_data()
+async def ingest(
+    full: bool = False,
+    batch_size: int = 50,
+    concurrency: int = 4,
+    window_size: int = 64,
+    keep: int = 2,
+    verify_queries: list[str] | None = None,
+    profile: str = "default",
+) -> None:
+    client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"))
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    if os.path.exists(LEGACY_MANIFEST_PATH) and is_legacy_collection(client, COLLECTION_ALIAS):
+        # manifest written before versioning, it describes the legacy 'documents' collection
+        os.replace(LEGACY_MANIFEST_PATH, manifest_path(COLLECTION_ALIAS))
 
-splitter = SentenceSplitter(chunk_size=512, chunk_overlap=128)
+    # screenshots are optimized first so the chunk text can reference the hashed variants
+    image_manifest = await asyncio.to_thread(build_image_variants)
+    print(f"{len(image_manifest)} images have optimized variants.")
 
-index = VectorStoreIndex.from_documents(
-    documents,
-    storage_context=storage_context,
-    embed_model=embed_model,
-    transformations=[splitter]
-)
+    # hash files by content (only the paths are kept in memory)
+    input_files = [str(path) for path in SimpleDirectoryReader(input_dir=DATA_DIR, encoding="utf-8").input_files]
+    current_hashes = {path: document_hash(path, image_manifest) for path in input_files}
+
+    checkpoint = IngestCheckpoint(CHECKPOINT_PATH)
+    if checkpoint.exists():
+        # resume the interrupted run into the same target collection
+        print(f"checkpoint found, resuming the previous {'full' if checkpoint.full else 'incremental'} run into '{checkpoint.collection}'.")
+        full, collection, source, profile = checkpoint.full, checkpoint.collection, checkpoint.source, checkpoint.profile
+        manifest = IngestManifest.load(manifest_path(collection))
+    else:
+        source = resolve_alias(client, COLLECTION_ALIAS) or (COLLECTION_ALIAS if is_legacy_collection(client, COLLECTION_ALIAS) else None)
+        if not full and (source is None or not os.path.exists(manifest_path(source))):
+            if source is not None:
+                # points written without a manifest have random ids and cannot be tracked
+                print(f"no manifest found for '{source}', falling back to a full rebuild.")
+            full = True
+        if not full:
+            live = IngestManifest.load(manifest_path(source))
+            changed_files, deleted_files = live.diff(current_hashes)
+            # manifests written before profiles describe a 'default' collection
+            if not changed_files and not deleted_files and (live.profile or "default") == profile:
+                # a new version would hold the same points, and bumping the index version would clear the answer caches
+                print(f"\nno changes since '{source}' ({len(input_files)} files unchanged, profile '{profile}'), the alias is not changed.")
+                return
+        collection = version_name(COLLECTION_ALIAS)
+        if full:
+            manifest = IngestManifest(manifest_path(collection))
+        else:
+            # start from the live collection's manifest, its points are copied over below
+            manifest = IngestManifest.load(manifest_path(source))
+            manifest.path = manifest_path(collection)
+        create_collection(client, collection, PROFILES[profile])
+        checkpoint.start(full, collection, source, profile)
+    manifest.collection = collection
+    manifest.profile = profile
+
+    if not full and "copy" not in checkpoint.steps:
+        # the vectors are converted when the new version uses a different profile
+        copied = await asyncio.to_thread(copy_points, client, source, collection, vector_fn=PROFILES[profile].point_vectors)
+        checkpoint.finish_step("copy")
+        print(f"copied {copied} points from '{source}' into '{collection}'.")
+    manifest.save()
+
+    vector_store = QdrantVectorStore(collection_name=collection, client=client)
+
+    # classify files against what the new version holds so far
+    changed_files, deleted_files = manifest.diff(current_hashes)
+
+    report = {
+        "files_unchanged": len(input_files) - len(changed_files),
+        "files_changed": len(changed_files),
+        "files_deleted": len(deleted_files),
+        "chunks_embedded": 0,
+        "chunks_resumed": 0,
+        "chunks_reused": 0,
+        "chunks_deleted": 0,
+    }
+
+    stale_ids: set[str] = set()
+    for path in deleted_files:
+        stale_ids |= manifest.chunk_ids(path)
+        manifest.remove_document(path)
+    if stale_ids:
+        client.delete(collection_name=collection, points_selector=PointIdsList(points=list(stale_ids)))
+        report["chunks_deleted"] += len(stale_ids)
+    manifest.save()
+
+    async def upsert(batch: list) -> None:
+        await asyncio.to_thread(vector_store.add, batch)
+        await asyncio.to_thread(upsert_prefix_vectors, client, collection, PROFILES[profile], batch)
+
+    embedder = BatchEmbedder(embed_model, batch_size=batch_size, concurrency=concurrency, checkpoint=checkpoint)
+
+    # load -> split -> embed -> upsert one window at a time; the next window is loaded
+    # in a worker thread while the current one is embedded, so at most two are in memory
+    windows = iter_windows(changed_files, window_size)
+    window_count = (len(changed_files) + window_size - 1) // window_size
+    next_window = next(windows, None)
+    loading = asyncio.create_task(asyncio.to_thread(load_window, next_window, image_manifest)) if next_window else None
+    for window_number in range(1, window_count + 1):
+        nodes_by_file = await loading
+        next_window = next(windows, None)
+        loading = asyncio.create_task(asyncio.to_thread(load_window, next_window, image_manifest)) if next_window else None
+
+        new_nodes = []
+        reused_nodes = []
+        window_stale_ids: set[str] = set()
+        for path, file_nodes in nodes_by_file.items():
+            previous_ids = manifest.chunk_ids(path)
+            window_stale_ids |= previous_ids - {node.node_id for node in file_nodes}
+            for node in file_nodes:
+                (reused_nodes if node.node_id in previous_ids else new_nodes).append(node)
+
+        # embed and upsert only the chunks that are new, batch by batch
+        if new_nodes:
+            embed_stats = await embedder.run(new_nodes, on_batch=upsert)
+            report["chunks_embedded"] = embed_stats["chunks"]
+            report["chunks_resumed"] = embed_stats["chunks_resumed"]
+        if reused_nodes:
+            await asyncio.to_thread(refresh_payloads, client, collection, vector_store, reused_nodes)
+            report["chunks_reused"] += len(reused_nodes)
+        if window_stale_ids:
+            client.delete(collection_name=collection, points_selector=PointIdsList(points=list(window_stale_ids)))
+            report["chunks_deleted"] += len(window_stale_ids)
+
+        for path, file_nodes in nodes_by_file.items():
+            manifest.set_document(
+                path, current_hashes[path], {node.node_id: node.metadata["chunk_hash"] for node in file_nodes}
+            )
+        manifest.save()
+        print(
+            f"[window {window_number}/{window_count}] {len(nodes_by_file)} files,"
+            f" {len(new_nodes)} new / {len(reused_nodes)} reused / {len(window_stale_ids)} deleted chunks"
+            f" | peak RSS {peak_rss_mb():.1f} MB"
+        )
+
+    if embedder.embedded_chunks:
+        embed_stats = embedder.stats()
+        print(
+            f"embedded {embed_stats['chunks']} chunks in {embed_stats['seconds']}s"
+            f" ({embed_stats['chunks_per_second']} chunks/s, {embed_stats['tokens_per_second']} tokens/s,"
+            f" throttled {embed_stats['throttled']} times)"
+        )
+
+    # chunks in unchanged files are reused as well
+    avoided = manifest.total_chunks() - report["chunks_embedded"]
+    print("\n=== ingestion report ===")
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    print(f"embeddings avoided: {avoided} / {manifest.total_chunks()} chunks")
+    print(f"peak RSS: {peak_rss_mb():.1f} MB")
+
+    # verify the new version before it goes live
+    point_ids = [point_id for entry in manifest.documents.values() for point_id in entry["chunks"]]
+    query_vectors = {query: embed_model.get_query_embedding(query) for query in verify_queries or []}
+    problems = verify_collection(
+        client, collection, point_ids, manifest.total_chunks(), query_vectors, using=PROFILES[profile].vector_name
+    )
+    if problems:
+        print(f"\n❌ verification of '{collection}' failed, the alias is not changed:")
+        for problem in problems:
+            print(f"  - {problem}")
+        # a left-over version could not be resumed and, being the newest, would push a valid version out of prune_versions
+        client.delete_collection(collection)
+        if os.path.exists(manifest_path(collection)):
+            os.remove(manifest_path(collection))
+        # the checkpoint points at the deleted collection, so it cannot be resumed either
+        checkpoint.clear()
+        print(f"'{collection}' and its manifest are deleted.")
+        sys.exit(1)
+    checkpoint.clear()
+    print(f"\n✅ '{collection}' is verified.")
+
+    previous = swap_alias(client, COLLECTION_ALIAS, collection)
+    print(f"alias '{COLLECTION_ALIAS}' now points to '{collection}' (previous: {previous or source}).")
+    if previous is None and os.path.exists(manifest_path(COLLECTION_ALIAS)):
+        # the legacy collection was replaced by the alias
+        os.remove(manifest_path(COLLECTION_ALIAS))
+    for removed in prune_versions(client, COLLECTION_ALIAS, keep):
+        print(f"old version '{removed}' is deleted.")
+        if os.path.exists(manifest_path(removed)):
+            os.remove(manifest_path(removed))
+    # chat servers running with RETRIEVAL_BACKEND=mmap search this file, not the alias
+    try:
+        mmap_stats = await asyncio.to_thread(refresh_mmap_index, client, collection)
+    except Exception as e:
+        print(f"⚠️ failed to re-export the mmap index, run export_mmap_index.py before mmap servers serve '{collection}': {e}")
+    else:
+        if mmap_stats is not None:
+            print(f"mmap index is re-exported from '{collection}' ({mmap_stats['count']} vectors, {mmap_stats['dtype']}).")
+    bump_index_version(collection)
+
+
+def rollback() -> None:
+    """repoint the alias to the previous version"""
+    client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"))
+    target = previous_version(client, COLLECTION_ALIAS)
+    if target is None:
+        print("no previous version to roll back to.")
+        sys.exit(1)
+    current = swap_alias(client, COLLECTION_ALIAS, target)
+    print(f"alias '{COLLECTION_ALIAS}' is rolled back from '{current}' to '{target}'.")
+    bump_index_version(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embed ../data into a new version of the Qdrant 'documents' collection")
+    parser.add_argument("--full", action="store_true", help="build the new version from scratch and re-embed every document")
+    parser.add_argument("--batch-size", type=int, default=50, help="chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum embedding requests in flight")
+    parser.add_argument("--window-size", type=int, default=64, help="files loaded, split and embedded together")
+    parser.add_argument("--keep", type=int, default=2, help="versions kept for rollback (including the live one)")
+    parser.add_argument("--verify-query", action="append", default=[], help="sample query that must return hits before the swap")
+    parser.add_argument(
+        "--profile", choices=sorted(PROFILES), default=os.getenv("COLLECTION_PROFILE", "default"),
+        help="storage / index settings of the new version (see collection_profiles.py)",
+    )
+    parser.add_argument("--rollback", action="store_true", help="repoint the alias to the previous version and exit")
+    args = parser.parse_args()
+    if args.rollback:
+        rollback()
+        return
+    asyncio.run(ingest(
+        full=args.full,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        window_size=args.window_size,
+        keep=args.keep,
+        verify_queries=args.verify_query,
+        profile=args.profile,
+    ))
 
-print(index)
 
-embeddings = embed_model.get_text_embedding("Google Gemini Embeddings.")
-print(embeddings[:5])
-print(f"Dimension of embeddings: {len(embeddings)}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
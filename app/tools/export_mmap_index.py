@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+import numpy as np
+import qdrant_client
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.mmap_index import write_index, MmapVectorIndex  # noqa: E402
+from collection_versions import resolve_alias  # noqa: E402
+from collection_profiles import dense_vector  # noqa: E402
+
+load_dotenv()
+
+COLLECTION_ALIAS = "documents"
+# relative to app/, the directory the chat server runs from
+DEFAULT_INDEX_PATH = os.getenv("MMAP_INDEX_PATH", "mmap_index/documents.mmvi")
+
+
+def export(client: qdrant_client.QdrantClient, collection: str, path: str, dtype: str, batch_size: int = 256) -> dict:
+    """scroll every point of the collection and write vectors and payloads into one mmap file"""
+    ids, vectors, payloads = [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        for point in points:
+            ids.append(str(point.id))
+            vectors.append(dense_vector(point.vector))
+            payloads.append(point.payload)
+        if offset is None:
+            break
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    write_index(path, ids, matrix, payloads, collection=collection, dtype=dtype)
+    return MmapVectorIndex(path).stats()
+
+
+def resolve_index_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(APP_DIR, path)
+
+
+def refresh_index(client: qdrant_client.QdrantClient, collection: str) -> dict | None:
+    """
+    re-export the chat server's index file from a newly swapped-in collection
+    only when MMAP_INDEX_PATH is set or the file was exported before; the dtype of the existing file is kept
+    """
+    path = resolve_index_path(DEFAULT_INDEX_PATH)
+    if not os.getenv("MMAP_INDEX_PATH") and not os.path.exists(path):
+        return None
+    dtype = MmapVectorIndex(path).header["dtype"] if os.path.exists(path) else "float32"
+    return export(client, collection, path, dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export the Qdrant 'documents' collection into a memory-mapped index file")
+    parser.add_argument("--collection", default=COLLECTION_ALIAS, help="collection or alias to export")
+    parser.add_argument("--output", default=DEFAULT_INDEX_PATH, help="index file (relative paths are resolved against app/)")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="float16 halves the file size")
+    args = parser.parse_args()
+
+    path = resolve_index_path(args.output)
+    client = qdrant_client.QdrantClient(url=os.getenv("QDRANT_URL"))
+    # record the versioned collection behind the alias, so the file shows what it was built from
+    collection = resolve_alias(client, args.collection) or args.collection
+    start = time.perf_counter()
+    stats = export(client, collection, path, args.dtype)
+    print(
+        f"exported {stats['count']} vectors ({stats['dtype']}) from '{collection}' to {path}"
+        f" | {stats['bytes'] / (1024 * 1024):.1f} MB | {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
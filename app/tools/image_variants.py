@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Image Variant Builder
+generate optimized, content-hashed copies of the operation screenshots in app/images
+and rewrite image references in document text to point at them
+
+- <name>.<hash>.<ext>               the original bytes under a content-hashed name
+- <name>.<hash>.webp / .w<width>.webp  WebP at full size and at each width smaller than the original
+- <file>.gz / <file>.br            precompressed copies of compressible formats (SVG); brotli only when installed
+
+everything is written to app/images/_v/ (served with an immutable Cache-Control by
+service/static_images.py) together with manifest.json. a file name never changes its
+content, so variants are only added, never rewritten; chunks that still reference an
+older variant keep working after a screenshot is replaced.
+
+embedding.py runs this before every ingestion; it can also be run on its own:
+    python3 image_variants.py [--widths 480,960] [--default-width 960] [--quality 80]
+"""
+
+import os
+import io
+import re
+import sys
+import gzip
+import json
+import argparse
+from urllib.parse import unquote
+
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.static_images import VARIANT_DIR  # noqa: E402
+from ingest_manifest import file_hash, text_hash  # noqa: E402
+
+try:
+    import brotli
+except ImportError:  # optional, gzip copies are always written
+    brotli = None
+
+IMAGES_DIR = os.path.join(APP_DIR, "images")
+OUTPUT_DIR = os.path.join(IMAGES_DIR, VARIANT_DIR)
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "manifest.json")
+# the path the chat server mounts app/images at, used for references that do not contain it
+IMAGE_URL_PREFIX = os.getenv("IMAGE_URL_PREFIX", "/static")
+
+DEFAULT_WIDTHS = (480, 960)
+# width of the variant chunk text is rewritten to (the chat column is narrower than this)
+DEFAULT_WIDTH = 960
+DEFAULT_QUALITY = 80
+HASH_LENGTH = 12
+
+RASTER_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+# raster formats are already compressed, gzip / brotli would not make them smaller
+COMPRESSIBLE_EXTENSIONS = {".svg"}
+IMAGE_EXTENSIONS = RASTER_EXTENSIONS | COMPRESSIBLE_EXTENSIONS
+
+# ![alt](url "title") in markdown and <img src="url"> in html
+IMAGE_REFERENCE = re.compile(r"(!\[[^\]]*\]\(\s*<?)([^)\s>]+)|(<img\b[^>]*?\bsrc\s*=\s*[\"'])([^\"']+)", re.IGNORECASE)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """a half-written file must never be served under an immutable name"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _encode_webp(image: Image.Image, width: int | None, quality: int) -> bytes:
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA", "P") else "RGB")
+    if width is not None:
+        image = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=quality, method=6)
+    return buffer.getvalue()
+
+
+def _precompress(path: str, data: bytes) -> list[str]:
+    """write .gz (and .br) next to path when they are smaller than the file itself"""
+    written = []
+    encoders = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append((".br", lambda raw: brotli.compress(raw, quality=11)))
+    for extension, compress in encoders:
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            if not os.path.exists(path + extension):
+                _write_atomic(path + extension, compressed)
+            written.append(os.path.basename(path) + extension)
+    return written
+
+
+def build_image_variants(
+    images_dir: str = IMAGES_DIR,
+    widths: tuple[int, ...] = DEFAULT_WIDTHS,
+    default_width: int = DEFAULT_WIDTH,
+    quality: int = DEFAULT_QUALITY,
+) -> dict:
+    """
+    generate the missing variants of every image and return the manifest:
+    { path relative to images_dir: { "hash", "width", "height", "bytes", "default", "default_bytes", "files" } }
+    "default" and "files" are relative to the variant directory
+    """
+    output_dir = os.path.join(images_dir, VARIANT_DIR)
+    manifest = {}
+    for root, dirs, files in os.walk(images_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != output_dir)
+        for filename in sorted(files):
+            stem, extension = os.path.splitext(filename)
+            extension = extension.lower()
+            if extension not in IMAGE_EXTENSIONS:
+                continue
+            source = os.path.join(root, filename)
+            relative = os.path.relpath(source, images_dir).replace(os.sep, "/")
+            target_dir = os.path.join(output_dir, os.path.dirname(relative))
+            prefix = os.path.dirname(relative) + "/" if os.path.dirname(relative) else ""
+            digest = file_hash(source)[:HASH_LENGTH]
+            with open(source, "rb") as f:
+                data = f.read()
+
+            # the original bytes under a hashed name
+            original = f"{stem}.{digest}{extension}"
+            if not os.path.exists(os.path.join(target_dir, original)):
+                _write_atomic(os.path.join(target_dir, original), data)
+            entry = {"hash": digest, "bytes": len(data), "width": None, "height": None,
+                     "default": prefix + original, "default_bytes": len(data), "files": [prefix + original]}
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                entry["files"] += [prefix + name for name in _precompress(os.path.join(target_dir, original), data)]
+
+            if extension in RASTER_EXTENSIONS:
+                with Image.open(source) as image:
+                    entry["width"], entry["height"] = image.width, image.height
+                    # animated images keep only the hashed original, WebP variants would drop the frames
+                    animated = getattr(image, "n_frames", 1) > 1
+                    if not animated:
+                        # the encoder settings are part of the name, so a different quality never reuses a file
+                        token = text_hash(f"{digest}:webp:{quality}")[:HASH_LENGTH]
+                        candidates = [(None, f"{stem}.{token}.webp")]
+                        candidates += [(width, f"{stem}.{token}.w{width}.webp") for width in sorted(set(widths)) if width < image.width]
+                        for width, name in candidates:
+                            path = os.path.join(target_dir, name)
+                            if not os.path.exists(path):
+                                _write_atomic(path, _encode_webp(image, width, quality))
+                            entry["files"].append(prefix + name)
+                        # the largest variant that is not wider than default_width
+                        fitting = [(width, name) for width, name in candidates[1:] if width <= default_width]
+                        default = max(fitting)[1] if image.width > default_width and fitting else candidates[0][1]
+                        if os.path.getsize(os.path.join(target_dir, default)) < len(data):
+                            entry["default"] = prefix + default
+                            entry["default_bytes"] = os.path.getsize(os.path.join(target_dir, default))
+            manifest[relative] = entry
+
+    _write_atomic(os.path.join(output_dir, "manifest.json"), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+
+def load_image_manifest(path: str = MANIFEST_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _resolve(url: str, manifest: dict) -> tuple[str, str] | None:
+    """(url prefix up to the static mount, manifest key) of a reference to a managed image"""
+    path = unquote(url.split("#", 1)[0].split("?", 1)[0])
+    if f"/{VARIANT_DIR}/" in path:
+        return None
+    mount = f"{IMAGE_URL_PREFIX.rstrip('/')}/"
+    if mount in path:
+        relative = path.split(mount, 1)[1]
+        if relative in manifest:
+            return url[:url.index(mount)] + mount.rstrip("/"), relative
+    # relative references such as images/foo.png or ../images/foo.png
+    if "images/" in path:
+        relative = path.rsplit("images/", 1)[1]
+        if relative in manifest:
+            return IMAGE_URL_PREFIX.rstrip("/"), relative
+    name = path.rsplit("/", 1)[-1]
+    if name in manifest:
+        return IMAGE_URL_PREFIX.rstrip("/"), name
+    return None
+
+
+def referenced_images(text: str, manifest: dict) -> list[str]:
+    """manifest keys of the managed images the text references"""
+    keys = []
+    for match in IMAGE_REFERENCE.finditer(text):
+        resolved = _resolve(match.group(2) or match.group(4), manifest)
+        if resolved is not None and resolved[1] not in keys:
+            keys.append(resolved[1])
+    return keys
+
+
+def rewrite_image_urls(text: str, manifest: dict) -> str:
+    """point every reference to a managed image at its default optimized variant"""
+    if not manifest:
+        return text
+
+    def replace(match: re.Match) -> str:
+        head, url = (match.group(1), match.group(2)) if match.group(2) else (match.group(3), match.group(4))
+        resolved = _resolve(url, manifest)
+        if resolved is None:
+            return match.group(0)
+        prefix, relative = resolved
+        return f"{head}{prefix}/{VARIANT_DIR}/{manifest[relative]['default']}"
+
+    return IMAGE_REFERENCE.sub(replace, text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate resized / WebP / precompressed variants of app/images")
+    parser.add_argument("--widths", default=",".join(map(str, DEFAULT_WIDTHS)), help="comma separated variant widths")
+    parser.add_argument("--default-width", type=int, default=DEFAULT_WIDTH, help="width chunk text is rewritten to")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="WebP quality")
+    args = parser.parse_args()
+
+    manifest = build_image_variants(
+        widths=tuple(int(width) for width in args.widths.split(",") if width),
+        default_width=args.default_width,
+        quality=args.quality,
+    )
+    print(f"{'image':<40} {'original KB':>12} {'served KB':>10} {'files':>6}")
+    for relative, entry in manifest.items():
+        print(f"{relative:<40} {entry['bytes'] / 1024:>12.1f} {entry['default_bytes'] / 1024:>10.1f} {len(entry['files']):>6}")
+    original = sum(entry["bytes"] for entry in manifest.values())
+    served = sum(entry["default_bytes"] for entry in manifest.values())
+    if original:
+        print(f"{len(manifest)} images, {served / original:.0%} of the original bytes per chat render.")
+    print(f"variants and manifest are in {OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import json
+import uuid
+import hashlib
+
+MANIFEST_VERSION = 1
+
+# namespace for deterministic point ids (uuid5 of "<file path>:<chunk hash>")
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c1a52-3f0e-4d0b-9a57-7b1f3c0b8e21")
+
+
+def file_hash(path: str) -> str:
+    """sha256 of the raw file content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """sha256 of a chunk's embedded content"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(path: str, chunk_hash: str) -> str:
+    """deterministic Qdrant point id for a chunk"""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{path}:{chunk_hash}"))
+
+
+class IngestManifest:
+    """
+    Persisted record of what is currently stored in the collection.
+
+    documents: { file path: { "hash": file sha256, "chunks": { point id: chunk sha256 } } }
+    profile: name of the collection profile the points are stored with (None in manifests written before profiles)
+    """
+
+    def __init__(self, path: str, collection: str | None = None, documents: dict | None = None, profile: str | None = None):
+        self.path = path
+        self.collection = collection
+        self.documents: dict[str, dict] = documents or {}
+        self.profile = profile
+
+    @classmethod
+    def load(cls, path: str) -> "IngestManifest":
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("manifest_version") != MANIFEST_VERSION:
+            print(f"manifest '{path}' has an unknown version, ignoring it.")
+            return cls(path)
+        return cls(path, collection=data.get("collection"), documents=data.get("documents", {}), profile=data.get("profile"))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self) -> None:
+        # write to a temporary file first so an interrupted run never leaves a broken manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"manifest_version": MANIFEST_VERSION, "collection": self.collection, "profile": self.profile, "documents": self.documents},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    def document_hash(self, path: str) -> str | None:
+        entry = self.documents.get(path)
+        return entry["hash"] if entry else None
+
+    def chunk_ids(self, path: str) -> set[str]:
+        entry = self.documents.get(path)
+        return set(entry["chunks"]) if entry else set()
+
+    def set_document(self, path: str, doc_hash: str, chunks: dict[str, str]) -> None:
+        self.documents[path] = {"hash": doc_hash, "chunks": chunks}
+
+    def remove_document(self, path: str) -> None:
+        self.documents.pop(path, None)
+
+    def diff(self, current_hashes: dict[str, str]) -> tuple[list[str], list[str]]:
+        """(changed or new files, deleted files) of current_hashes ({ file path: document hash }) against this manifest"""
+        changed = [path for path, digest in current_hashes.items() if self.document_hash(path) != digest]
+        deleted = [path for path in self.documents if path not in current_hashes]
+        return changed, deleted
+
+    def total_chunks(self) -> int:
+        return sum(len(entry["chunks"]) for entry in self.documents.values())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Prompt Cache Check Script
+スタブのキャッシュバックエンドと仮想時計を使って、システム指示のコンテキストキャッシュの
+作成・延長・期限切れ後の再作成と、リクエストごとの入力トークン数の削減をオフラインで確認するスクリプト
+
+使い方:
+    python3 prompt_cache_check.py [--minutes 180] [--interval 7] [--ttl 3600] [--min-tokens 0]
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from service.chat import SYSTEM_INSTRUCTION, LLM_MODEL_NAME  # noqa: E402
+from service.prompt_cache import PromptCache, StubCacheBackend  # noqa: E402
+
+# 動的な部分（質問・参考情報・履歴）の例
+SAMPLE_PROMPT = """
+# 質問
+ログイン方法を教えてください
+
+# 参考情報
+## 参考情報 1
+TUNAシステムにログインするには、トップページの「ログイン」ボタンを押し、IDとパスワードを入力します。
+
+# 過去の会話履歴
+（過去の会話はありません）
+
+上記の参考情報を基に、ユーザーの質問に対して有用で実践的な回答を提供してください。
+重要：参考情報が不十分または質問が不適切な場合は、必ず空文字列で応答してください。
+"""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def run(minutes: int, interval: int, ttl: int, min_tokens: int, idle_after: int) -> None:
+    clock = FakeClock()
+    backend = StubCacheBackend(min_tokens=min_tokens, clock=clock)
+    cache = PromptCache(backend, SYSTEM_INSTRUCTION, model=LLM_MODEL_NAME, ttl_seconds=ttl, clock=clock)
+
+    inline_tokens = backend.input_tokens(cache.inline_config(), SAMPLE_PROMPT)
+    cache.inline_requests = 0
+    total_tokens = 0
+    requests = 0
+    for minute in range(0, minutes, interval):
+        # 途中で長時間アクセスがない状態を作り、期限切れ後の再作成を確認する
+        clock.now = (minute + (idle_after if idle_after and minute >= idle_after else 0)) * 60
+        config = await cache.generation_config()
+        try:
+            tokens = backend.input_tokens(config, SAMPLE_PROMPT)
+        except Exception as e:
+            print(f"[{clock.now / 60:6.0f} min] generation failed ({e}), retrying inline")
+            cache.invalidate()
+            tokens = backend.input_tokens(cache.inline_config(), SAMPLE_PROMPT)
+        total_tokens += tokens
+        requests += 1
+        mode = "cached" if "cached_content" in config else "inline"
+        print(f"[{clock.now / 60:6.0f} min] {mode:<6} input tokens {tokens:5d} | {config.get('cached_content', '-')}")
+
+    stats = cache.stats()
+    print("\n=== summary ===")
+    for key in ("creates", "adopted", "refreshes", "failures", "cached_requests", "inline_requests", "static_tokens"):
+        print(f"{key}: {stats[key]}")
+    print(f"input tokens per request: {total_tokens / requests:.0f} (without cache: {inline_tokens})")
+    print(f"input tokens avoided: {inline_tokens * requests - total_tokens} / {inline_tokens * requests}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check the system instruction cache lifecycle offline")
+    parser.add_argument("--minutes", type=int, default=180, help="simulated duration")
+    parser.add_argument("--interval", type=int, default=7, help="minutes between requests")
+    parser.add_argument("--ttl", type=int, default=3600, help="cache TTL in seconds")
+    parser.add_argument("--min-tokens", type=int, default=0, help="reject caches smaller than this (like the real API)")
+    parser.add_argument("--idle-after", type=int, default=120, help="simulate 2 idle hours after this minute (0 to disable)")
+    args = parser.parse_args()
+    asyncio.run(run(args.minutes, args.interval, args.ttl, args.min_tokens, args.idle_after))
+
+
+if __name__ == "__main__":
+    main()
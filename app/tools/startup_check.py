@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Startup Check Script
+バックエンドを別プロセスで起動し、起動してから /healthz/live と /healthz/ready が 200 を返すまでの時間と、
+サーバーが記録した起動の各段階（import_app / redis / import_chat / chat_service）の時間を計測するスクリプト
+
+結果は bench_results/startup_<日時>_<コミット>.json に保存され、--compare で以前の結果との差を表示できる。
+Redis は必要（docker compose up -d）。CHAT_BACKEND=fake を指定すれば Gemini・Qdrant なしで計測できる。
+
+使い方:
+    python3 startup_check.py [--mode lazy] [--runs 3]
+    CHAT_BACKEND=fake python3 startup_check.py --mode eager --compare bench_results/startup_<以前の結果>.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+import httpx
+
+from bench_load import APP_DIR, RESULTS_DIR, free_port, git_commit
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float) -> float | None:
+    """
+    url が 200 を返すまで待ち、起動からの経過秒を返す（タイムアウト・異常終了時は None）
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return None
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def measure(mode: str, timeout: float) -> dict:
+    port = free_port()
+    env = {**os.environ, "STARTUP_MODE": mode}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        live = wait_for(f"{base_url}/healthz/live", process, timeout)
+        ready = wait_for(f"{base_url}/healthz/ready", process, timeout) if live is not None else None
+        if ready is None:
+            raise RuntimeError(f"server did not become ready within {timeout}s (exit code {process.poll()})")
+        server = httpx.get(f"{base_url}/healthz/ready", timeout=5.0).json()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        "live_s": round(live - start, 3),
+        "ready_s": round(ready - start, 3),
+        "server_timings": server["timings"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure time until the backend is live and ready")
+    parser.add_argument("--mode", choices=("eager", "lazy"), default=os.getenv("STARTUP_MODE", "eager"))
+    parser.add_argument("--runs", type=int, default=3, help="cold starts to measure (the median is reported)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args()
+
+    runs = []
+    for i in range(args.runs):
+        result = measure(args.mode, args.timeout)
+        print(f"run {i + 1}: live {result['live_s']:.2f}s, ready {result['ready_s']:.2f}s | "
+              + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result["server_timings"].items()))
+        runs.append(result)
+
+    def median(values: list[float]) -> float:
+        return round(sorted(values)[len(values) // 2], 3)
+
+    summary = {
+        "live_s": median([run["live_s"] for run in runs]),
+        "ready_s": median([run["ready_s"] for run in runs]),
+        **{name: median([run["server_timings"].get(name, 0.0) for run in runs]) for name in runs[0]["server_timings"]},
+    }
+    print("\n=== median ===")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+    for name, seconds in summary.items():
+        line = f"{name:<14} {seconds:8.3f}s"
+        if baseline and name in baseline:
+            line += f"   was {baseline[name]:8.3f}s ({seconds - baseline[name]:+.3f}s)"
+        print(line)
+
+    commit = git_commit()
+    output = os.path.join(RESULTS_DIR, f"startup_{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "mode": args.mode,
+            "chat_backend": os.getenv("CHAT_BACKEND", "gemini"),
+            "summary": summary,
+            "runs": runs,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import { api } from "@/lib/api-client";
+
+type ChatStreamRequest = {
+  session_id: string;
+  user_query: string;
+  onDelta: (text: string) => void;
+};
+
+const parseEvent = (block: string) => {
+  let event = "message";
+  let data = "";
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice("event:".length).trim();
+    } else if (line.startsWith("data:")) {
+      data += line.slice("data:".length).trim();
+    }
+  }
+  return { event, data: data ? JSON.parse(data) : {} };
+};
+
+export const createResponseStream = async ({
+  session_id,
+  user_query,
+  onDelta,
+}: ChatStreamRequest): Promise<string> => {
+  if (!session_id || !user_query) {
+    throw new Error("Session ID and user query are required.");
+  }
+
+  // axios はブラウザでレスポンスのストリーミングに対応していないため fetch を使用する
+  const response = await fetch(`${api.defaults.baseURL}/create/chat/stream`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      Accept: "text/event-stream",
+    },
+    body: JSON.stringify({ session_id: session_id, query: user_query }),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Failed to create chat stream: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder("utf-8");
+  let buffer = "";
+  let text = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const { event, data } = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      if (event === "error") {
+        throw new Error(data.detail);
+      }
+      if (event === "done") {
+        return data.response;
+      }
+      text += data.delta ?? "";
+      onDelta(text);
+    }
+  }
+  // done イベントが届く前に切断された場合は、途中までの回答を完了扱いにしない
+  throw new Error("Chat stream ended before the done event.");
+};
@@ -3,6 +3,7 @@ import { useSession } from "../../hooks/useSession";
 import { ChatContent } from "../chat_content/chat-content";
 import { QueryInput } from "../query_input/query-input";
 import type { chatHistory } from "../../types/chat-history";
+import { createResponseStream } from "../../api/create-response-stream";
 import styles from "./chat.module.css";
 
 export const Chat = () => {
@@ -11,18 +12,57 @@ export const Chat = () => {
   const [chatHistory, setChatHistory] = useState<chatHistory[]>([]);
   const { sessionId } = useSession();
 
+  // history はこの質問より前の会話（再送信では失敗した質問を除いた会話）
+  const sendQuery = async (query: string, history: chatHistory[]) => {
+    if (!sessionId || !query.trim()) {
+      console.error("Session ID or query is missing.");
+      return;
+    }
+
+    setChatHistory([...history, { userQuery: query, aiResponse: "" }]);
+
+    let partial = "";
+    try {
+      // 生成されたトークンを受け取るたびに回答を更新する
+      const response = await createResponseStream({
+        session_id: sessionId,
+        user_query: query,
+        onDelta: (text) => {
+          partial = text;
+          setChatHistory([...history, { userQuery: query, aiResponse: text }]);
+        },
+      });
+
+      setChatHistory([...history, { userQuery: query, aiResponse: response }]);
+    } catch (error) {
+      console.error("Error in createResponseStream:", error);
+      // 途中まで受け取った回答は残し、エラーと再送信ボタンを表示する
+      setChatHistory([
+        ...history,
+        {
+          userQuery: query,
+          aiResponse: partial,
+          error: "回答を取得できませんでした。時間をおいて再送信してください。",
+        },
+      ]);
+    }
+  };
+
+  const retryQuery = (index: number) => {
+    sendQuery(chatHistory[index].userQuery, chatHistory.slice(0, index));
+  };
+
   return (
     <div className={styles.chat_container}>
       <div className={styles.chat_content_wrapper}>
-        <ChatContent chatHistory={chatHistory} />
+        <ChatContent chatHistory={chatHistory} onRetry={retryQuery} />
       </div>
       <div className={styles.query_container_wrapper}>
         <QueryInput
           sessionId={sessionId}
           query={query}
           setQuery={setQuery}
-          chatHistory={chatHistory}
-          setChatHistory={setChatHistory}
+          onSend={(query) => sendQuery(query, chatHistory)}
         />
       </div>
     </div>
@@ -1,15 +1,20 @@
 import styles from "./chat-content.module.css";
 import { useEffect, useRef } from "react";
-import { UserChatMessage, AIChatMessage } from "../chat_message/chat-message";
+import {
+  UserChatMessage,
+  AIChatMessage,
+  ErrorChatMessage,
+} from "../chat_message/chat-message";
 import type { chatHistory } from "../../types/chat-history";
 import { Loading } from "../loading/loading";
 import { v4 as uuid } from "uuid";
 
 type Props = {
   chatHistory: chatHistory[];
+  onRetry: (index: number) => void;
 };
 
-export const ChatContent = ({ chatHistory }: Props) => {
+export const ChatContent = ({ chatHistory, onRetry }: Props) => {
   const chatContentRef = useRef<HTMLDivElement>(null);
   const prevChatHistoryLength = useRef(0);
 
@@ -27,14 +32,25 @@ export const ChatContent = ({ chatHistory }: Props) => {
   return (
     <div className={styles.chat_content} ref={chatContentRef}>
       {chatHistory &&
-        chatHistory.map((history) => {
+        chatHistory.map((history, index) => {
           return (
             <div className={styles.chat_message} key={uuid()}>
               <UserChatMessage content={history.userQuery} />
-              {history.aiResponse ? (
+              {history.aiResponse && (
                 <AIChatMessage content={history.aiResponse} />
+              )}
+              {history.error ? (
+                <ErrorChatMessage
+                  message={history.error}
+                  // 再送信できるのは最後の質問だけ（途中の質問を送り直すと以降の会話と順序が合わなくなる）
+                  onRetry={
+                    index === chatHistory.length - 1
+                      ? () => onRetry(index)
+                      : undefined
+                  }
+                />
               ) : (
-                <Loading />
+                !history.aiResponse && <Loading />
               )}
             </div>
           );
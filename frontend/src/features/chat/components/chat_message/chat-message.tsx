@@ -1,5 +1,6 @@
 import styles from "./chat-message.module.css";
 import { MarkdownRender } from "../markdown/markdown-render";
+import { IoReload } from "react-icons/io5";
 
 type ChatMessageProps = {
   content: string;
@@ -16,3 +17,22 @@ export const AIChatMessage = ({ content }: ChatMessageProps) => {
     </div>
   );
 };
+
+type ErrorChatMessageProps = {
+  message: string;
+  onRetry?: () => void;
+};
+
+export const ErrorChatMessage = ({ message, onRetry }: ErrorChatMessageProps) => {
+  return (
+    <div className={styles.error_chat_message} role="alert">
+      <span>{message}</span>
+      {onRetry && (
+        <button className={styles.retry_button} title="再送信" onClick={onRetry}>
+          <IoReload size="1rem" />
+          再送信
+        </button>
+      )}
+    </div>
+  );
+};
@@ -1,5 +1,3 @@
-import type { chatHistory } from "../../types/chat-history";
-import { createResponse } from "../../api/create-response";
 import styles from "./query-input.module.css";
 import { IoSend } from "react-icons/io5";
 import { useRef } from "react";
@@ -8,18 +6,13 @@ type Props = {
   sessionId: string | null;
   query: string;
   setQuery: (query: string) => void;
-  chatHistory: chatHistory[];
-  setChatHistory: (chatHistory: chatHistory[]) => void;
+  onSend: (query: string) => void;
 };
 
-export const QueryInput = ({
-  sessionId,
-  chatHistory,
-  setChatHistory,
-}: Props) => {
+export const QueryInput = ({ sessionId, onSend }: Props) => {
   const inputRef = useRef<HTMLTextAreaElement>(null);
 
-  const handleQuerySend = async () => {
+  const handleQuerySend = () => {
     const query = inputRef.current?.value || "";
 
     console.log("Query sent:", query);
@@ -28,23 +21,11 @@ export const QueryInput = ({
       return;
     }
 
-    const user_query = query;
-
     if (inputRef.current) {
       inputRef.current.value = "";
     }
 
-    setChatHistory([...chatHistory, { userQuery: query, aiResponse: "" }]);
-
-    const response = await createResponse({
-      session_id: sessionId,
-      user_query: user_query,
-    });
-
-    setChatHistory([
-      ...chatHistory,
-      { userQuery: query, aiResponse: response.response },
-    ]);
+    onSend(query);
   };
 
   const handleKeyDown = (e: React.KeyboardEvent<HTMLTextAreaElement>) => {
@@ -1,4 +1,6 @@
 export type chatHistory = {
   userQuery: string;
   aiResponse: string;
+  // 回答の取得に失敗した場合のメッセージ（aiResponse には途中まで受け取った回答が入る）
+  error?: string;
 };